@@ -8,18 +8,35 @@
 from __future__ import print_function
 import sys
 import dor
+from hubmonitools.snapshotServer import SnapshotClient, QueryException
 
 def main(): 
-    # Get command line arguments
-    if len(sys.argv) != 2:
-        print("Usage: %s CWD|all" % sys.argv[0])
+    # Get command line arguments; with -c, ask hubmoni first
+    args = sys.argv[1:]
+    cached = (len(args) > 0) and (args[0] == '-c')
+    if cached:
+        args = args[1:]
+    if len(args) != 1:
+        print("Usage: %s [-c] CWD|all" % sys.argv[0])
         sys.exit(0)
 
-    cwdArg = sys.argv[1].upper()
+    cwdArg = args[0].upper()
     if len(cwdArg) != 3:
-        print("Error: unknown CWD",sys.argv[1])
+        print("Error: unknown CWD",args[0])
         sys.exit(-1)
 
+    if cached:
+        try:
+            if cwdArg.lower() == "all":
+                states = SnapshotClient().states()
+            else:
+                states = SnapshotClient().states([cwdArg])
+            for cwd in sorted(states.keys()):
+                print(cwd,states[cwd])
+            return
+        except QueryException:
+            pass
+
     # DOR interface
     dorDriver = dor.DOR()
 
@@ -27,7 +44,7 @@ def main():
     doms = []
     # Parse which CWDs to check (only can be communicating DOMs)
     if cwdArg.lower() == "all":
-        doms = dorDriver.getCommunicatingDOMs()
+        doms = dorDriver.snapshot().getCommunicatingDOMs()
     else:
         dom = dorDriver.getDOM(cwdArg)        
         if dom is None:
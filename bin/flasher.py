@@ -28,7 +28,8 @@ class UnexpectedDOMResponse(Exception):
 class IceBoot(object):
     PROMPT = '> '
     def __init__(self, dom):
-        if dom.state() != "iceboot":
+        # Probe it now; a cached state could be out of date
+        if dom.state(maxAge=0) != "iceboot":
             raise InvalidDOMStateException('DOM %s is not in IceBoot!', dom.cwd())
         self.dom = dom
         self.dom.open()
@@ -36,8 +37,9 @@ class IceBoot(object):
     def send(self, s):
         self.dom.write(s+'\r')
 
-    def expect(self, s=None):
-        resp = self.dom.read().split('\r\n')
+    def expect(self, s=None, timeout=1.0):
+        resp = self.dom.read(timeout=timeout, prompt=IceBoot.PROMPT)
+        resp = resp.decode('latin-1').split('\r\n')
         if s is None:
             respOK = (resp[-1] == IceBoot.PROMPT) and (len(resp) == 2)
         else:
@@ -48,8 +50,8 @@ class IceBoot(object):
     
     def flasherSetup(self, brightness, width, mask, rate):    
         self.send("enableFB .")
-        time.sleep(1)
-        self.expect("0")
+        # Flasherboard power-up takes about a second
+        self.expect("0", timeout=5)
         self.send("%d setFBbrightness" % brightness)
         self.expect()
         self.send("%d setFBwidth" % width)
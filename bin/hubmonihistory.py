@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# hubmonihistory
+#
+# Print the sample history of one quantity for one DOM from the hubmoni
+# history file, e.g.
+#
+#   $ hubmonihistory.py 34B badpkt --since 12 --delta
+#
+
+from __future__ import print_function
+import sys
+import os
+import time
+import calendar
+from optparse import OptionParser
+
+import hubmonitools
+import hubmonitools.history
+
+HUBMONICONFIG = os.environ['HOME']+"/hubmoni.config"
+
+def parseTime(s):
+    """Parse a UTC time, YYYY-MM-DD[ HH:MM[:SS]], to UNIX seconds"""
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(s, fmt))
+        except ValueError:
+            pass
+    raise ValueError("can't parse time %s" % s)
+
+def main():
+    parser = OptionParser(usage="%prog [options] CWD QUANTITY\n" +
+                          "       %prog [options] --list")
+    parser.add_option("-c", "--config", dest="config_file",
+                      help="hubmoni configuration file", default=HUBMONICONFIG)
+    parser.add_option("-f", "--file", dest="history_file",
+                      help="history file (default from configuration)")
+    parser.add_option("-l", "--list", action="store_true", dest="list",
+                      help="list quantities and the time range stored", default=False)
+    parser.add_option("--since", type="float", dest="since",
+                      help="only show the last <#> hours")
+    parser.add_option("--start", dest="start", help="start time (UTC)")
+    parser.add_option("--stop", dest="stop", help="stop time (UTC)")
+    parser.add_option("-d", "--delta", action="store_true", dest="delta",
+                      help="show the change since the previous sample", default=False)
+    (options, args) = parser.parse_args()
+
+    if os.path.isfile(options.config_file):
+        config = hubmonitools.HubMoniConfig(options.config_file)
+    else:
+        config = hubmonitools.HubMoniConfig()
+    fname = options.history_file or config.HISTORY_FILE
+    if fname is None:
+        parser.error("no history file configured")
+
+    try:
+        store = hubmonitools.history.HistoryStore(fname, readonly=True)
+    except hubmonitools.history.HistoryException as e:
+        print("Error:", e)
+        sys.exit(-1)
+
+    if options.list:
+        idx = store.order()
+        print("%d of %d samples in %s" % (len(store), store.slots, fname))
+        if len(idx):
+            print("from %s to %s UTC" % (fmtTime(store.times[idx[0]]),
+                                         fmtTime(store.times[idx[-1]])))
+        print("quantities:", " ".join(store.quantities))
+        return
+
+    if len(args) != 2:
+        parser.error("need a CWD and a quantity")
+
+    start = stop = None
+    try:
+        if options.start:
+            start = parseTime(options.start)
+        if options.stop:
+            stop = parseTime(options.stop)
+    except ValueError as e:
+        parser.error(str(e))
+    if options.since is not None:
+        start = time.time() - options.since*3600
+
+    try:
+        times, values = store.query(args[0], args[1], start, stop)
+    except hubmonitools.history.HistoryException as e:
+        print("Error:", e)
+        sys.exit(-1)
+
+    prev = None
+    for t, v in zip(times, values):
+        if options.delta:
+            d = v - prev if prev is not None else float("nan")
+            prev = v
+            v = d
+        print("%s %s" % (fmtTime(t), v))
+
+def fmtTime(t):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# hubmonispool
+#
+# Inspect or replay the hubmoni record/alert spool.  The spool can only
+# be opened while hubmoni isn't using it.
+#
+
+from __future__ import print_function
+import sys
+import os
+import time
+import json
+from optparse import OptionParser
+
+import hubmonitools
+import hubmonitools.spool
+from hubmonitools.spool import ALERT
+
+HUBMONICONFIG = os.environ['HOME']+"/hubmoni.config"
+
+def main():
+    parser = OptionParser(usage="%prog [options] [list|dump|replay]")
+    parser.add_option("-c", "--config", dest="config_file",
+                      help="hubmoni configuration file", default=HUBMONICONFIG)
+    parser.add_option("-d", "--dir", dest="spool_dir",
+                      help="spool directory (default from configuration)")
+    parser.add_option("-r", "--rate", type="float", dest="rate",
+                      help="replay rate, messages per second")
+    (options, args) = parser.parse_args()
+
+    cmd = args and args[0] or "list"
+    if cmd not in ("list", "dump", "replay"):
+        parser.error("unknown command %s" % cmd)
+
+    if os.path.isfile(options.config_file):
+        config = hubmonitools.HubMoniConfig(options.config_file)
+    else:
+        config = hubmonitools.HubMoniConfig()
+    spoolDir = options.spool_dir or config.SPOOL_DIR
+    if spoolDir is None:
+        print("Error: no spool directory configured")
+        sys.exit(-1)
+    if not os.path.isdir(spoolDir):
+        print("Spool %s is empty" % spoolDir)
+        sys.exit(0)
+
+    try:
+        spool = hubmonitools.spool.Spool(spoolDir, maxBytes=config.SPOOL_MAX_BYTES)
+    except hubmonitools.spool.SpoolLockedException:
+        print("Error: spool %s is in use (is hubmoni running?)" % spoolDir)
+        sys.exit(-1)
+
+    try:
+        if cmd == "replay":
+            replay(spool, config, options.rate or config.SPOOL_REPLAY_RATE)
+        else:
+            show(spool, cmd == "dump")
+    finally:
+        spool.close()
+
+def show(spool, dump):
+    # Only needed to decode the entries
+    from hubmonitools.sender import decode
+
+    n = 0
+    nbytes = 0
+    for kind, buf in spool:
+        n += 1
+        nbytes += len(buf)
+        for msg in decode(buf):
+            if dump:
+                print(json.dumps(msg, sort_keys=True, indent=4, separators=(',', ': ')))
+            else:
+                print("%-6s %6dB %-28s %s" % ((kind == ALERT) and "alert" or "record",
+                                              len(buf), msg.get("varname"),
+                                              msg.get("time", msg.get("t", ""))))
+    print("%d spooled messages, %d bytes, in %s" % (n, nbytes, spool.directory))
+
+def replay(spool, config, rate):
+    import zmq
+
+    addr = "tcp://%s:%d" % (config.ZMQ_HOSTNAME, config.ZMQ_PORT)
+    s = zmq.Context.instance().socket(zmq.PUSH)
+    s.setsockopt(zmq.LINGER, 5000)
+    s.setsockopt(zmq.IMMEDIATE, 1)
+    s.connect(addr)
+
+    n = 0
+    entry = spool.peek()
+    while entry is not None:
+        if not s.poll(int(config.SOCKET_WAIT*1000), zmq.POLLOUT):
+            print("Error: couldn't send to ZMQ listener at %s; %d messages replayed" % (addr, n))
+            break
+        s.send(entry[1])
+        spool.ack()
+        n += 1
+        time.sleep(1.0/rate)
+        entry = spool.peek()
+    else:
+        print("Replayed %d messages to %s" % (n, addr))
+    s.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# simhub
+#
+# Run a synthetic DOR driver: a procfs-format tree and DOM devices for
+# hubmoni and the DOR tools to be pointed at, e.g.
+#
+#   $ simhub.py --cards 8 --mode 00A=iceboot --mode 01B=hung --fault-rate 0.001
+#
+# then set DOR_PREFIX and DOR_DEVPATH in the hubmoni configuration to the
+# printed directories.
+#
+
+from __future__ import print_function
+import sys
+import time
+import signal
+from optparse import OptionParser
+
+import dorsim
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-p", "--prefix", dest="prefix",
+                      help="proc tree directory (default a new one, on tmpfs if possible)")
+    parser.add_option("-d", "--devdir", dest="devdir",
+                      help="DOM device directory (default a new one)")
+    parser.add_option("-n", "--cards", dest="cards", type="int", default=8,
+                      help="number of DOR cards (default %default)")
+    parser.add_option("-m", "--mode", dest="modes", action="append", default=[],
+                      help="DOM mode, CWD=MODE with MODE one of " + ", ".join(dorsim.MODES))
+    parser.add_option("-s", "--step", dest="step", type="float", default=1.0,
+                      help="seconds between updates (default %default)")
+    parser.add_option("-f", "--fault-rate", dest="faultRate", type="float", default=0.0,
+                      help="random faults per wire pair per second (default %default)")
+    parser.add_option("--seed", dest="seed", type="int",
+                      help="random seed")
+    parser.add_option("--no-devices", action="store_false", dest="devices", default=True,
+                      help="don't emulate the DOM devices")
+    (options, args) = parser.parse_args()
+    if args or not (1 <= options.cards <= 8):
+        parser.print_help()
+        return 1
+
+    modes = {}
+    for m in options.modes:
+        cwd, sep, mode = m.partition("=")
+        if mode not in dorsim.MODES:
+            print("Unknown mode %s" % m, file=sys.stderr)
+            return 1
+        modes[cwd.upper()] = mode
+
+    hub = dorsim.SimHub(prefix=options.prefix, cards=options.cards, seed=options.seed,
+                        modes=modes, faultRate=options.faultRate)
+    emulator = None
+    if options.devices:
+        emulator = dorsim.DOMEmulator(hub, options.devdir)
+        emulator.start()
+
+    print("DOR_PREFIX  %s" % hub.prefix)
+    if emulator is not None:
+        print("DOR_DEVPATH %s" % emulator.devdir)
+    sys.stdout.flush()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(options.step)
+            hub.step(options.step)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if emulator is not None:
+            emulator.stop(timeout=1)
+        hub.cleanup()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
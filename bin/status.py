@@ -10,6 +10,7 @@ from __future__ import print_function
 import sys
 import dor
 from hubmonitools import hubConfig
+from hubmonitools.snapshotServer import SnapshotClient, QueryException
 
 #-----------------------------------------------------------
 
@@ -26,11 +27,15 @@ class DOMSummary(dict):
         else:
             self['Stat'] = ''
         self['Pos'] = dom.omkey()
-        self['Name'] = dom.name()
-        self['MBID'] = dom.mbid()
-        self['DOMID'] = dom.prodID()
-        self['Curr'] = str(dom.pair.current())+" mA"
-        self['Volts'] = str(int(dom.pair.voltage()+0.5))+"V"
+        # Unknown IDs and values missing from a partial snapshot are
+        # shown as "-"
+        self['Name'] = dom.name() or "-"
+        self['MBID'] = dom.mbid() or "-"
+        self['DOMID'] = dom.prodID() or "-"
+        current = dom.pair.current()
+        voltage = dom.pair.voltage()
+        self['Curr'] = (current is not None) and str(current)+" mA" or "-"
+        self['Volts'] = (voltage is not None) and str(int(voltage+0.5))+"V" or "-"
         if state is not None:
             self['State'] = state
 
@@ -74,9 +79,10 @@ class DOMSummary(dict):
 
 #-----------------------------------------------------------
 
-dorDriver = dor.DOR()
-
-quick = (len(sys.argv) > 1) and (sys.argv[1] == '-q')
+# -q: don't probe DOM states
+# -c: answer from hubmoni's latest snapshot and DOM states, if it's running
+quick = '-q' in sys.argv[1:]
+cached = '-c' in sys.argv[1:]
 
 # Header info
 #-------------------------------------------------------------------------------
@@ -87,16 +93,39 @@ print("-"*80)
 print("%s SUMMARY:\n" % host.upper())
 
 
+# Read the procfile tree once for all of the summaries, or get it from hubmoni
+snapshot = None
+client = None
+if cached:
+    client = SnapshotClient()
+    try:
+        snapshot, age = client.snapshot()
+        print("(from hubmoni, %d s old)\n" % age)
+    except QueryException:
+        client = None
+dorDriver = None
+if snapshot is None:
+    dorDriver = dor.DOR()
+    snapshot = dorDriver.snapshot()
+
 states = None
-doms = dorDriver.getPluggedDOMs()
+doms = snapshot.getPluggedDOMs()
 if not quick:
-    states = dorDriver.getDOMStates(doms)
+    if client is not None:
+        try:
+            states = client.states([dom.cwd() for dom in doms])
+        except QueryException:
+            pass
+    if states is None:
+        if dorDriver is None:
+            dorDriver = dor.DOR()
+        states = dorDriver.getDOMStates(doms)
 
 # Get the DOM summaries
 summaries = []
 for dom in doms:
     if not quick:
-        summary = DOMSummary(dom, state=states[dom.cwd()])
+        summary = DOMSummary(dom, state=states.get(dom.cwd(), "unknown"))
     else:
         summary = DOMSummary(dom)
     summaries.append(summary)
@@ -110,7 +139,7 @@ for summary in sorted(summaries):
     print(summary)
 
 # Print a summary line
-countStr = "communicating %d DOMs; " % len(dorDriver.getCommunicatingDOMs())
+countStr = "communicating %d DOMs; " % len(snapshot.getCommunicatingDOMs())
 if not quick:
     for state in set(states.values()):
         cnt = len([cwd for cwd in states if states[cwd] == state])
@@ -1,2 +1,6 @@
 from __future__ import absolute_import
 from .dor import DOR, Card, WirePair, DOM, PwrCheck, CommStats
+from .dor import InvalidPwrCheckException, InvalidComstatException
+from .dor import DOMStateProber, DOMStateCache
+from .dor import TimedProcReader, ProcReadTimeout, ProcReadDeferred
+from .snapshot import HubSnapshot, CardSnapshot, PairSnapshot, DOMSnapshot
@@ -10,10 +10,19 @@ import string
 import re
 import subprocess
 import signal
+import datetime
+import select
+import errno
+import time
 import threading
-from time import sleep
+import collections
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import nicknames
+from .snapshot import HubSnapshot, CardSnapshot, PairSnapshot, DOMSnapshot
 
 MAXCARDS = 8
 MAXPAIRS = 4
@@ -22,48 +31,603 @@ DOMLABELS = ['A', 'B']
 DEVPATH = "/dev"
 DEV_BLOCKSIZE = 4092
 
+# Device read deadline, and how long a reply must be quiet before we
+# consider it complete when no other termination condition is given,
+# in seconds
+DEV_READ_TIMEOUT = 1.0
+DEV_READ_IDLE = 0.1
+
+# Overall deadline for probing DOM states, and how long to wait for a
+# domapp ID reply before trying for an iceboot/configboot prompt, in seconds
+PROBE_TIMEOUT = 3.0
+PROBE_REPLY_WAIT = 0.2
+
+# How long a probed DOM state is trusted while the DOM's proc indicators
+# stay the same, in seconds
+STATE_CACHE_TTL = 300
+
+# Probe results worth keeping; anything else is probed again next time
+CACHED_STATES = ("domapp", "iceboot", "configboot")
+
 DOMAPP_REQUEST_ID  = bytearray(b'\x01\x0a\x00\x00\x0d\x0a\x00\x00')
 DOMAPP_ID_RESPONSE = bytearray(b'\x01\x0a\x00\x0c\x0d\x0a\x00\x01')
 DOMAPP_ID_RESPONSE_LEN = 20
 
+CURRENT_PAT = re.compile(r".+ current is (\d+) mA")
+VOLTAGE_PAT = re.compile(r".+ voltage is ([0-9.]+) Volts")
+MBID_PAT = re.compile(r".+ ID is ([0-9a-f]+)")
+SERIAL_PAT = re.compile(r"Serial number: (\S+)")
+
+# Monotonic clock for deadlines, where available
+monotonic = getattr(time, "monotonic", time.time)
+
+# Proc files read every sample, which are kept open and re-read in place
+HOT_PROC_FILES = frozenset(("comstat", "current", "voltage", "pwr_check",
+                            "is-communicating", "is-plugged"))
+# Most proc files to keep open, and the initial read buffer size
+PROC_POOL_SIZE = 512
+PROC_BUFSIZE = 4096
+
+# Default per-file time limit for timed proc reads, in seconds, and the
+# most worker threads to read them with
+PROC_READ_TIMEOUT = 2.0
+PROC_READ_WORKERS = 4
+
+#--------------------------------------------------------------------------
+# Procfile access and parsing, shared by the driver classes and snapshots
+
+if hasattr(os, "preadv"):
+    def preadInto(fd, buf):
+        return os.preadv(fd, [buf], 0)
+else:
+    def preadInto(fd, buf):
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = os.read(fd, len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+class PooledFile(object):
+    """An open proc file in a ProcFilePool, with the number of readers
+    currently using it"""
+    __slots__ = ('fd', 'users', 'removed')
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.users = 0
+        # Taken out of the pool; closed once the last reader is done
+        self.removed = False
+
+class ProcFilePool(object):
+    """Keeps proc files open and re-reads them from offset 0 into a
+    reusable buffer, so each read is one syscall instead of an open,
+    read, and close.  Reads are positional, so threads can share the
+    open files.  If a read fails or comes back empty, e.g. because the
+    driver was reloaded and the open file no longer refers to a live
+    proc entry, the file is reopened and read once more.
+
+    When the pool is full the least recently used file is evicted.  A
+    file is never closed while a reader holds it, since its descriptor
+    number could be reused for another file under the reader."""
+
+    def __init__(self, maxFiles=PROC_POOL_SIZE, bufSize=PROC_BUFSIZE):
+        self.maxFiles = maxFiles
+        self.bufSize = bufSize
+        # Path -> PooledFile, least recently used first
+        self.fds = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Number of files opened, for statistics
+        self.opens = 0
+
+    def __len__(self):
+        return len(self.fds)
+
+    def acquire(self, path):
+        """Return the PooledFile for path, opening it if need be; the
+        caller must release() it when done reading"""
+        with self.lock:
+            f = self.fds.pop(path, None)
+            if f is not None:
+                f.users += 1
+                self.fds[path] = f
+                return f
+        # Opening can block (e.g. on a hung driver), so not under the lock
+        fd = os.open(path, os.O_RDONLY)
+        with self.lock:
+            f = self.fds.pop(path, None)
+            if f is not None:
+                os.close(fd)
+            else:
+                f = PooledFile(fd)
+                while len(self.fds) >= self.maxFiles:
+                    self._remove(next(iter(self.fds)))
+                self.opens += 1
+            f.users += 1
+            self.fds[path] = f
+        return f
+
+    def release(self, f):
+        with self.lock:
+            f.users -= 1
+            if f.removed and f.users == 0:
+                self._closeFile(f)
+
+    def _closeFile(self, f):
+        try:
+            os.close(f.fd)
+        except OSError:
+            pass
+
+    def _remove(self, path):
+        f = self.fds.pop(path, None)
+        if f is not None:
+            f.removed = True
+            if f.users == 0:
+                self._closeFile(f)
+
+    def close(self, prefix=""):
+        """Close all open files, or those whose paths start with prefix;
+        files being read are closed when their readers are done"""
+        with self.lock:
+            for path in [p for p in self.fds if p.startswith(prefix)]:
+                self._remove(path)
+
+    def discard(self, path, f=None):
+        """Close a file; if f is given, only if it is still the open one"""
+        with self.lock:
+            if (f is None) or (self.fds.get(path) is f):
+                self._remove(path)
+
+    def pread(self, fd):
+        buf = getattr(self.local, "buf", None)
+        if buf is None:
+            buf = self.local.buf = bytearray(self.bufSize)
+        while True:
+            n = preadInto(fd, buf)
+            # Proc files come back in a single read if they fit
+            if n < len(buf):
+                return bytes(buf[:n])
+            buf = self.local.buf = bytearray(2*len(buf))
+
+    def read(self, path):
+        """Return the contents of a proc file, as readProcFile does"""
+        for retry in (False, True):
+            try:
+                f = self.acquire(path)
+            except OSError as e:
+                if retry or e.errno in (errno.ENOENT, errno.EACCES):
+                    raise IOError(e.errno, e.strerror, path)
+                continue
+            try:
+                data = self.pread(f.fd)
+            except OSError as e:
+                self.discard(path, f)
+                if retry:
+                    raise IOError(e.errno, e.strerror, path)
+                continue
+            finally:
+                self.release(f)
+            if data or retry:
+                return data.decode("utf-8", "replace")
+            self.discard(path, f)
+
+# Shared pool for the hot proc files; None opens and closes every file
+procFiles = ProcFilePool()
+
+def readProcFile(path):
+    if (procFiles is not None) and (os.path.basename(path) in HOT_PROC_FILES):
+        return procFiles.read(path)
+    with open(path) as f:
+        return f.read()
+
+class ProcReadTimeout(IOError):
+    pass
+
+class ProcReadDeferred(ProcReadTimeout):
+    """A timed read that never started, because the workers were all busy
+    or the time ran out first; not a sign of trouble with the file"""
+    pass
+
+class ProcReadJob(object):
+    def __init__(self, path):
+        self.path = path
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.started = False
+        self.abandoned = False
+
+class TimedProcReader(object):
+    """Reads proc files on a few worker threads, so a read that blocks in
+    the driver costs the caller at most its time limit.  A blocked read
+    can't be interrupted: its worker is left to finish on its own, and
+    reads of the same file fail at once until it does.  Timeouts are
+    counted per file.  Reads that time out before a worker picks them
+    up raise ProcReadDeferred instead, and aren't counted."""
+
+    def __init__(self, timeout=PROC_READ_TIMEOUT, maxWorkers=PROC_READ_WORKERS):
+        self.timeout = timeout
+        self.maxWorkers = maxWorkers
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.idle = 0
+        # Files with an abandoned read still outstanding
+        self.stuck = set()
+        # Number of timeouts for each file
+        self.timeouts = { }
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.idle -= 1
+                # Reads given up on before they started are dropped
+                job.started = not job.abandoned
+            if job.started:
+                try:
+                    job.result = readProcFile(job.path)
+                except Exception as e:
+                    job.error = e
+            with self.lock:
+                self.idle += 1
+                if job.abandoned and job.started:
+                    self.stuck.discard(job.path)
+                job.done.set()
+
+    def timedOut(self, path):
+        self.timeouts[path] = self.timeouts.get(path, 0) + 1
+        return ProcReadTimeout(errno.ETIMEDOUT, "proc read timed out", path)
+
+    def read(self, path, timeout=None, deadline=None):
+        """Return the contents of a proc file, as readProcFile does, or
+        raise ProcReadTimeout after timeout seconds (default self.timeout)
+        or at the monotonic() deadline, whichever comes first"""
+        if timeout is None:
+            timeout = self.timeout
+        if deadline is not None:
+            left = deadline - monotonic()
+            timeout = left if timeout is None else min(timeout, left)
+        job = ProcReadJob(path)
+        with self.lock:
+            if path in self.stuck:
+                raise self.timedOut(path)
+            if (timeout is not None) and (timeout <= 0):
+                raise ProcReadDeferred(errno.ETIMEDOUT, "proc read not started", path)
+            if (self.idle == 0) and (self.workers < self.maxWorkers):
+                t = threading.Thread(target=self.work, name="procread%d" % self.workers)
+                t.daemon = True
+                t.start()
+                self.workers += 1
+                self.idle += 1
+        self.jobs.put(job)
+        if not job.done.wait(timeout):
+            with self.lock:
+                if not job.done.is_set():
+                    job.abandoned = True
+                    if not job.started:
+                        raise ProcReadDeferred(errno.ETIMEDOUT, "proc read not started",
+                                               path)
+                    self.stuck.add(path)
+                    raise self.timedOut(path)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+def listProcDir(path):
+    try:
+        return set(os.listdir(path))
+    except OSError:
+        return set()
+
+def parseCurrent(txt):
+    m = CURRENT_PAT.match(txt)
+    if m is None: return -1
+    return int(m.group(1))
+
+def parseVoltage(txt):
+    m = VOLTAGE_PAT.match(txt)
+    if m is None: return -1
+    return float(m.group(1))
+
+def parsePlugged(txt):
+    return (len(txt) > 0) and (txt.find("not") < 0)
+
+def parseCommunicating(txt):
+    return (len(txt) > 0) and (txt.find("NOT") < 0)
+
+def parseNotConfigboot(txt):
+    return (len(txt) > 0) and (txt.find("is out") >= 0)
+
+def parsePowered(txt):
+    return (txt.find("on") >= 0)
+
+def parsePwrCheck(txt):
+    return PwrCheck(txt.rstrip())
+
+def parseMBID(txt):
+    m = MBID_PAT.match(txt)
+    if m is not None:
+        return m.group(1)
+
+def validMBID(mbid):
+    """A DOM in configboot, or still booting, reports an all-zero ID"""
+    return (mbid is not None) and (mbid.strip("0") != "")
+
+def parseSerial(txt):
+    m = SERIAL_PAT.match(txt)
+    if m is None: return ""
+    return m.group(1)
+
 #--------------------------------------------------------------------------
 
-class DOMStateThread(threading.Thread):
+def domIndicators(dom):
+    """The proc values that tell us about a DOM's state without talking to
+    it, or None if they can't be read.  Any traffic to or from the DOM
+    changes the message counts, and a reboot the connect count."""
+    try:
+        if not dom.isCommunicating():
+            return (False,)
+        cs = dom.commStats()
+        if cs is None:
+            return None
+        return (True, dom.isNotConfigboot(), cs.open, cs.connected, cs.nconnects,
+                cs.rxmsgs, cs.txmsgs)
+    except (IOError, InvalidComstatException):
+        return None
+
+def inferState(indicators):
+    """DOM state from its proc indicators alone, or None if it takes a
+    probe: not communicating, in configboot, or busy because someone else
+    has the device open and probing would disturb their session"""
+    if indicators is None:
+        return None
+    if not indicators[0]:
+        return "nocomm"
+    if indicators[1] is False:
+        return "configboot"
+    if indicators[2]:
+        return "busy"
+    return None
+
+class DOMStateCache(object):
+    """Probed DOM states, reused while they are younger than the TTL and
+    the DOM's proc indicators haven't changed since the probe"""
+
+    def __init__(self, ttl=STATE_CACHE_TTL, clock=monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        # CWD -> (time, indicators, state)
+        self.states = { }
+
+    def get(self, cwd, indicators, maxAge=None):
+        entry = self.states.get(cwd)
+        if (entry is None) or (indicators is None):
+            return None
+        if maxAge is None or maxAge > self.ttl:
+            maxAge = self.ttl
+        elif maxAge <= 0:
+            return None
+        t, cachedIndicators, state = entry
+        if (self.clock() - t > maxAge) or (cachedIndicators != indicators):
+            del self.states[cwd]
+            return None
+        return state
+
+    def put(self, cwd, indicators, state):
+        if (indicators is None) or (state not in CACHED_STATES):
+            self.states.pop(cwd, None)
+        else:
+            self.states[cwd] = (self.clock(), indicators, state)
+
+    def invalidate(self, cwd=None):
+        if cwd is None:
+            self.states.clear()
+        else:
+            self.states.pop(cwd, None)
+
+class DOMProbe(object):
+    """Per-DOM state of a DOMStateProber conversation"""
+    # Phases: waiting for the domapp ID reply, then for a boot prompt
+    DOMAPP, PROMPT = range(2)
+
     def __init__(self, dom):
-        threading.Thread.__init__(self)
         self.dom = dom
-        self.state = "busy"
-
-    def __str__(self):
-        return self.dom.cwd()+" "+self.state
+        self.phase = DOMProbe.DOMAPP
+        self.buf = b""
+        self.last = None
+        self.state = None
+
+class DOMStateProber(object):
+    """Probe the state of a set of DOMs from a single thread.  The domapp
+    ID request goes out to every DOM at once, replies are classified as
+    they arrive, and one global deadline bounds the whole probe; DOMs that
+    haven't answered by then are reported as busy."""
+
+    def __init__(self, doms, timeout=PROBE_TIMEOUT, replyWait=PROBE_REPLY_WAIT,
+                 idle=DEV_READ_IDLE):
+        self.doms = doms
+        self.timeout = timeout
+        self.replyWait = replyWait
+        self.idle = idle
 
     def run(self):
-        self.state = self.dom.state()
+        """Returns a dict of states keyed by CWD"""
+        states = {}
+        probes = {}
+        poller = select.poll()
+        try:
+            for dom in self.doms:
+                if not dom.isCommunicating():
+                    states[dom.cwd()] = "nocomm"
+                    continue
+                dom.open()
+                if dom.f is None:
+                    states[dom.cwd()] = "error"
+                    continue
+                p = DOMProbe(dom)
+                probes[dom.f] = p
+                poller.register(dom.f, select.POLLIN)
+                self._send(p, DOMAPP_REQUEST_ID)
+
+            deadline = monotonic() + self.timeout
+            pending = list(probes.values())
+            while pending:
+                # DOMs are let go of as soon as their state is known
+                for p in pending:
+                    if p.state is not None:
+                        self._finish(poller, p)
+                pending = [p for p in pending if p.state is None]
+                now = monotonic()
+                if (not pending) or (now >= deadline):
+                    break
+                wait = min([deadline] + [self._timer(p) for p in pending]) - now
+                for fd, event in poller.poll(max(0, int(wait*1000)+1)):
+                    self._receive(probes[fd])
+                now = monotonic()
+                for p in pending:
+                    if (p.state is None) and (now >= self._timer(p)):
+                        self._expire(p)
+
+            for p in probes.values():
+                states[p.dom.cwd()] = p.state or "busy"
+        finally:
+            for p in probes.values():
+                p.dom.close()
+        return states
+
+    def _finish(self, poller, p):
+        if p.dom.f is not None:
+            poller.unregister(p.dom.f)
+            p.dom.close()
+
+    def _send(self, p, msg):
+        try:
+            p.dom.write(msg)
+        except OSError:
+            p.state = "error"
+        p.last = monotonic()
+
+    def _timer(self, p):
+        """Time at which a quiet DOM moves on to the next step"""
+        if p.buf:
+            return p.last + self.idle
+        if p.phase == DOMProbe.DOMAPP:
+            return p.last + self.replyWait
+        return p.last + self.timeout
+
+    def _receive(self, p):
+        if p.state is not None:
+            return
+        try:
+            chunk = os.read(p.dom.f, DEV_BLOCKSIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            chunk = b""
+        if not chunk:
+            p.state = "unknown"
+            return
+        p.buf += chunk
+        p.last = monotonic()
+        if p.phase == DOMProbe.DOMAPP:
+            if len(p.buf) >= DOMAPP_ID_RESPONSE_LEN:
+                if (len(p.buf) == DOMAPP_ID_RESPONSE_LEN) and \
+                        (bytearray(p.buf[0:8]) == DOMAPP_ID_RESPONSE):
+                    p.state = "domapp"
+                else:
+                    self._expire(p)
+        elif b"> " in p.buf:
+            p.state = "iceboot"
+        elif b"# " in p.buf:
+            p.state = "configboot"
+
+    def _expire(self, p):
+        if p.phase == DOMProbe.DOMAPP:
+            # Not domapp; now check for iceboot / configboot
+            p.phase = DOMProbe.PROMPT
+            p.buf = b""
+            self._send(p, b'\r')
+        else:
+            p.state = "unknown"
 
 #--------------------------------------------------------------------------
 
 class DOR:
+    """DOR driver interface.  The card/pair/DOM topology is scanned once
+    and cached; it is rescanned when invalidate() is called or when the
+    driver revision or the list of cards changes underneath us."""
 
-    def __init__(self, prefix=os.path.join("/", "proc", "driver", "domhub")):
+    def __init__(self, prefix=os.path.join("/", "proc", "driver", "domhub"), devpath=None):
         self.prefix = prefix
+        # Directory of the DOM devices; None means DEVPATH
+        self.devpath = devpath
         self.nicks = nicknames.Nicknames()
+        # Sampling epoch for proc file caching; None means no caching
+        self.epoch = None
+        # Worker threads for timed proc reads, created on first use
+        self.reader = None
+        # Files the last timed snapshot didn't get to, read first next time
+        self.deferred = []
+        # Probed DOM states
+        self.stateCache = DOMStateCache()
         self.scan()
 
     def __getitem__(self, key):
-        for p in self.cards:
-            if p.id == key:
-                return p
-        return None
+        if self._topologyKey is None:
+            self.scan()
+        return self._cardMap.get(key)
             
     def path(self):
         return self.prefix
 
     def scan(self):
+        """Rebuild the cached card/pair/DOM topology"""
+        self._topologyKey = self.topologyKey()
+        if procFiles is not None:
+            procFiles.close(self.prefix)
         self.cards = [ ]
+        entries = listProcDir(self.prefix)
         for i in range(MAXCARDS):
-            c = Card(i, self)
-            if os.path.exists(c.path()):
-                self.cards.append(c)
+            if ("card%d" % i) in entries:
+                self.cards.append(Card(i, self))
+        self._cardMap = dict((c.id, c) for c in self.cards)
+        self._doms = [d for c in self.cards
+                      for w in c.pairs
+                      for d in w.doms]
+
+    def topologyKey(self):
+        """Cheap fingerprint of the driver tree: revision and card list"""
+        try:
+            rev = readProcFile(os.path.join(self.prefix, "revision"))
+        except IOError:
+            rev = None
+        return (rev, tuple(sorted(listProcDir(self.prefix))))
+
+    def invalidate(self):
+        """Force a rescan of the topology on the next query"""
+        self._topologyKey = None
+
+    def refresh(self):
+        """Rescan the topology if it has been invalidated or has changed.
+        Returns True if a rescan was done."""
+        if (self._topologyKey is None) or (self.topologyKey() != self._topologyKey):
+            self.scan()
+            return True
+        return False
+
+    def newEpoch(self):
+        """Start a new sampling epoch, turning on proc file caching: until
+        the next epoch, each proc file is read at most once.  Static values
+        (card serial and revision, and the mainboard ID of DOMs out of
+        configboot) are cached until the topology is rescanned, or for the
+        ID, until the DOM reconnects."""
+        self.epoch = (self.epoch or 0) + 1
+        return self.epoch
+
+    def endEpoch(self):
+        """Turn off proc file caching"""
+        self.epoch = None
 
     def getDOM(self, cwd):
         try:
@@ -82,10 +646,8 @@ class DOR:
                 for dom in DOMLABELS]
 
     def getAllDOMs(self):
-        self.scan()
-        return [d for c in self.cards
-                for w in c.pairs
-                for d in w.doms]
+        self.refresh()
+        return list(self._doms)
 
     def getPluggedDOMs(self):
         try:
@@ -101,154 +663,346 @@ class DOR:
             doms = []
         return doms
 
-    def getDOMStates(self, doms):
-        s = {}
-        # Create threads for each DOM to check
-        threads = []
-        for dom in doms:
-            t = DOMStateThread(dom)
-            t.start()
-            threads.append(t)
-
-         # Join, but using a timeout for busy DOMs
-        for t in threads:
-            t.join(3)
-            s[t.dom.cwd()] = t.state
+    def timedReader(self):
+        """The driver's TimedProcReader, created on first use"""
+        if self.reader is None:
+            self.reader = TimedProcReader()
+        return self.reader
+
+    def readTimeouts(self):
+        """Number of timed proc reads that timed out, by path"""
+        if self.reader is None:
+            return { }
+        return dict(self.reader.timeouts)
+
+    def snapshot(self, timeout=None, budget=None):
+        """Walk the procfile tree once and return an immutable HubSnapshot.
+        Power values are read only for plugged pairs, and the ID and
+        comstats only for communicating DOMs.
+
+        If timeout (seconds per file) or budget (seconds for the whole
+        walk) is given, files are read on worker threads, and any file
+        that times out or can't be read or parsed is left out: the
+        snapshot is partial, with the affected values None and listed as
+        missing, instead of blocking or failing as a whole.  Files that
+        weren't read at all, because the budget ran out or the workers
+        were all stuck, are listed as deferred instead, and are read
+        first by the next timed snapshot.
+
+        While a sampling epoch is open, static values (card serials and
+        mainboard IDs) come from the live objects' cache, so they are read
+        once per topology rather than once per snapshot.  As for the live
+        objects, an ID is only kept once it is valid and the DOM is out of
+        configboot, and is dropped when the DOM reconnects; the topology
+        is rescanned first if the driver has changed."""
+        self.refresh()
+        now = datetime.datetime.utcnow().__str__()
+        entries = listProcDir(self.prefix)
+
+        timed = (timeout is not None) or (budget is not None)
+        if timed:
+            reader = self.timedReader()
+            deadline = (budget is not None) and monotonic() + budget or None
+        missing = []
+        deferred = []
+        # Files deferred last time, read ahead of the walk
+        early = { }
+        if timed:
+            for rel in self.deferred:
+                path = os.path.join(self.prefix, rel)
+                try:
+                    early[path] = reader.read(path, timeout, deadline)
+                except ProcReadDeferred:
+                    pass
+                except EnvironmentError as e:
+                    early[path] = e
+        def read(path, parse, nodeMissing):
+            if not timed:
+                return parse(readProcFile(path))
+            try:
+                txt = early.pop(path, None)
+                if isinstance(txt, EnvironmentError):
+                    raise txt
+                if txt is None:
+                    txt = reader.read(path, timeout, deadline)
+                return parse(txt)
+            except ProcReadDeferred:
+                nodeMissing.append(os.path.basename(path))
+                deferred.append(os.path.relpath(path, self.prefix))
+                return None
+            except (EnvironmentError, InvalidComstatException, InvalidPwrCheckException):
+                nodeMissing.append(os.path.basename(path))
+                missing.append(os.path.relpath(path, self.prefix))
+                return None
+        def readStatic(node, path, parse, nodeMissing, keep=None):
+            if (self.epoch is None) or (node is None):
+                return read(path, parse, nodeMissing)
+            fname = os.path.basename(path)
+            cached = node._cache.get(fname)
+            if (cached is not None) and (cached[0] in (self.epoch, ProcNode.STATIC)):
+                return cached[1]
+            val = read(path, parse, nodeMissing)
+            if (val is not None) and ((keep is None) or keep(val)):
+                node._cache[fname] = (ProcNode.STATIC, val)
+            return val
+
+        cards = []
+        for c in range(MAXCARDS):
+            cname = "card%d" % c
+            if cname not in entries:
+                continue
+            cpath = os.path.join(self.prefix, cname)
+            cardEntries = set(os.listdir(cpath))
+            try:
+                serial = readStatic(self[c], os.path.join(cpath, "test-log"), parseSerial, [])
+            except IOError:
+                serial = ""
+            if serial is None:
+                serial = ""
+            pairs = []
+            for w in range(MAXPAIRS):
+                pname = "pair%d" % w
+                if pname not in cardEntries:
+                    continue
+                wpath = os.path.join(cpath, pname)
+                pairEntries = set(os.listdir(wpath))
+                pairMissing = []
+                plugged = read(os.path.join(wpath, "is-plugged"), parsePlugged, pairMissing)
+                current = voltage = pwrcheck = None
+                if plugged:
+                    current = read(os.path.join(wpath, "current"), parseCurrent, pairMissing)
+                    voltage = read(os.path.join(wpath, "voltage"), parseVoltage, pairMissing)
+                    pwrcheck = read(os.path.join(wpath, "pwr_check"), parsePwrCheck,
+                                    pairMissing)
+                doms = []
+                for d in DOMLABELS:
+                    dname = "dom"+d
+                    if dname not in pairEntries:
+                        continue
+                    dpath = os.path.join(wpath, dname)
+                    domMissing = []
+                    comm = read(os.path.join(dpath, "is-communicating"), parseCommunicating,
+                                domMissing)
+                    notConfigboot = mbid = comstat = None
+                    if comm:
+                        notConfigboot = read(os.path.join(dpath, "is-not-configboot"),
+                                             parseNotConfigboot, domMissing)
+                        comstat = read(os.path.join(dpath, "comstat"), CommStats, domMissing)
+                    live = self.getDOM("%d%d%s" % (c, w, d))
+                    if live is not None:
+                        nconnects = comstat.nconnects if comstat is not None else None
+                        live.noteConnection(comm, nconnects)
+                    if comm:
+                        mbid = readStatic(live, os.path.join(dpath, "id"), parseMBID, domMissing,
+                                          keep=lambda m: notConfigboot and validMBID(m))
+                    doms.append(DOMSnapshot(d, comm, notConfigboot, mbid, comstat,
+                                            missing=domMissing))
+                pairs.append(PairSnapshot(w, plugged, current, voltage, pwrcheck, doms,
+                                          missing=pairMissing))
+            cards.append(CardSnapshot(c, serial, pairs))
+        if timed:
+            self.deferred = deferred
+        return HubSnapshot(self.prefix, self.nicks, cards, time=now, missing=missing,
+                           deferred=deferred)
+
+    def getDOMStates(self, doms, maxAge=None):
+        """Return the state of each DOM, keyed by CWD.  The state is
+        inferred from the proc files where possible, or else taken from
+        an earlier probe if it is younger than maxAge seconds (at most the
+        cache TTL) and the DOM's proc indicators haven't changed since;
+        only the remaining DOMs are probed.  Callers about to act on a
+        DOM's state should pass maxAge=0, so that it is probed unless the
+        proc files alone rule it out.  DOMSnapshots are resolved to
+        the corresponding live DOM first, and left out if there is none."""
+        doms = [d if isinstance(d, DOM) else self.getDOM(d.cwd()) for d in doms]
+        doms = [d for d in doms if d is not None]
+        states = {}
+        probe = []
+        for d in doms:
+            indicators = domIndicators(d)
+            state = inferState(indicators) or \
+                self.stateCache.get(d.cwd(), indicators, maxAge)
+            if state is None:
+                probe.append(d)
+            else:
+                states[d.cwd()] = state
+        if probe:
+            probed = DOMStateProber(probe).run()
+            # Our own probe shows up in the message counts, so the
+            # indicators are read again afterwards
+            for d in probe:
+                self.stateCache.put(d.cwd(), domIndicators(d), probed[d.cwd()])
+            states.update(probed)
+        return states
+
+class ProcNode:
+    """Base class for the driver tree objects.  Reads and parses their proc
+    files, caching the results while the driver has a sampling epoch
+    open: within an epoch each file is read at most once, and static
+    values are kept until the topology is rescanned."""
+    STATIC = "static"
 
-        return s
+    def path(self):
+        return self._path
+
+    def procPath(self, fname):
+        """Full path of one of our proc files, built once"""
+        path = self._files.get(fname)
+        if path is None:
+            path = self._files[fname] = os.path.join(self._path, fname)
+        return path
+
+    def procRead(self, fname, parse, static=False):
+        epoch = self.driver.epoch
+        if epoch is None:
+            return parse(readProcFile(self.procPath(fname)))
+        cached = self._cache.get(fname)
+        if (cached is not None) and (cached[0] in (epoch, ProcNode.STATIC)):
+            return cached[1]
+        val = parse(readProcFile(self.procPath(fname)))
+        if static and (val is not None):
+            self._cache[fname] = (ProcNode.STATIC, val)
+        else:
+            self._cache[fname] = (epoch, val)
+        return val
 
-class Card:
+class Card(ProcNode):
     """A class/struct to hold information about a DOR card.
     """
     def __init__(self, id, driver):
         self.id    = id
         self.driver = driver
+        self._path = os.path.join(driver.path(), "card%d" % id)
+        self._files = { }
+        self._cache = { }
         self.pairs = [ ]
+        self._pairMap = { }
         self.scan()
         
     def __int__(self):
         return self.id
 
     def __getitem__(self, key):
-        for p in self.pairs:
-            if p.id == key:
-                return p
-        return None
-
-    def path(self):        
-        return os.path.join(self.driver.path(), "card%d" % self.id)
+        return self._pairMap.get(key)
 
     def scan(self):
+        entries = listProcDir(self.path())
         for i in range(MAXPAIRS):
-            p = WirePair(i, self)
-            if os.path.exists(p.path()):
+            if ("pair%d" % i) in entries:
+                p = WirePair(i, self)
                 self.pairs.append(p)
+                self._pairMap[i] = p
                 
     def fpgaRegs(self):
-        with open(os.path.join(self.path(), "fpga"),"r") as f:
-            return f.read()
+        return self.procRead("fpga", str)
 
     def revision(self):
-        with open(os.path.join(self.path(), "rev"),"r") as f:
-            return int(f.read())
+        return self.procRead("rev", int, static=True)
 
     def serial(self):
-        with open(os.path.join(self.path(), "test-log")) as f:
-            m = re.compile("Serial number: (\S+)").match(f.read())
-            if m is None: return ""
-            return m.group(1)
+        return self.procRead("test-log", parseSerial, static=True)
 
 
-class WirePair:
+class WirePair(ProcNode):
     """A class/struct to hold information about a DOR card.
     """
     MAXDOMS = 2
     def __init__(self, id, card):
         self.id    = id
         self.doms = [ ]
+        self._domMap = { }
         self.card = card
+        self.driver = card.driver
+        self._path = os.path.join(card.path(), "pair%d" % id)
+        self._files = { }
+        self._cache = { }
         self.scan()
         
     def __int__(self):
         return self.id
 
     def __getitem__(self, key):
-        for p in self.doms:
-            if p.id == key:
-                return p
-        return None
-
-    def path(self):        
-        return os.path.join(self.card.path(), "pair%d" % self.id)
+        return self._domMap.get(key)
 
     def scan(self):
+        entries = listProcDir(self.path())
         for i in range(WirePair.MAXDOMS):
-            d = DOM(DOMLABELS[i], self)
-            if os.path.exists(d.path()):
+            if ("dom"+DOMLABELS[i]) in entries:
+                d = DOM(DOMLABELS[i], self)
                 self.doms.append(d)
+                self._domMap[d.id] = d
 
     def current(self):        
-        with open(os.path.join(self.path(), "current")) as f:
-            m = re.compile(".+ current is (\d+) mA").match(f.read())
-            if m is None: return -1
-            return int(m.group(1))   
+        return self.procRead("current", parseCurrent)
 
     def voltage(self):
-        with open(os.path.join(self.path(), "voltage")) as f:
-            m = re.compile(".+ voltage is ([0-9.]+) Volts").match(f.read())
-            if m is None: return -1
-            return float(m.group(1))
+        return self.procRead("voltage", parseVoltage)
 
     def isPlugged(self):
-        with open(os.path.join(self.path(), "is-plugged")) as f:
-            s = f.read()
-            return (len(s) > 0) and (s.find("not") < 0)
+        return self.procRead("is-plugged", parsePlugged)
 
     def isPowered(self):        
-        with open(os.path.join(self.path(), "pwr")) as f:
-            return (f.read().find("on") >= 0)
+        return self.procRead("pwr", parsePowered)
 
     def pwrCheck(self):
-        with open(os.path.join(self.path(), "pwr_check")) as f:
-            return PwrCheck(f.read().rstrip())
+        return self.procRead("pwr_check", parsePwrCheck)
 
 
-class DOM:
+class DOM(ProcNode):
     """ Class to interface with DOMs in the DOR driver tree """
     def __init__(self, id, pair):
         self.id = id.upper()
         self.pair = pair
         self.card = pair.card
+        self.driver = pair.driver
+        self._path = os.path.join(pair.path(), "dom"+self.id)
+        self._files = { }
+        self._cache = { }
+        # Last is-communicating state and connect count seen; a change in
+        # either means the DOM reconnected, so its cached ID is dropped
+        self._connection = [None, None]
         self.f = None
 
-    def path(self):        
-        return os.path.join(self.pair.path(), "dom"+self.id)
-
     def dev(self):
-        return DEVPATH+"/dhc%dw%dd%s" % (self.card, self.pair, self.id)
+        return (self.driver.devpath or DEVPATH)+"/dhc%dw%dd%s" % (self.card, self.pair, self.id)
 
     def isCommunicating(self):
-        with open(os.path.join(self.path(), "is-communicating")) as f:
-            s = f.read()
-            return (len(s) > 0) and (s.find("NOT") < 0)
+        comm = self.procRead("is-communicating", parseCommunicating)
+        self.noteConnection(communicating=comm)
+        return comm
 
     def isNotConfigboot(self):
-        with open(os.path.join(self.path(), "is-not-configboot")) as f:
-            s = f.read()
-            return (len(s) > 0) and (s.find("is out") >= 0)
+        return self.procRead("is-not-configboot", parseNotConfigboot)
         
     def mbid(self):
-        with open(os.path.join(self.path(), "id")) as f:
-            m = re.compile(".+ ID is ([0-9a-f]+)").match(f.read())
-            if m is not None:
-                return m.group(1)
+        """The mainboard ID.  It is only treated as static once the DOM is
+        out of configboot and reports a valid ID, and is kept until the
+        DOM reconnects."""
+        cached = self._cache.get("id")
+        if (cached is not None) and (cached[0] == ProcNode.STATIC):
+            return cached[1]
+        mbid = self.procRead("id", parseMBID)
+        if (self.driver.epoch is not None) and validMBID(mbid) and self.isNotConfigboot():
+            self._cache["id"] = (ProcNode.STATIC, mbid)
+        return mbid
+
+    def noteConnection(self, communicating=None, nconnects=None):
+        """Record the is-communicating state and connect count read for
+        this DOM; None means not known"""
+        for i, val in enumerate((communicating, nconnects)):
+            if val is None:
+                continue
+            if (self._connection[i] is not None) and (val != self._connection[i]):
+                self._cache.pop("id", None)
+            self._connection[i] = val
 
     def cwd(self):
         return "%s%s%s" % (self.pair.card.id, self.pair.id, self.id)
 
     def commStats(self):
-        with open(os.path.join(self.path(), "comstat")) as f:
-            return CommStats(f.read())
+        cs = self.procRead("comstat", CommStats)
+        self.noteConnection(nconnects=cs.nconnects)
+        return cs
 
     def pos(self):
         nicks = self.pair.card.driver.nicks
@@ -291,18 +1045,53 @@ class DOM:
         return p
 
     def write(self, d):
+        if not isinstance(d, (bytes, bytearray)):
+            d = d.encode()
         os.write(self.f, d)
 
-    def read(self):
-        done = False
-        resp = ""
-        sleep(0.2)
-        while not done:
+    def read(self, timeout=DEV_READ_TIMEOUT, length=None, prompt=None,
+             idle=DEV_READ_IDLE):
+        """Read a reply from the device, returning as soon as it is complete:
+        when at least length bytes have arrived, or when the reply ends
+        with prompt (or any of a tuple of prompts).  Unless waiting for a
+        prompt, a reply that has gone quiet for idle seconds is also
+        considered complete.  Never waits longer than timeout seconds."""
+        if isinstance(prompt, (bytes, str)):
+            prompt = (prompt,)
+        if prompt is not None:
+            prompt = tuple([p if isinstance(p, bytes) else p.encode() for p in prompt])
+        resp = b""
+        deadline = monotonic() + timeout
+        while True:
+            now = monotonic()
+            if now >= deadline:
+                break
+            wait = deadline - now
+            quiet = resp and (prompt is None) and (idle is not None)
+            if quiet:
+                wait = min(wait, idle)
+            try:
+                r, w, x = select.select([self.f], [], [], wait)
+            except (select.error, OSError, ValueError):
+                break
+            if not r:
+                # Reply has gone quiet, or we hit the deadline
+                if quiet:
+                    break
+                continue
             try:
-                resp += os.read(self.f, DEV_BLOCKSIZE)
-                sleep(0.1)
-            except:
-                done = True
+                chunk = os.read(self.f, DEV_BLOCKSIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    continue
+                break
+            if not chunk:
+                break
+            resp += chunk
+            if (length is not None) and (len(resp) >= length):
+                break
+            if (prompt is not None) and resp.endswith(prompt):
+                break
         return resp
 
     def open(self):
@@ -317,33 +1106,10 @@ class DOM:
             os.close(self.f)
         self.f = None
 
-    def state(self):
-        state = "unknown"
-        if not self.isCommunicating():
-            return "nocomm"
-
-        self.open()
-        if self.f is None:
-            return "error"
-
-        self.write(DOMAPP_REQUEST_ID)
-        resp = self.read()
-
-        # Check for correct domapp response
-        if (len(resp) == DOMAPP_ID_RESPONSE_LEN) and \
-                (bytearray(resp[0:8]) == DOMAPP_ID_RESPONSE):
-            state = "domapp"
-        else:
-            # Now check for iceboot / configboot
-            self.write('\r')
-            resp = self.read()
-            if "> " in resp:
-                state = "iceboot"
-            elif "# " in resp:
-                state = "configboot"
-
-        self.close()
-        return state
+    def state(self, maxAge=None):
+        """The DOM's state, probing it only if it can't be inferred or
+        taken from the driver's cache (see DOR.getDOMStates())"""
+        return self.driver.getDOMStates([self], maxAge)[self.cwd()]
 
 class InvalidPwrCheckException(Exception):
     pass
@@ -383,53 +1149,66 @@ class CommStats:
     """
     # TEMP FIX ME: NACKQ can be negative from the driver, this is a bug in 
     # dor-driver
-    CSPAT = """(?msx)\
-/dev/dhc(\d)w(\d)d(\w)\s*
+    CSPAT = r"""(?msx)/dev/dhc(\d)w(\d)d(\w)\s*
 RX:\s*(\d+)B,\s*MSGS=(\d+)\s*NINQ=(\d+)\s*PKTS=(\d+)\s*ACKS=(\d+)\s*
 \s*BADPKT=(\d+)\s*BADHDR=(\d+)\s*BADSEQ=(\d+)\s*NCTRL=(\d+)\s*NCI=(\d+)\s*NIC=(\d+)\s*
 TX:\s*(\d+)B,\s*MSGS=(\d+)\s*NOUTQ=(\d+)\s*RESENT=(\d+)\s*PKTS=(\d+)\s*ACKS=(\d+)\s*
 NACKQ=(-?\d+)\s*NRETXB=(\d+)\s*RETXB_BYTES=(\d+)\s*NRETXQ=(\d+)\s*NCTRL=(\d+)\s*NCI=(\d+)\s*NIC=(\d+)\s*
 NCONNECTS=(\d+)\s*NHDWRTIMEOUTS=(\d+)\s*OPEN=(\S+)\s*CONNECTED=(\S+)\s*
 RXFIFO=(.+?)\ TXFIFO=(.+?)\ DOM_RXFIFO=(\S+)"""
-    
+    CSRE = re.compile(CSPAT)
+
+    # Attribute names, in CSPAT group order
+    FIELDS = ('card', 'pair', 'dom',
+              'rxbytes', 'rxmsgs', 'inq', 'rxpkts', 'rxacks',
+              'badpkt', 'badhdr', 'badseq', 'rxctrl', 'rxci', 'rxic',
+              'txbytes', 'txmsgs', 'outq', 'resent', 'txpkts', 'txacks',
+              'nackq', 'nretxb', 'retxb_bytes', 'nretxq', 'nctrl', 'txci', 'txic',
+              'nconnects', 'hwtimeouts', 'open', 'connected',
+              'rxfifo', 'txfifo', 'dom_rxfifo')
+
+    # Integer counters, in CSPAT group order
+    COUNTERS = FIELDS[3:29]
+    COUNTER_INDEX = dict((k, i) for i, k in enumerate(COUNTERS))
+
     def __init__(self, txt):
         if txt is None:
             raise InvalidComstatException('No string argument supplied!')
-        m = re.search(CommStats.CSPAT, txt)
+        m = CommStats.CSRE.search(txt)
         if not m:
             raise InvalidComstatException('Invalid comstats text!  "%s"' % txt)
-        groups = list(m.groups())
-        self.card = int(groups.pop(0))
-        self.pair = int(groups.pop(0))
-        self.dom = groups.pop(0)
-        self.rxbytes = int(groups.pop(0))
-        self.rxmsgs = int(groups.pop(0))
-        self.inq = int(groups.pop(0))
-        self.rxpkts = int(groups.pop(0))
-        self.rxacks = int(groups.pop(0))
-        self.badpkt = int(groups.pop(0))
-        self.badhdr = int(groups.pop(0))
-        self.badseq = int(groups.pop(0))
-        self.rxctrl = int(groups.pop(0))
-        self.rxci = int(groups.pop(0))
-        self.rxic = int(groups.pop(0))
-        self.txbytes = int(groups.pop(0))
-        self.txmsgs = int(groups.pop(0))
-        self.outq = int(groups.pop(0))
-        self.resent = int(groups.pop(0))
-        self.txpkts = int(groups.pop(0))
-        self.txacks = int(groups.pop(0))
-        self.nackq = int(groups.pop(0))
-        self.nretxb = int(groups.pop(0))
-        self.retxb_bytes = int(groups.pop(0))
-        self.nretxq = int(groups.pop(0))
-        self.nctrl = int(groups.pop(0))
-        self.txci = int(groups.pop(0))
-        self.txic = int(groups.pop(0))
-        self.nconnects = int(groups.pop(0))
-        self.hwtimeouts = int(groups.pop(0))
-        self.open = (groups.pop(0)=='true') and True or False
-        self.connected = (groups.pop(0)=='true') and True or False
-        self.rxfifo = groups.pop(0)
-        self.txfifo = groups.pop(0)
-        self.dom_rxfifo = groups.pop(0)
+        g = m.groups()
+        self.text = txt
+        self.card = int(g[0])
+        self.pair = int(g[1])
+        self.dom = g[2]
+        # The driver prints these flags in either case
+        self.open = (g[29].lower() == 'true')
+        self.connected = (g[30].lower() == 'true')
+        self.rxfifo = g[31]
+        self.txfifo = g[32]
+        self.dom_rxfifo = g[33]
+        # Counters are converted to integers on first access; the regex
+        # has already validated them, and most users only look at a
+        # handful of the 26 counters
+        self._counters = g[3:29]
+
+    def __getattr__(self, attr):
+        idx = CommStats.COUNTER_INDEX.get(attr)
+        counters = self.__dict__.get('_counters')
+        if (idx is None) or (counters is None):
+            raise AttributeError(attr)
+        val = int(counters[idx])
+        self.__dict__[attr] = val
+        return val
+
+    def counters(self):
+        """Return a tuple of all counter values, in COUNTERS order"""
+        d = self.__dict__
+        counters = d.pop('_counters', None)
+        if counters is not None:
+            # Convert everything at once, keeping any values already
+            # accessed (or modified)
+            for k, v in zip(CommStats.COUNTERS, map(int, counters)):
+                d.setdefault(k, v)
+        return tuple(d[k] for k in CommStats.COUNTERS)
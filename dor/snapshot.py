@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""
+Immutable, timestamped snapshots of the DOR driver procfile tree.
+
+The snapshot objects mimic the read-only query interface of the live
+Card / WirePair / DOM classes (isPlugged(), current(), commStats(), ...)
+so that code written against the driver classes can consume a snapshot
+unchanged, but every answer comes from a single pass over the proc tree.
+
+A snapshot taken with read time limits can be partial: values whose proc
+files timed out or couldn't be read are None, and are listed in the
+missing attribute of the pair or DOM (file names) and of the hub (paths
+relative to the driver prefix).  Files that weren't read at all, because
+the time ran out first, are listed in the pair or DOM's missing attribute
+too, but in the hub's deferred attribute rather than its missing one.
+"""
+
+import datetime
+
+class ImmutableSnapshotException(AttributeError):
+    pass
+
+class _Frozen(object):
+    """Base class for snapshot objects; attributes can't be reassigned"""
+    __slots__ = ()
+
+    def __setattr__(self, attr, value):
+        raise ImmutableSnapshotException("snapshot objects are immutable")
+
+    def __delattr__(self, attr):
+        raise ImmutableSnapshotException("snapshot objects are immutable")
+
+    def _set(self, **kwargs):
+        for k in kwargs:
+            object.__setattr__(self, k, kwargs[k])
+
+
+class HubSnapshot(_Frozen):
+    """Snapshot of all DOR cards, wire pairs, and DOMs on a hub"""
+    __slots__ = ('time', 'prefix', 'nicks', 'cards', 'missing', 'deferred',
+                 '_cardMap', '_domMap')
+
+    def __init__(self, prefix, nicks, cards, time=None, missing=(), deferred=()):
+        if time is None:
+            time = datetime.datetime.utcnow().__str__()
+        self._set(time=time, prefix=prefix, nicks=nicks, cards=tuple(cards),
+                  missing=tuple(missing), deferred=tuple(deferred),
+                  _cardMap=dict((c.id, c) for c in cards),
+                  _domMap=dict((d.cwd(), d) for c in cards
+                               for w in c.pairs for d in w.doms))
+        for c in self.cards:
+            c._set(driver=self)
+
+    def __getitem__(self, key):
+        return self._cardMap.get(key)
+
+    def __len__(self):
+        return len(self._domMap)
+
+    def path(self):
+        return self.prefix
+
+    def isPartial(self):
+        return len(self.missing) + len(self.deferred) > 0
+
+    def getDOM(self, cwd):
+        try:
+            return self._domMap.get(cwd[0:2]+cwd[2].upper())
+        except (TypeError, IndexError, AttributeError):
+            return None
+
+    def getAllDOMs(self):
+        return [d for c in self.cards
+                for w in c.pairs
+                for d in w.doms]
+
+    def getPluggedDOMs(self):
+        return [d for d in self.getAllDOMs() if d.pair.isPlugged()]
+
+    def getCommunicatingDOMs(self):
+        return [d for d in self.getAllDOMs() if d.isCommunicating()]
+
+
+class CardSnapshot(_Frozen):
+    """Snapshot of a DOR card"""
+    __slots__ = ('id', 'driver', 'pairs', '_serial', '_pairMap')
+
+    def __init__(self, id, serial, pairs):
+        self._set(id=id, driver=None, pairs=tuple(pairs), _serial=serial,
+                  _pairMap=dict((p.id, p) for p in pairs))
+        for p in self.pairs:
+            p._set(card=self)
+
+    def __int__(self):
+        return self.id
+
+    def __getitem__(self, key):
+        return self._pairMap.get(key)
+
+    def serial(self):
+        return self._serial
+
+
+class PairSnapshot(_Frozen):
+    """Snapshot of a DOR wire pair; power values are only collected for
+    plugged pairs and are None otherwise"""
+    __slots__ = ('id', 'card', 'doms', 'missing', '_plugged', '_current', '_voltage',
+                 '_pwrcheck', '_domMap')
+
+    def __init__(self, id, plugged, current, voltage, pwrcheck, doms, missing=()):
+        self._set(id=id, card=None, doms=tuple(doms), missing=tuple(missing), _plugged=plugged,
+                  _current=current, _voltage=voltage, _pwrcheck=pwrcheck,
+                  _domMap=dict((d.id, d) for d in doms))
+        for d in self.doms:
+            d._set(pair=self)
+
+    def __int__(self):
+        return self.id
+
+    def __getitem__(self, key):
+        return self._domMap.get(key)
+
+    def isPlugged(self):
+        return self._plugged
+
+    def current(self):
+        return self._current
+
+    def voltage(self):
+        return self._voltage
+
+    def pwrCheck(self):
+        return self._pwrcheck
+
+
+class DOMSnapshot(_Frozen):
+    """Snapshot of a DOM's driver state; the ID and comstats are only
+    collected for communicating DOMs and are None otherwise"""
+    __slots__ = ('id', 'pair', 'missing', '_communicating', '_notConfigboot',
+                 '_mbid', '_comstat')
+
+    def __init__(self, id, communicating, notConfigboot, mbid, comstat, missing=()):
+        self._set(id=id.upper(), pair=None, missing=tuple(missing),
+                  _communicating=communicating,
+                  _notConfigboot=notConfigboot, _mbid=mbid, _comstat=comstat)
+
+    @property
+    def card(self):
+        return self.pair.card
+
+    def cwd(self):
+        return "%s%s%s" % (self.pair.card.id, self.pair.id, self.id)
+
+    def isCommunicating(self):
+        return self._communicating
+
+    def isNotConfigboot(self):
+        return self._notConfigboot
+
+    def mbid(self):
+        return self._mbid
+
+    def commStats(self):
+        return self._comstat
+
+    def pos(self):
+        nicks = self.pair.card.driver.nicks
+        if (nicks is not None) and (self._mbid is not None):
+            return nicks.getDOMPosition(self._mbid)
+
+    def omkey(self):
+        p = self.pos()
+        if p is not None:
+            return "%d-%d" % (p[0], p[1])
+        else:
+            return "-"
+
+    def name(self):
+        nicks = self.pair.card.driver.nicks
+        if (nicks is not None) and (self._mbid is not None):
+            return nicks.getDOMName(self._mbid)
+        else:
+            return "-"
+
+    def prodID(self):
+        nicks = self.pair.card.driver.nicks
+        if (nicks is not None) and (self._mbid is not None):
+            return nicks.getDOMID(self._mbid)
+        else:
+            return "-"
+
+    def quad(self):
+        '''Return (by convention only) patch panel quad for this CWD'''
+        return self.card.id*2 + self.pair.id//2 + 2
+
+    def port(self):
+        '''Network port with default dtsx settings'''
+        p = 5001 + (self.card.id*8) + (self.pair.id*2)
+        if (self.id == 'A'):
+            p += 1
+        return p
@@ -0,0 +1,10 @@
+"""
+Synthetic DOR driver for load and scale testing: a procfs-format tree
+that evolves like a live hub's, and pseudo-terminal DOM devices that
+answer state probes.  Point dor.DOR(prefix=hub.prefix,
+devpath=emulator.devdir) at them.
+"""
+
+from __future__ import absolute_import
+from .procfs import SimHub, SimCard, SimPair, SimDOM, MODES
+from .devices import DOMEmulator
@@ -0,0 +1,118 @@
+"""
+Simulated DOM devices.
+
+DOMEmulator gives each DOM of a SimHub a pseudo-terminal, linked as
+dhcXwYdZ in its own device directory, and answers on the master side as
+the DOM's current mode would: a domapp ID reply, an iceboot or
+configboot prompt, a late reply for slow DOMs, or nothing at all for
+hung ones.  Point dor.DOR(prefix, devpath=emulator.devdir) at it.
+"""
+
+import os
+import tty
+import heapq
+import select
+import shutil
+import tempfile
+import threading
+
+import dor
+
+__all__ = ['DOMEmulator', 'SLOW_DELAY']
+
+# Reply delay of a slow DOM, in seconds; longer than the prober waits for
+# a domapp reply
+SLOW_DELAY = 0.5
+
+class DOMEmulator(threading.Thread):
+    """Answers DOM state probes for every DOM of a SimHub, from a daemon
+    thread.  Modes and delays are read from the SimDOMs at each request,
+    so changes to the simulation take effect straight away."""
+
+    def __init__(self, hub, devdir=None):
+        threading.Thread.__init__(self, name="DOMEmulator")
+        self.daemon = True
+        self.hub = hub
+        self.tmpdir = devdir is None and tempfile.mkdtemp(prefix="dorsimdev") or None
+        self.devdir = devdir or self.tmpdir
+        # Master fd -> SimDOM, and input not yet answered
+        self.doms = {}
+        self.bufs = {}
+        self.slaves = []
+        # Pending replies: (time due, sequence, master fd, data)
+        self.replies = []
+        self.seq = 0
+        self.requests = 0
+        for dom in hub.doms():
+            master, slave = os.openpty()
+            tty.setraw(slave)
+            self.slaves.append(slave)
+            self.doms[master] = dom
+            self.bufs[master] = b""
+            link = os.path.join(self.devdir, "dhc%dw%dd%s" % (dom.pair.card.id, dom.pair.id, dom.id))
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(os.ttyname(slave), link)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            now = dor.dor.monotonic()
+            wait = 0.05
+            if self.replies:
+                wait = max(0, min(wait, self.replies[0][0] - now))
+            r, w, x = select.select(list(self.doms.keys()), [], [], wait)
+            for fd in r:
+                try:
+                    self.receive(fd, os.read(fd, 1024))
+                except OSError:
+                    pass
+            now = dor.dor.monotonic()
+            while self.replies and self.replies[0][0] <= now:
+                due, seq, fd, data = heapq.heappop(self.replies)
+                try:
+                    os.write(fd, data)
+                except OSError:
+                    pass
+
+    def receive(self, fd, msg):
+        dom = self.doms[fd]
+        self.requests += 1
+        buf = self.bufs[fd] + msg
+        request = bytes(dor.dor.DOMAPP_REQUEST_ID)
+        if not (dom.communicating and dom.pair.powered()) or dom.mode == "hung":
+            self.bufs[fd] = b""
+            return
+        if dom.mode in ("domapp", "slow"):
+            while request in buf:
+                buf = buf.split(request, 1)[1]
+                self.reply(fd, dom, bytes(dor.dor.DOMAPP_ID_RESPONSE) +
+                           dom.mbid.encode("ascii")[:12].ljust(12, b'\x00'))
+            # Keep a possible partial request
+            self.bufs[fd] = buf[-(len(request)-1):]
+        else:
+            # Boot prompts answer every carriage return, but not the
+            # binary domapp request
+            buf = buf.replace(request, b"")
+            prompt = dom.mode == "iceboot" and b'\r\n> ' or b'\r\n# '
+            for i in range(buf.count(b'\r')):
+                self.reply(fd, dom, prompt)
+            self.bufs[fd] = b""
+
+    def reply(self, fd, dom, data):
+        delay = dom.delay
+        if dom.mode == "slow":
+            delay = max(delay, SLOW_DELAY)
+        self.seq += 1
+        heapq.heappush(self.replies, (dor.dor.monotonic() + delay, self.seq, fd, data))
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.is_alive():
+            self.join(timeout)
+        for fd in list(self.doms.keys()) + self.slaves:
+            os.close(fd)
+        self.doms = {}
+        self.slaves = []
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -0,0 +1,350 @@
+"""
+Simulated DOR driver proc tree.
+
+SimHub writes a procfs-format tree (the files the dor package reads,
+in the driver's formats) for up to 8 cards of 4 wire pairs and 2 DOMs
+each, and evolves it with step(): comstat counters grow at per-DOM
+rates, power readings wander around their nominal values, and faults
+(pwr_check failures, unplugged pairs, DOM reboots) can be injected by
+hand or at random.  Files are rewritten in place, so readers that keep
+them open see the new values, and any file can be made to block its
+readers, like a proc handler stuck in the driver.
+"""
+
+import os
+import stat
+import errno
+import random
+import shutil
+import tempfile
+
+import dor
+
+__all__ = ['SimHub', 'SimCard', 'SimPair', 'SimDOM', 'MODES']
+
+# DOM software states; slow DOMs answer probes late, and hung ones never
+MODES = ("domapp", "iceboot", "configboot", "slow", "hung")
+
+COMSTAT_FORMAT = """/dev/dhc%%d%%s
+RX: %dB, MSGS=%d NINQ=%d PKTS=%d ACKS=%d
+    BADPKT=%d BADHDR=%d BADSEQ=%d NCTRL=%d NCI=%d NIC=%d
+TX: %dB, MSGS=%d NOUTQ=%d RESENT=%d PKTS=%d ACKS=%d
+    NACKQ=%d NRETXB=%d RETXB_BYTES=%d NRETXQ=%d NCTRL=%d NCI=%d NIC=%d
+
+    NCONNECTS=%d NHDWRTIMEOUTS=%d OPEN=%%s CONNECTED=%%s
+    RXFIFO=empty TXFIFO=almost empty,empty DOM_RXFIFO=notfull
+"""
+
+# Counter growth per second for a communicating DOM: packets and acks
+# flow all the time, messages only while the device is open
+IDLE_RATES = { "rxbytes" : 400, "rxpkts" : 40, "rxacks" : 1,
+               "txbytes" : 30, "txpkts" : 40, "txacks" : 40 }
+OPEN_RATES = { "rxbytes" : 50000, "rxmsgs" : 15, "txbytes" : 120, "txmsgs" : 1 }
+
+# Nominal wire pair power readings, and current drawn per DOM
+NOMINAL_VOLTAGE = 89.0
+DOM_CURRENT = 50
+
+# Preferred directory for the tree (tmpfs where available)
+SHM = "/dev/shm"
+
+class SimDOM(object):
+    """A simulated DOM"""
+
+    def __init__(self, pair, label, mbid, mode="domapp"):
+        self.pair = pair
+        self.id = label
+        self.mbid = mbid
+        self.mode = mode
+        # Extra reply delay on the device, in seconds; slow DOMs wait at
+        # least devices.SLOW_DELAY
+        self.delay = 0
+        self.communicating = True
+        self.open = False
+        self.counters = dict.fromkeys(dor.CommStats.COUNTERS, 0)
+        # Extra counter growth per second, e.g. { "badpkt" : 0.1 }
+        self.rates = {}
+
+    def cwd(self):
+        return "%d%d%s" % (self.pair.card.id, self.pair.id, self.id)
+
+    def path(self):
+        return os.path.join(self.pair.path(), "dom"+self.id)
+
+    def isConfigboot(self):
+        return self.mode == "configboot"
+
+    def step(self, dt, rng):
+        if not (self.communicating and self.pair.powered()):
+            return
+        for rates in (IDLE_RATES, self.open and OPEN_RATES or {}, self.rates):
+            for c in rates:
+                x = rates[c]*dt*rng.uniform(0.8, 1.2)
+                # Randomly round, so slow rates still add up
+                self.counters[c] += int(x) + (rng.random() < x - int(x))
+
+    def comstat(self):
+        txt = COMSTAT_FORMAT % tuple(self.counters[c] for c in dor.CommStats.COUNTERS)
+        return txt % (self.pair.card.id, "w%dd%s" % (self.pair.id, self.id),
+                      self.open and "TRUE" or "FALSE",
+                      (self.open and self.communicating) and "TRUE" or "FALSE")
+
+    def files(self):
+        c, p, d = self.pair.card.id, self.pair.id, self.id
+        comm = self.communicating and self.pair.powered()
+        return { "is-communicating" : "Card %d Pair %d DOM %s is %scommunicating\n" %
+                 (c, p, d, (not comm) and "NOT " or ""),
+                 "is-not-configboot" : "Card %d Pair %d DOM %s is %sout of configboot\n" %
+                 (c, p, d, self.isConfigboot() and "not " or ""),
+                 "id" : "Card %d Pair %d DOM %s ID is %s\n" % (c, p, d, self.mbid),
+                 "comstat" : self.comstat() }
+
+class SimPair(object):
+    """A simulated wire pair"""
+
+    # pwr_check faults
+    FAULTS = ("current_lo", "current_hi", "voltage_lo", "voltage_hi")
+
+    def __init__(self, card, id):
+        self.card = card
+        self.id = id
+        self.plugged = True
+        self.power = True
+        self.faults = set()
+        self.current = 0
+        self.voltage = 0.0
+        self.doms = []
+
+    def path(self):
+        return os.path.join(self.card.path(), "pair%d" % self.id)
+
+    def powered(self):
+        return self.plugged and self.power
+
+    def step(self, dt, rng):
+        if not self.powered():
+            self.current, self.voltage = 0, 0.0
+            return
+        ndoms = len([d for d in self.doms if d.communicating])
+        current = DOM_CURRENT*ndoms + rng.randint(-2, 2)
+        voltage = NOMINAL_VOLTAGE + rng.uniform(-0.3, 0.3)
+        if "current_lo" in self.faults:
+            current = DOM_CURRENT//5
+        elif "current_hi" in self.faults:
+            current = DOM_CURRENT*4
+        if "voltage_lo" in self.faults:
+            voltage = NOMINAL_VOLTAGE*0.8
+        elif "voltage_hi" in self.faults:
+            voltage = NOMINAL_VOLTAGE*1.2
+        self.current, self.voltage = current, voltage
+
+    def pwrCheck(self):
+        def check(lo, hi):
+            return "%s,%s" % (lo in self.faults and "ERR_%s_BELOW_LIMITS" % lo[:-3].upper() or "ok",
+                              hi in self.faults and "ERR_%s_ABOVE_LIMITS" % hi[:-3].upper() or "ok")
+        return "Card %d pair %d pwr check: plugged(ok) current(%s) voltage(%s)\n" % \
+            (self.card.id, self.id, check("current_lo", "current_hi"),
+             check("voltage_lo", "voltage_hi"))
+
+    def files(self):
+        c, p = self.card.id, self.id
+        return { "is-plugged" : "Card %d Pair %d is %splugged in.\n" %
+                 (c, p, (not self.plugged) and "not " or ""),
+                 "pwr" : "Card %d Pair %d power status is %s.\n" %
+                 (c, p, self.power and "on" or "off"),
+                 "current" : "Card %d Pair %d current is %d mA.\n" % (c, p, self.current),
+                 "voltage" : "Card %d Pair %d voltage is %.3f Volts.\n" % (c, p, self.voltage),
+                 "pwr_check" : self.pwrCheck() }
+
+class SimCard(object):
+    """A simulated DOR card"""
+
+    def __init__(self, hub, id, serial):
+        self.hub = hub
+        self.id = id
+        self.serial = serial
+        self.pairs = []
+
+    def path(self):
+        return os.path.join(self.hub.prefix, "card%d" % self.id)
+
+    def files(self):
+        return { "rev" : "1\n",
+                 "test-log" : "Serial number: %s\n" % self.serial,
+                 "pwr_check" : "Card %d power check: ok\n" % self.id,
+                 "fpga" : "FPGA registers:\nCTRL  0x68003003\n" }
+
+class SimHub(object):
+    """A simulated DOR driver proc tree, written under prefix (by default
+    a new directory, on tmpfs if there is one)"""
+
+    def __init__(self, prefix=None, cards=8, seed=None, modes=None, faultRate=0.0,
+                 revision="V02-14-01"):
+        self.tmpdir = None
+        if prefix is None:
+            self.tmpdir = tempfile.mkdtemp(prefix="dorsim",
+                                           dir=os.access(SHM, os.W_OK) and SHM or None)
+            prefix = os.path.join(self.tmpdir, "domhub")
+        self.prefix = prefix
+        self.revision = revision
+        self.rng = random.Random(seed)
+        # Faults per pair per second, when stepping
+        self.faultRate = faultRate
+        self.cards = []
+        for c in range(cards):
+            card = SimCard(self, c, "SIM%07d" % c)
+            for p in range(dor.dor.MAXPAIRS):
+                pair = SimPair(card, p)
+                for d in dor.dor.DOMLABELS:
+                    dom = SimDOM(pair, d, "%012x" % self.rng.getrandbits(48))
+                    dom.counters["nconnects"] = 1
+                    pair.doms.append(dom)
+                card.pairs.append(pair)
+            self.cards.append(card)
+        for dom in self.doms():
+            if modes and dom.cwd() in modes:
+                dom.mode = modes[dom.cwd()]
+        self.blocked = set()
+        for pair in self.pairs():
+            pair.step(0, self.rng)
+        self.write()
+
+    def doms(self):
+        return [d for c in self.cards for p in c.pairs for d in p.doms]
+
+    def pairs(self):
+        return [p for c in self.cards for p in c.pairs]
+
+    def getDOM(self, cwd):
+        for d in self.doms():
+            if d.cwd() == cwd.upper():
+                return d
+
+    def getPair(self, card, pair):
+        return self.cards[card].pairs[pair]
+
+    #----------------------------------------------------------------------
+    # Writing the tree
+
+    def writeFile(self, path, txt):
+        """Rewrite a file in place, in one write, so open readers see it"""
+        if path in self.blocked:
+            return
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, txt.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def writeFiles(self, path, files):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for f in files:
+            self.writeFile(os.path.join(path, f), files[f])
+
+    def write(self):
+        """Write every file of the tree"""
+        self.writeFiles(self.prefix, { "revision" : self.revision + "\n" })
+        for card in self.cards:
+            self.writeFiles(card.path(), card.files())
+            for pair in card.pairs:
+                self.writeFiles(pair.path(), pair.files())
+                for dom in pair.doms:
+                    self.writeFiles(dom.path(), dom.files())
+
+    def step(self, dt=1.0):
+        """Advance the simulation dt seconds and rewrite the dynamic files"""
+        for pair in self.pairs():
+            if self.faultRate and self.rng.random() < self.faultRate*dt:
+                self.randomFault(pair)
+            pair.step(dt, self.rng)
+            for dom in pair.doms:
+                dom.step(dt, self.rng)
+        for card in self.cards:
+            for pair in card.pairs:
+                self.writeFiles(pair.path(), pair.files())
+                for dom in pair.doms:
+                    self.writeFiles(dom.path(), dom.files())
+
+    def cleanup(self):
+        """Remove the tree if we made its directory"""
+        for path in list(self.blocked):
+            self.unblock(path)
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    #----------------------------------------------------------------------
+    # Faults and events; they show up in the files on the next step()
+
+    def fail(self, card, pair, fault="current_lo"):
+        """Add a pwr_check fault to a pair"""
+        if fault not in SimPair.FAULTS:
+            raise ValueError("unknown fault %s" % fault)
+        self.getPair(card, pair).faults.add(fault)
+
+    def repair(self, card, pair):
+        self.getPair(card, pair).faults.clear()
+
+    def unplug(self, card, pair):
+        self.getPair(card, pair).plugged = False
+
+    def plug(self, card, pair):
+        self.getPair(card, pair).plugged = True
+
+    def setMode(self, cwd, mode):
+        if mode not in MODES:
+            raise ValueError("unknown mode %s" % mode)
+        self.getDOM(cwd).mode = mode
+
+    def reboot(self, cwd, mode="iceboot"):
+        """Reboot a DOM into mode; it reconnects, closing the device"""
+        dom = self.getDOM(cwd)
+        dom.mode = mode
+        dom.open = False
+        dom.counters["nconnects"] += 1
+
+    def resetComstats(self, cwd):
+        """Zero a DOM's counters, as a driver reload does"""
+        dom = self.getDOM(cwd)
+        dom.counters = dict.fromkeys(dor.CommStats.COUNTERS, 0)
+
+    def randomFault(self, pair):
+        kind = self.rng.choice(("pwr_check", "unplug", "reboot", "clear"))
+        if kind == "pwr_check":
+            pair.faults.add(self.rng.choice(SimPair.FAULTS))
+        elif kind == "unplug":
+            pair.plugged = not pair.plugged
+        elif kind == "reboot":
+            self.reboot(self.rng.choice(pair.doms).cwd())
+        else:
+            pair.faults.clear()
+            pair.plugged = True
+
+    #----------------------------------------------------------------------
+    # Blocking proc files
+
+    def block(self, relpath):
+        """Make a file (relative to the prefix) block its readers, like a
+        proc handler stuck in the driver, by replacing it with a FIFO"""
+        path = os.path.join(self.prefix, relpath)
+        if os.path.exists(path):
+            os.unlink(path)
+        os.mkfifo(path)
+        self.blocked.add(path)
+
+    def unblock(self, relpath):
+        """Release a blocked file's readers and make it a file again"""
+        path = os.path.join(self.prefix, relpath)
+        self.blocked.discard(path)
+        try:
+            if stat.S_ISFIFO(os.stat(path).st_mode):
+                try:
+                    # Let any blocked reader through, with an empty read
+                    os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+                except OSError as e:
+                    if e.errno != errno.ENXIO:
+                        raise
+                os.unlink(path)
+        except OSError:
+            pass
+        self.write()
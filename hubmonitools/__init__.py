@@ -3,5 +3,8 @@ from __future__ import absolute_import
 from .hubConfig import *
 from .moniDOMs import *
 from .moniConfig import *
+from .scheduler import *
+from .moniStats import *
+from .alertManager import *
 
 
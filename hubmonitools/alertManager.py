@@ -0,0 +1,123 @@
+import time
+
+__all__ = ['AlertManager', 'ActiveAlert']
+
+class ActiveAlert(object):
+    """Bookkeeping for one active alert condition"""
+    def __init__(self, alert, now):
+        self.alert = alert
+        self.firstSeen = now
+        self.lastSeen = now
+        # When we last sent it, or None if never
+        self.lastSent = None
+        self.sendCount = 0
+
+class AlertManager(object):
+    """Table of active alerts keyed by HubMoniAlert.key(), the hashable
+    (condition, hub, cluster) identity.
+
+    Each evaluation cycle passes the current alerts to update(), which
+    raises new ones, refreshes existing ones, clears those that went away,
+    and returns the alerts that should be sent now; the caller reports
+    each one it actually sends with sent().  An alert is sent when first
+    raised and, if renotify is set, again every renotify seconds while it
+    stays active.  An alert that clears and comes back within holdoff
+    seconds counts as the same occurrence and isn't sent again, and
+    suppress() silences a condition for a while."""
+
+    def __init__(self, renotify=None, holdoff=0, clock=time.time):
+        self.renotify = renotify
+        self.holdoff = holdoff
+        self.clock = clock
+        self.alerts = {}
+        # Recently cleared alerts, kept for the holdoff period
+        self.cleared = {}
+        # Suppressed keys, with the time suppression ends
+        self.suppressed = {}
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def __contains__(self, key):
+        return key in self.alerts
+
+    def __getitem__(self, key):
+        return self.alerts[key]
+
+    def active(self):
+        """Currently active alerts, oldest first"""
+        return [a.alert for a in sorted(self.alerts.values(), key=lambda a: a.firstSeen)]
+
+    def raiseAlert(self, alert, now=None):
+        """Raise or refresh an alert; returns its ActiveAlert"""
+        if now is None:
+            now = self.clock()
+        key = alert.key()
+        entry = self.alerts.get(key)
+        if entry is None:
+            entry = self.cleared.pop(key, None)
+            if entry is None or now - entry.lastSeen > self.holdoff:
+                entry = ActiveAlert(alert, now)
+            self.alerts[key] = entry
+        # Keep the latest text, which can change while the condition holds
+        entry.alert = alert
+        entry.lastSeen = now
+        return entry
+
+    def clear(self, key, now=None):
+        """Clear an active alert; returns True if it was active"""
+        if now is None:
+            now = self.clock()
+        entry = self.alerts.pop(key, None)
+        if entry is None:
+            return False
+        if self.holdoff > 0:
+            self.cleared[key] = entry
+        return True
+
+    def suppress(self, key, duration, now=None):
+        """Don't send alerts for key for the next duration seconds"""
+        if now is None:
+            now = self.clock()
+        self.suppressed[key] = now + duration
+
+    def isSuppressed(self, key, now):
+        until = self.suppressed.get(key)
+        if until is None:
+            return False
+        if now >= until:
+            del self.suppressed[key]
+            return False
+        return True
+
+    def due(self, entry, now):
+        if self.isSuppressed(entry.alert.key(), now):
+            return False
+        if entry.lastSent is None:
+            return True
+        return (self.renotify is not None) and (now - entry.lastSent >= self.renotify)
+
+    def update(self, alerts, now=None):
+        """Make alerts the set of active alerts; returns those that are due
+        to be sent"""
+        if now is None:
+            now = self.clock()
+        keys = set()
+        for alert in alerts:
+            self.raiseAlert(alert, now)
+            keys.add(alert.key())
+        for key in [k for k in self.alerts if k not in keys]:
+            self.clear(key, now)
+        for key in [k for k in self.cleared if now - self.cleared[k].lastSeen > self.holdoff]:
+            del self.cleared[key]
+        return [e.alert for e in sorted(self.alerts.values(), key=lambda a: a.firstSeen)
+                if self.due(e, now)]
+
+    def sent(self, alert, now=None):
+        """Record that an alert was sent"""
+        if now is None:
+            now = self.clock()
+        entry = self.alerts.get(alert.key())
+        if entry is not None:
+            entry.lastSent = now
+            entry.sendCount += 1
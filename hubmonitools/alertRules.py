@@ -0,0 +1,238 @@
+"""
+Declarative alert rules, evaluated in batch on whole-hub arrays.
+
+Rules are listed in the hubmoni configuration as ALERT_RULES, e.g.
+
+    "ALERT_RULES" : [
+        { "name" : "high retransmit rate", "type" : "rate",
+          "quantity" : "nretxb", "max" : 10 },
+        { "name" : "wire pair current out of range", "type" : "threshold",
+          "quantity" : "current", "min" : 20, "max" : 120 },
+        { "name" : "DOMs in configboot", "type" : "count",
+          "quantity" : "notconfigboot", "expect" : "iceboot" }
+    ]
+
+A threshold rule compares a wire pair quantity (current or voltage) or a
+comstat counter of every DOM to "min" and/or "max"; a rate rule does the
+same for a comstat counter per second since the previous evaluation.  A
+count rule compares a hub-wide count (cards, plugged pairs, comm DOMs,
+comm DOMs out of or in configboot, leaving out those whose state wasn't
+read) to "expect", "min" and/or "max".  Limits
+are numbers, or names of a number in the hub's hubConfig.json entry.
+Pairs waived in hubConfig.json are skipped unless a rule has
+"waive" : false, and a rule can waive more pairs with e.g.
+"waive" : ["c0p1"].
+
+AlertRules compiles the rules once into column indices, limits, and
+waiver masks, so each evaluation is a few array operations covering all
+DOMs and all rules of a type, and Python only loops over rules that
+fired.  Each firing rule gives one HubMoniAlert listing every offender.
+
+Requires numpy.
+"""
+
+import time
+import numpy
+
+import dor
+from .comstats import ComstatArray
+from .history import CWDS
+from .moniDOMs import HubMoniAlert
+from .moniStats import timestamp
+
+__all__ = ['AlertRules', 'RuleException', 'PAIRS']
+
+# All possible wire pairs, in the same order as CWDS (two DOMs per pair)
+PAIRS = tuple("c%dp%d" % (c, p) for c in range(8) for p in range(4))
+PAIR_INDEX = dict((p, i) for i, p in enumerate(PAIRS))
+
+PAIR_QUANTITIES = ("current", "voltage")
+COUNT_QUANTITIES = ("cards", "plugged", "comm", "notconfigboot", "configboot")
+RULE_TYPES = ("threshold", "rate", "count")
+
+class RuleException(Exception):
+    pass
+
+class Rule(object):
+    """One alert rule, checked against the hub configuration"""
+
+    def __init__(self, spec, conf):
+        try:
+            self.name = spec["name"]
+            self.type = spec["type"]
+            self.quantity = spec["quantity"]
+        except (KeyError, TypeError):
+            raise RuleException("alert rule %s needs a name, type, and quantity" % (spec,))
+        if self.type not in RULE_TYPES:
+            raise RuleException("alert rule '%s' has unknown type %s" % (self.name, self.type))
+        if self.type == "count":
+            quantities = COUNT_QUANTITIES
+        elif self.type == "rate":
+            quantities = dor.CommStats.COUNTERS
+        else:
+            quantities = PAIR_QUANTITIES + dor.CommStats.COUNTERS
+        if self.quantity not in quantities:
+            raise RuleException("alert rule '%s' has unknown %s quantity %s" %
+                                (self.name, self.type, self.quantity))
+
+        self.min = self.limit(spec, "min", conf)
+        self.max = self.limit(spec, "max", conf)
+        if self.type == "count" and "expect" in spec:
+            self.min = self.max = self.limit(spec, "expect", conf)
+        if self.min is None and self.max is None:
+            raise RuleException("alert rule '%s' has no limits" % self.name)
+
+        # Waived pairs
+        self.waived = numpy.zeros(len(PAIRS), dtype=bool)
+        waive = spec.get("waive", True)
+        if waive is True or isinstance(waive, list):
+            for card, pair in conf.waivers:
+                self.waived[PAIR_INDEX["c%dp%d" % (card, pair)]] = True
+        if isinstance(waive, list):
+            for p in waive:
+                if p not in PAIR_INDEX:
+                    raise RuleException("alert rule '%s' waives unknown pair %s" % (self.name, p))
+                self.waived[PAIR_INDEX[p]] = True
+        elif waive is not True and waive is not False:
+            raise RuleException("alert rule '%s' waive must be true, false, or a list" % self.name)
+
+    def limit(self, spec, key, conf):
+        """A number, or the number with that name in the hub configuration"""
+        val = spec.get(key)
+        if val is None:
+            return None
+        if not isinstance(val, (int, float)):
+            if val not in conf:
+                raise RuleException("alert rule '%s' %s: no %s in hub configuration" %
+                                    (self.name, key, val))
+            val = conf[val]
+        if isinstance(val, bool) or not isinstance(val, (int, float)):
+            raise RuleException("alert rule '%s' %s is not a number" % (self.name, key))
+        return val
+
+    def describe(self):
+        what = self.quantity
+        if self.type == "rate":
+            what += " rate"
+        elif self.type == "count":
+            what += " count"
+        if self.min is None:
+            return "%s above %g" % (what, self.max)
+        if self.max is None:
+            return "%s below %g" % (what, self.min)
+        if self.min == self.max:
+            return "%s not %g" % (what, self.min)
+        return "%s outside [%g, %g]" % (what, self.min, self.max)
+
+class RuleGroup(object):
+    """Rules of one type, compiled against one array of values with a row
+    per pair, DOM, or (for counts) the whole hub"""
+
+    def __init__(self, rules, columns, labels):
+        self.rules = rules
+        self.labels = labels
+        nrows = len(labels)
+        self.columns = numpy.array([columns.index(r.quantity) for r in rules], dtype=int)
+        self.lo = numpy.array([r.min if r.min is not None else -numpy.inf for r in rules])
+        self.hi = numpy.array([r.max if r.max is not None else numpy.inf for r in rules])
+        # Waiver mask, one row per pair/DOM and one column per rule
+        self.waived = numpy.zeros((nrows, len(rules)), dtype=bool)
+        for j, r in enumerate(rules):
+            if nrows == len(PAIRS):
+                self.waived[:, j] = r.waived
+            elif nrows == len(CWDS):
+                self.waived[:, j] = r.waived.repeat(2)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def evaluate(self, values):
+        """Return a boolean matrix of violations, one row per row of values
+        and one column per rule; NaN (missing) values never violate"""
+        x = values[:, self.columns]
+        bad = (x < self.lo) | (x > self.hi)
+        return bad & ~self.waived
+
+class AlertRules(object):
+    """Alert rules compiled for one hub"""
+
+    def __init__(self, config, rules, hubConfig, hub, cluster):
+        self.config = config
+        self.hub = hub
+        self.cluster = cluster
+        conf = hubConfig.getHub(hub, cluster)
+        rules = [Rule(spec, conf) for spec in rules]
+
+        count = [r for r in rules if r.type == "count"]
+        pair = [r for r in rules if r.type == "threshold" and r.quantity in PAIR_QUANTITIES]
+        dom = [r for r in rules if r.type == "threshold" and r.quantity not in PAIR_QUANTITIES]
+        rate = [r for r in rules if r.type == "rate"]
+        self.hubRules = RuleGroup(count, COUNT_QUANTITIES, ("hub",))
+        self.pairRules = RuleGroup(pair, PAIR_QUANTITIES, PAIRS)
+        self.domRules = RuleGroup(dom, dor.CommStats.COUNTERS, CWDS)
+        self.rateRules = RuleGroup(rate, dor.CommStats.COUNTERS, CWDS)
+        # Comstats at the previous evaluation, for rates
+        self.prev = None
+
+    def __len__(self):
+        return len(self.hubRules) + len(self.pairRules) + len(self.domRules) + len(self.rateRules)
+
+    def evaluate(self, dor):
+        """Return the alerts for all rules.  The dor argument should be the
+        cycle's dor.HubSnapshot; the live driver also works."""
+        t = getattr(dor, "time", None)
+        t = timestamp(t) if t is not None else time.time()
+
+        commDOMs = dor.getCommunicatingDOMs()
+        counts = { "cards" : len(dor.cards), "plugged" : 0, "comm" : len(commDOMs),
+                   "notconfigboot" : 0, "configboot" : 0 }
+        for d in commDOMs:
+            notConfigboot = d.isNotConfigboot()
+            if notConfigboot:
+                counts["notconfigboot"] += 1
+            elif notConfigboot is not None:
+                counts["configboot"] += 1
+
+        pairValues = None
+        if len(self.pairRules) or len(self.hubRules):
+            pairValues = numpy.full((len(PAIRS), len(PAIR_QUANTITIES)), numpy.nan)
+            for d in dor.getPluggedDOMs():
+                i = PAIR_INDEX.get("c%dp%d" % (int(d.card), int(d.pair)))
+                if i is None or not numpy.isnan(pairValues[i, 0]):
+                    continue
+                counts["plugged"] += 1
+                pairValues[i] = (d.pair.current(), d.pair.voltage())
+
+        checks = [(self.hubRules, numpy.array([[counts[q] for q in COUNT_QUANTITIES]],
+                                              dtype=float))]
+        if pairValues is not None:
+            checks.append((self.pairRules, pairValues))
+        if len(self.domRules) or len(self.rateRules):
+            comstats = ComstatArray.fromCommStats(dict((d.cwd(), d.commStats())
+                                                       for d in commDOMs), t)
+            values = comstats.counts.astype(float)
+            values[~comstats.valid] = numpy.nan
+            checks.append((self.domRules, values))
+            if (self.prev is not None) and (t > self.prev.time):
+                checks.append((self.rateRules, comstats.rate(self.prev)))
+            self.prev = comstats
+
+        alerts = []
+        for group, values in checks:
+            if not len(group):
+                continue
+            bad = group.evaluate(values)
+            for j in numpy.nonzero(bad.any(axis=0))[0]:
+                rule = group.rules[j]
+                col = group.columns[j]
+                rows = numpy.nonzero(bad[:, j])[0]
+                if rule.type == "count":
+                    found = "found %d" % values[0, col]
+                else:
+                    found = ", ".join("%s (%g)" % (group.labels[i], values[i, col])
+                                      for i in rows)
+                alert_txt = "%s: %s" % (self.hub, rule.name)
+                alert_desc = "%s-%s: %s: %s" % (self.cluster, self.hub, rule.describe(), found)
+                alerts.append(HubMoniAlert(self.config, self.hub, self.cluster,
+                                           alert_txt=alert_txt, alert_desc=alert_desc))
+        return alerts
@@ -0,0 +1,91 @@
+"""
+Whole-hub comstat samples as arrays.
+
+A ComstatArray holds every comstat counter of every DOM on the hub in one
+int64 matrix, one row per CWD (in history.CWDS order) and one column per
+counter (in dor.CommStats.COUNTERS order), so differences, rates, and
+counter resets can be computed for all DOMs and counters at once.
+
+Requires numpy.
+"""
+
+import numpy
+
+import dor
+from .history import CWDS
+
+__all__ = ['ComstatArray']
+
+CWD_INDEX = dict((c, i) for i, c in enumerate(CWDS))
+COUNTER_INDEX = dor.CommStats.COUNTER_INDEX
+
+class ComstatArray(object):
+    """Comstat counters of all DOMs on a hub at one time"""
+
+    def __init__(self, counts, valid, t=None):
+        self.counts = counts
+        # Rows with data
+        self.valid = valid
+        # Sample time, UNIX seconds
+        self.time = t
+
+    @classmethod
+    def fromCommStats(cls, comstats, t=None):
+        """Build from a dict of dor.CommStats keyed by CWD"""
+        counts = numpy.zeros((len(CWDS), len(dor.CommStats.COUNTERS)), dtype=numpy.int64)
+        valid = numpy.zeros(len(CWDS), dtype=bool)
+        for cwd in comstats:
+            i = CWD_INDEX.get(cwd)
+            if (i is None) or (comstats[cwd] is None):
+                continue
+            counts[i] = comstats[cwd].counters()
+            valid[i] = True
+        return cls(counts, valid, t)
+
+    @classmethod
+    def fromMoniDOMs(cls, moniDOMs, t=None):
+        """Build from a dict of HubMoniDOMs keyed by CWD"""
+        return cls.fromCommStats(dict((cwd, getattr(moniDOMs[cwd], "comstat", None))
+                                      for cwd in moniDOMs), t)
+
+    @classmethod
+    def fromSnapshot(cls, snapshot, t=None):
+        """Build from the communicating DOMs in a dor.HubSnapshot"""
+        return cls.fromCommStats(dict((d.cwd(), d.commStats())
+                                      for d in snapshot.getCommunicatingDOMs()), t)
+
+    def cwds(self):
+        """CWDs with data"""
+        return [CWDS[i] for i in numpy.nonzero(self.valid)[0]]
+
+    def get(self, cwd, counter):
+        i = CWD_INDEX[cwd]
+        if not self.valid[i]:
+            return None
+        return int(self.counts[i, COUNTER_INDEX[counter]])
+
+    def column(self, counter):
+        """One counter for all CWDs"""
+        return self.counts[:, COUNTER_INDEX[counter]]
+
+    def delta(self, prev):
+        """Counter differences since an earlier sample, and a mask of the
+        CWDs present in both"""
+        return self.counts - prev.counts, self.valid & prev.valid
+
+    def resets(self, prev):
+        """Boolean matrix of counters that went backwards since prev,
+        meaning the driver's comstats were reset underneath us"""
+        d, both = self.delta(prev)
+        return (d < 0) & both[:, numpy.newaxis]
+
+    def rate(self, prev):
+        """Counter rates per second since prev; NaN where either sample is
+        missing or the counter was reset"""
+        if (self.time is None) or (prev.time is None) or (self.time <= prev.time):
+            raise ValueError("comstat rates need increasing sample times")
+        d, both = self.delta(prev)
+        r = d/float(self.time - prev.time)
+        r[~both] = numpy.nan
+        r[d < 0] = numpy.nan
+        return r
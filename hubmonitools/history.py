@@ -0,0 +1,171 @@
+"""
+Fixed-size, memory-mapped ring buffer of per-DOM hubmoni samples.
+
+Every sample is one slot in a circular array with a value for each DOM
+(all 64 possible CWDs) and each quantity (pair current and voltage, and
+every comstat counter), so appending is O(1) and the file never grows
+past its initial size.  Missing values are NaN.  Layout:
+
+    HEADER_SIZE bytes   JSON header, space-padded (slots, cwds, quantities)
+    int64               number of samples ever appended
+    float64[slots]      sample times, UNIX seconds (NaN if unused)
+    float64[slots, len(cwds), len(quantities)]   sample values
+
+Requires numpy.
+"""
+
+import os
+import json
+import time
+import numpy
+
+import dor
+from .moniStats import timestamp
+
+__all__ = ['HistoryStore', 'HistoryException', 'CWDS', 'QUANTITIES']
+
+MAGIC = "hubmoni-history"
+VERSION = 1
+HEADER_SIZE = 4096
+
+# All possible CWDs, in slot order
+CWDS = tuple("%d%d%s" % (c, p, d) for c in range(8) for p in range(4) for d in "AB")
+
+# Per-DOM quantities stored with each sample
+QUANTITIES = ("current", "voltage") + dor.CommStats.COUNTERS
+
+class HistoryException(Exception):
+    pass
+
+class HistoryStore:
+    """Ring buffer of hubmoni samples in a memory-mapped file"""
+
+    def __init__(self, filename, slots=2880, readonly=False):
+        self.filename = filename
+        if os.path.exists(filename):
+            self.header = self.readHeader()
+        elif readonly:
+            raise HistoryException("no history file %s" % filename)
+        else:
+            self.header = self.create(slots)
+        self.slots = self.header["slots"]
+        self.cwds = tuple(self.header["cwds"])
+        self.quantities = tuple(self.header["quantities"])
+        self.cwdIndex = dict((c, i) for i, c in enumerate(self.cwds))
+        self.qtyIndex = dict((q, i) for i, q in enumerate(self.quantities))
+
+        mode = readonly and "r" or "r+"
+        offset = HEADER_SIZE
+        self.count = numpy.memmap(filename, dtype=numpy.int64, mode=mode,
+                                  offset=offset, shape=(1,))
+        offset += 8
+        self.times = numpy.memmap(filename, dtype=numpy.float64, mode=mode,
+                                  offset=offset, shape=(self.slots,))
+        offset += 8*self.slots
+        self.data = numpy.memmap(filename, dtype=numpy.float64, mode=mode,
+                                 offset=offset,
+                                 shape=(self.slots, len(self.cwds), len(self.quantities)))
+
+    def readHeader(self):
+        with open(self.filename, "rb") as f:
+            raw = f.read(HEADER_SIZE)
+        try:
+            header = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            raise HistoryException("%s is not a hubmoni history file" % self.filename)
+        if not isinstance(header, dict) or header.get("magic") != MAGIC or \
+                header.get("version") != VERSION:
+            raise HistoryException("%s is not a version %d hubmoni history file" %
+                                   (self.filename, VERSION))
+        # A truncated file can't be mapped
+        try:
+            slots = header["slots"]
+            size = HEADER_SIZE + 8 + 8*slots*(1 + len(header["cwds"])*len(header["quantities"]))
+        except (KeyError, TypeError):
+            raise HistoryException("%s has a bad hubmoni history header" % self.filename)
+        if os.path.getsize(self.filename) < size:
+            raise HistoryException("%s is truncated: %d bytes, expected %d" %
+                                   (self.filename, os.path.getsize(self.filename), size))
+        return header
+
+    def create(self, slots):
+        """Write an empty store with the current layout"""
+        header = { "magic" : MAGIC, "version" : VERSION, "slots" : slots,
+                   "cwds" : CWDS, "quantities" : QUANTITIES }
+        raw = json.dumps(header).encode("utf-8")
+        if len(raw) > HEADER_SIZE:
+            raise HistoryException("history header too large")
+        tmp = self.filename + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(raw + b" "*(HEADER_SIZE-len(raw)))
+            numpy.zeros(1, dtype=numpy.int64).tofile(f)
+            numpy.full(slots, numpy.nan).tofile(f)
+            numpy.full(slots*len(CWDS)*len(QUANTITIES), numpy.nan).tofile(f)
+        os.rename(tmp, self.filename)
+        return json.loads(raw.decode("utf-8"))
+
+    def __len__(self):
+        """Number of samples currently stored"""
+        return int(min(self.count[0], self.slots))
+
+    def append(self, moniDOMs, t=None):
+        """Store a sample; moniDOMs is a dict of HubMoniDOMs keyed by CWD.
+        The sample time t is in UNIX seconds or a dor.HubSnapshot time
+        string, and defaults to now."""
+        if t is None:
+            t = time.time()
+        try:
+            t = float(t)
+        except ValueError:
+            t = timestamp(t)
+        row = numpy.full((len(self.cwds), len(self.quantities)), numpy.nan)
+        for cwd in moniDOMs:
+            i = self.cwdIndex.get(cwd)
+            if i is None:
+                continue
+            m = moniDOMs[cwd]
+            if hasattr(m, "current"):
+                row[i, 0] = m.current
+                row[i, 1] = m.voltage
+            if getattr(m, "comstat", None) is not None:
+                row[i, 2:] = m.comstat.counters()
+        slot = int(self.count[0] % self.slots)
+        self.data[slot] = row
+        self.times[slot] = t
+        # Bump the count last, so a reader never sees a partial sample
+        self.count[0] += 1
+
+    def order(self):
+        """Slot indices of stored samples, oldest first"""
+        n = int(self.count[0])
+        if n <= self.slots:
+            return numpy.arange(n)
+        return (numpy.arange(self.slots) + n) % self.slots
+
+    def query(self, cwd, quantity, start=None, stop=None):
+        """Return (times, values) arrays for one DOM and quantity over
+        [start, stop), in UNIX seconds, oldest first"""
+        try:
+            i = self.cwdIndex[cwd.upper()]
+            j = self.qtyIndex[quantity]
+        except (KeyError, AttributeError):
+            raise HistoryException("unknown CWD/quantity %s/%s" % (cwd, quantity))
+        idx = self.order()
+        times = numpy.array(self.times[idx])
+        keep = numpy.ones(len(idx), dtype=bool)
+        if start is not None:
+            keep &= (times >= start)
+        if stop is not None:
+            keep &= (times < stop)
+        idx = idx[keep]
+        return times[keep], numpy.array(self.data[idx, i, j])
+
+    def flush(self):
+        self.data.flush()
+        self.times.flush()
+        self.count.flush()
+
+    def close(self):
+        if self.count.mode != "r":
+            self.flush()
+        del self.data, self.times, self.count
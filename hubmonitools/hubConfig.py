@@ -1,21 +1,109 @@
+import os
+import re
 import subprocess
 import json
 
+class HubConfigException(Exception):
+    pass
+
+class HubEntry(dict):
+    """Configuration of one hub: expected DOR card and DOM counts, and
+    waived card/pair power check conditions.  Values are validated and
+    also kept as typed attributes, with the waivers as a frozenset of
+    (card, pair) tuples; setting an item updates them."""
+
+    COUNTS = ("comm", "dor", "iceboot", "quad")
+    WAIVEPAT = re.compile(r"^c([0-7])p([0-3])$")
+
+    def __init__(self, name, data):
+        dict.__init__(self)
+        self.name = name
+        if not isinstance(data, dict):
+            raise HubConfigException("%s: hub configuration is not a dictionary" % name)
+        for k in HubEntry.COUNTS + ("waive",):
+            if k not in data:
+                raise HubConfigException("%s: missing '%s'" % (name, k))
+        dict.update(self, data)
+        self.compile()
+
+    def __setitem__(self, key, value):
+        old = dict(self)
+        dict.__setitem__(self, key, value)
+        try:
+            self.compile()
+        except HubConfigException:
+            self.clear()
+            dict.update(self, old)
+            raise
+
+    def compile(self):
+        for k in HubEntry.COUNTS:
+            val = self[k]
+            if isinstance(val, bool) or not isinstance(val, int) or val < 0:
+                raise HubConfigException("%s: '%s' is not a count: %r" % (self.name, k, val))
+        if not isinstance(self["waive"], list):
+            raise HubConfigException("%s: 'waive' is not a list" % self.name)
+        waivers = set()
+        for w in self["waive"]:
+            m = HubEntry.WAIVEPAT.match(str(w))
+            if not m:
+                raise HubConfigException("%s: bad waiver '%s', expected c<card>p<pair>" %
+                                         (self.name, w))
+            waivers.add((int(m.group(1)), int(m.group(2))))
+        self.comm = self["comm"]
+        self.dor = self["dor"]
+        self.iceboot = self["iceboot"]
+        self.quad = self["quad"]
+        self.waivers = frozenset(waivers)
+
 class HubConfig(dict):
     """Class containing DOR/DOM configuration for various hubs and waivers
     for certain driver error conditions.  Loads a JSON dictionary."""
     def __init__(self, hubConfigFile=None):
         """Initialize the object with the JSON dictionary in hubConfigFile"""
         dict.__init__(self)
+        self.filename = None
+        self.mtime = None
         if hubConfigFile is not None:
             self.load(hubConfigFile)
             
     def load(self, filename):
-        """Load a JSON file containing configuration for each DOMHub"""
-        with open(filename) as file:
-            data = json.load(file)            
-            for hub in data:
-                self[hub] = data[hub]
+        """Load a JSON file containing configuration for each DOMHub.  The
+        whole file is parsed and validated first, so on any error a
+        HubConfigException is raised and the current contents are kept."""
+        try:
+            mtime = os.stat(filename).st_mtime
+            with open(filename) as file:
+                data = json.load(file)
+        except (EnvironmentError, ValueError) as e:
+            raise HubConfigException("can't load %s: %s" % (filename, e))
+        if not isinstance(data, dict):
+            raise HubConfigException("%s is not a dictionary of clusters" % filename)
+        clusters = {}
+        for cluster in data:
+            if not isinstance(data[cluster], dict):
+                raise HubConfigException("%s: cluster %s is not a dictionary of hubs" %
+                                         (filename, cluster))
+            clusters[cluster] = dict((hub, HubEntry(hub, data[cluster][hub]))
+                                     for hub in data[cluster])
+        self.clear()
+        self.update(clusters)
+        self.filename = filename
+        self.mtime = mtime
+
+    def changed(self):
+        """Has the file been modified since it was loaded, or since the
+        last call that returned True?"""
+        if self.filename is None:
+            return False
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except EnvironmentError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        return True
 
     def getHub(self, hub, cluster="other"):
         """Return dict containing configuration for a particular hub"""
@@ -23,8 +111,7 @@ class HubConfig(dict):
         
     def isWaived(self, hub, cluster, card, pair):
         """Check to see if a particular card and pair on a hub is waived"""
-        waiveStr = "c%dp%d" % (card, pair)
-        return waiveStr in self[cluster][hub]["waive"]
+        return (int(card), int(pair)) in self[cluster][hub].waivers
     
     def hubs(self, cluster):
         """Return a list of hubs in a particular cluster"""
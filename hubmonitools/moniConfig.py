@@ -31,6 +31,9 @@ class HubMoniConfig(dict):
 
         # DOR procfile prefix
         "DOR_PREFIX" : "/proc/driver/domhub",
+
+        # DOM device directory (None == /dev)
+        "DOR_DEVPATH" : None,
         
         # Default monitoring period, in seconds
         "MONI_PERIOD" : 120,
@@ -38,10 +41,63 @@ class HubMoniConfig(dict):
         # Default monitoring reporting period, in seconds
         "MONI_REPORT_PERIOD" : 3600,
 
-        # How long to wait before reattempting 
-        # socket connection, in seconds
+        # Alert evaluation period, in seconds (None == MONI_PERIOD)
+        "ALERT_PERIOD" : None,
+
+        # Time limits for reading the DOR proc files, per file and
+        # per snapshot, in seconds; files that time out are left out
+        # of that cycle's data (None == no limit)
+        "PROC_READ_TIMEOUT" : 2,
+        "PROC_CYCLE_TIMEOUT" : 30,
+
+        # Unix socket on which to answer status/domstate queries
+        # from the latest snapshot (None == don't; status.py and
+        # domstate.py look for "~/.hubmoni/query.sock"), and how long
+        # DOM states probed for them are reused, in seconds
+        "QUERY_SOCKET" : None,
+        "QUERY_STATE_CACHE_TIME" : 60,
+
+        # Maximum wait between attempts to
+        # reconnect the socket, in seconds
         "SOCKET_WAIT" : 60,
 
+        # Maximum number of records and alerts queued
+        # for sending while the ZMQ listener is down
+        "MAX_QUEUED_RECORDS" : 1000,
+        "MAX_QUEUED_ALERTS" : 1000,
+
+        # Directory for spooling records and alerts to disk while
+        # the ZMQ listener is down (None == don't spool), the
+        # maximum spool size, how often to fsync the spool, in
+        # seconds, and the replay rate, in messages per second
+        "SPOOL_DIR" : None,
+        "SPOOL_MAX_BYTES" : 50*1024*1024,
+        "SPOOL_SYNC_INTERVAL" : 5,
+        "SPOOL_REPLAY_RATE" : 10,
+
+        # Send each report cycle's records as one batch message,
+        # optionally zlib-compressed
+        "MONI_BATCH" : False,
+        "MONI_COMPRESS" : False,
+
+        # Send only changed entries of the voltage, current, and
+        # cabling records, with a full keyframe every
+        # MONI_KEYFRAME_PERIOD reports.  Numeric entries count as
+        # changed when they move by more than their threshold.
+        "MONI_DELTA" : False,
+        "MONI_KEYFRAME_PERIOD" : 24,
+        "MONI_DELTA_THRESHOLDS" : { "dom_pwrstat_voltage" : 0.5,
+                                    "dom_pwrstat_current" : 1 },
+
+        # Other comstat counters (dor.CommStats.COUNTERS names)
+        # to report as dom_comstat_<counter> records
+        "MONI_COMSTAT_COUNTERS" : [],
+
+        # Add min/max/mean/variance/quantiles over all samples in
+        # the report window to each record (comstats as rates/s)
+        "MONI_EXTENDED_STATS" : False,
+        "MONI_STATS_QUANTILES" : [0.5, 0.9, 0.99],
+
         # Default ZMQ listener for reporting
         "ZMQ_HOSTNAME" : "expcont",
         "ZMQ_PORT" : 6668,
@@ -49,6 +105,17 @@ class HubMoniConfig(dict):
         # Grace period for alert after reboot, seconds
         "ALERT_GRACE_PERIOD" : 600,
 
+        # Resend alerts that are still active after this many
+        # seconds (None == only send once), and treat an alert
+        # that clears and comes back within ALERT_HOLDOFF seconds
+        # as the same occurrence
+        "ALERT_RENOTIFY_PERIOD" : None,
+        "ALERT_HOLDOFF" : 0,
+
+        # Additional alert rules (thresholds, rates, and counts),
+        # see hubmonitools/alertRules.py; requires numpy
+        "ALERT_RULES" : [],
+
         # Maximum pause time, minutes
         "MAX_PAUSE_TIME" : 120,
 
@@ -56,6 +123,12 @@ class HubMoniConfig(dict):
         # exiting (-1 == loop forever), for testing
         "MAX_LOOP_CNT" : -1,
 
+        # Ring-buffer file for the history of every sample
+        # (None == don't keep one; requires numpy), and how many
+        # samples it holds
+        "HISTORY_FILE" : None,
+        "HISTORY_SLOTS" : 2880,
+
         # Hostname override for testing
         "HOSTNAME" : None
         }
@@ -1,14 +1,20 @@
 import datetime
 import json
+import copy
 import dor
 
 class HubMoniDOM(object):
     """Class containing increment of monitoring data from one
-    DOM on a hub.  """
+    DOM on a hub.  The DOM can be a live dor.DOM or a dor.DOMSnapshot."""
     def __init__(self, dom, hub):
         self.dom = dom
         self.hub = hub
-        self.updateTime = datetime.datetime.utcnow().__str__()
+        # Use the sample time of a snapshot, so recording windows line
+        # up with the sampling schedule rather than with processing order
+        driver = getattr(getattr(dom, 'card', None), 'driver', None)
+        self.updateTime = getattr(driver, 'time', None)
+        if self.updateTime is None:
+            self.updateTime = datetime.datetime.utcnow().__str__()
         if (self.dom is not None) and self.dom.pair.isPlugged():
             self.current = self.dom.pair.current()
             self.voltage = self.dom.pair.voltage()
@@ -83,23 +89,34 @@ class HubMoniAlert(dict):
             for idx,receiver in enumerate(self["value"]["notifies"]):
                 self["value"]["notifies"][idx]["notifies_txt"] += alert_desc
             
+    def key(self):
+        """Hashable alert identity: (condition, hub, cluster)"""
+        v = self["value"]
+        return (v.get("condition"), v["vars"]["hub"], v["vars"]["cluster"])
+
     def __eq__(self, other):
         """Overide equals for alert equivalence."""
         if type(self) is type(other):
-            return ((self["value"]["condition"] == other["value"]["condition"]) and
-                    (self["value"]["vars"]["hub"] == other["value"]["vars"]["hub"]) and
-                    (self["value"]["vars"]["cluster"] == other["value"]["vars"]["cluster"]))
+            return self.key() == other.key()
         else:
             return False
 
+    def __hash__(self):
+        return hash(self.key())
+
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __str__(self):
         return json.dumps(self, sort_keys=True, indent=4, separators=(',', ': '))
 
-def moniAlerts(config, dor, hubConfig, hub, cluster):
-    """Send user alerts to I3Live for problematic conditions"""
+def moniAlerts(config, dor, hubConfig, hub, cluster, rules=None):
+    """Send user alerts to I3Live for problematic conditions.  The dor
+    argument should be the cycle's dor.HubSnapshot, so that alerts are
+    evaluated without any proc file I/O of their own and reflect the same
+    instant as the monitoring records; the live driver also works.  If
+    rules (an alertRules.AlertRules) is given, the alerts from the
+    configured rules are added."""
     conf = hubConfig.getHub(hub, cluster)
 
     alerts = []
@@ -112,56 +129,114 @@ def moniAlerts(config, dor, hubConfig, hub, cluster):
         alert = HubMoniAlert(config, hub, cluster, alert_txt=alert_txt, alert_desc=alert_desc)
         alerts.append(alert)
         
-    # Check number of communicating DOMs
-    if (len(dor.getCommunicatingDOMs()) != conf["comm"]):
+    # Check number of communicating DOMs.  DOMs whose state is missing
+    # from a partial snapshot could go either way, so they only matter if
+    # the count is off whichever way they go.
+    nComm = len(dor.getCommunicatingDOMs())
+    try:
+        nUnknown = len([d for d in dor.getAllDOMs() if d.isCommunicating() is None])
+    except IOError:
+        nUnknown = 0
+    if (nComm > conf["comm"]) or (nComm + nUnknown < conf["comm"]):
         alert_txt = "%s: unexpected number of DOMs" % hub
         alert_desc = "%s-%s: expected %d communicating DOMs, found %d" % \
-            (cluster, hub, conf["comm"], len(dor.getCommunicatingDOMs()))
+            (cluster, hub, conf["comm"], nComm)
+        if nUnknown:
+            alert_desc += " (%d unknown)" % nUnknown
         alert = HubMoniAlert(config, hub, cluster, alert_txt=alert_txt, alert_desc=alert_desc)        
         alerts.append(alert)
 
-    # Check DOR-driver pwr_check conditions (vs. waivers)
+    # Check DOR-driver pwr_check conditions (vs. waivers), once per pair
     pwrFail = False
+    pairs = set()
     for dom in dor.getPluggedDOMs():
-        moni = HubMoniDOM(dom, hub)
+        card, pair = int(dom.card), int(dom.pair)
+        if (card, pair) in pairs:
+            continue
+        pairs.add((card, pair))
+        pwrcheck = dom.pair.pwrCheck()
+        # Missing from a partial snapshot
+        if pwrcheck is None:
+            continue
         # All power check failures are equivalent at the moment
-        if not moni.pwrcheck.ok and not hubConfig.isWaived(hub, cluster, int(dom.card), int(dom.pair)):
+        if not pwrcheck.ok and not hubConfig.isWaived(hub, cluster, card, pair):
             if not pwrFail:
                 alert_txt = "%s: DOM power check failure" % hub
                 alert_desc = "%s-%s: " % (cluster, hub)
-                alert_desc += moni.pwrcheck.text
+                alert_desc += pwrcheck.text
                 alert = HubMoniAlert(config, hub, cluster, alert_txt=alert_txt, alert_desc=alert_desc)
                 pwrFail = True
             else:
-                alert.appendAlert(moni.pwrcheck.text)
+                alert.appendAlert(pwrcheck.text)
     if pwrFail:
         alerts.append(alert)
 
+    if rules is not None:
+        alerts.extend(rules.evaluate(dor))
+
     return alerts
 
-def moniRecords(config, moniDOMs, moniDOMsPrev):
-    """Construct the JSON monitoring records from the monitoring snapshots"""
+# Comstat counter reported by each count quantity
+COUNT_QUANTITIES = { "dom_comstat_retx" : "nretxb",
+                     "dom_comstat_badpkt" : "badpkt",
+                     "dom_comstat_rxbytes" : "rxbytes",
+                     "dom_comstat_txbytes" : "txbytes" }
+
+# Streaming statistics published with each monitoring quantity
+STATS_QUANTITIES = dict(COUNT_QUANTITIES)
+STATS_QUANTITIES.update({ "dom_pwrstat_voltage" : "voltage",
+                          "dom_pwrstat_current" : "current" })
+
+def counterDeltas(comstat, comstatPrev):
+    """Differences of all comstat counters, in dor.CommStats.COUNTERS order"""
+    return tuple(a - b for a, b in zip(comstat.counters(), comstatPrev.counters()))
+
+def moniRecords(config, moniDOMs, moniDOMsPrev, stats=None):
+    """Construct the JSON monitoring records from the monitoring snapshots.
+    If stats (a MoniStats) is given, each record also gets a "stats" dict
+    of the per-DOM statistics over the report window.  Any other comstat
+    counters listed in config.MONI_COMSTAT_COUNTERS are reported as
+    dom_comstat_<counter> records."""
 
     # JSON monitoring message headers
     MONI_QUANTITIES = ["dom_pwrstat_voltage", "dom_pwrstat_current",
                        "dom_comstat_retx", "dom_comstat_badpkt",
                        "dom_comstat_rxbytes", "dom_comstat_txbytes",
                        "dom_cabling"]
+    counters = dict(COUNT_QUANTITIES)
+    for c in config.MONI_COMSTAT_COUNTERS:
+        qty = "dom_comstat_%s" % c
+        if qty not in counters:
+            MONI_QUANTITIES.insert(-1, qty)
+            counters[qty] = c
 
     recs = []
     # Check that we have something to monitor
     if len(moniDOMs) == 0:
         return recs
 
+    # OMKeys, and all counter differences, once per DOM
+    omkeys = {}
+    deltas = {}
+    for cwd in moniDOMs:
+        omkey = moniDOMs[cwd].dom.omkey()
+        if omkey == "-":
+            continue
+        omkeys[cwd] = omkey
+        if cwd in moniDOMsPrev:
+            deltas[cwd] = counterDeltas(moniDOMs[cwd].comstat, moniDOMsPrev[cwd].comstat)
+
     for qty in MONI_QUANTITIES:
-        rec = HubMoniRecord(config, qty, countQty=("comstat" in qty))
+        rec = HubMoniRecord(config, qty, countQty=(qty in counters))
+        if rec.countQty:
+            idx = dor.CommStats.COUNTER_INDEX[counters[qty]]
         for cwd in moniDOMs:
             # Most recent monitoring snapshot for this DOM
             m = moniDOMs[cwd]
             rec["value"]["hub"] = m.hub
-            omkey = m.dom.omkey()
-            if omkey is "-":
+            if cwd not in omkeys:
                 continue
+            omkey = omkeys[cwd]
             if (qty == "dom_pwrstat_voltage"):
                 rec.setDOMValue(omkey, m.voltage)
             elif (qty == "dom_pwrstat_current"):
@@ -171,19 +246,10 @@ def moniRecords(config, moniDOMs, moniDOMsPrev):
                 # Override priority
                 rec["prio"] = 2
             elif rec.countQty:
-                if cwd not in moniDOMsPrev:
+                if cwd not in deltas:
                     rec.valid = False
                 else:
-                    cnt = 0
-                    mPrev = moniDOMsPrev[cwd]
-                    if (qty == "dom_comstat_retx"):
-                        cnt = m.comstat.nretxb - mPrev.comstat.nretxb
-                    elif (qty == "dom_comstat_badpkt"):
-                        cnt = m.comstat.badpkt - mPrev.comstat.badpkt
-                    elif (qty == "dom_comstat_rxbytes"):
-                        cnt = m.comstat.rxbytes - mPrev.comstat.rxbytes
-                    elif (qty == "dom_comstat_txbytes"):
-                        cnt = m.comstat.txbytes - mPrev.comstat.txbytes
+                    cnt = deltas[cwd][idx]
                     # A negative count most likely means the comstats
                     # were reset underneath us
                     if (cnt < 0):
@@ -191,10 +257,112 @@ def moniRecords(config, moniDOMs, moniDOMsPrev):
                     else:
                         rec.setDOMValue(omkey, cnt)
                         rec["value"]["recordingStopTime"] = m.updateTime
-                        rec["value"]["recordingStartTime"] = mPrev.updateTime
+                        rec["value"]["recordingStartTime"] = moniDOMsPrev[cwd].updateTime
+
+            if (stats is not None) and (qty in STATS_QUANTITIES):
+                s = stats.get(cwd, STATS_QUANTITIES[qty])
+                if s is not None:
+                    rec["value"].setdefault("stats", {})[omkey] = s.summary()
 
         recs.append(rec)
         
     return recs
 
+class MoniDeltaEncoder(object):
+    """Changed-only encoding of slowly-varying (non-count) monitoring
+    records.  Every keyframePeriod-th record of a quantity carries the full
+    per-DOM map; in between only entries that changed by more than the
+    quantity's threshold (or any change, for non-numeric values) since they
+    were last sent are included, and DOMs that disappeared are listed under
+    "removed".  Each quantity carries its own sequence number so that the
+    receiver can detect gaps and wait for the next keyframe; when the sender
+    knows a record was lost, forceKeyframe() shortens that wait.
+
+    Count quantities are per-window differences already and pass through
+    unchanged."""
 
+    def __init__(self, keyframePeriod=24, thresholds=None):
+        self.keyframePeriod = max(1, keyframePeriod)
+        self.thresholds = thresholds or {}
+        # Per-quantity sequence number and last-sent values
+        self.seq = {}
+        self.sent = {}
+
+    def changed(self, qty, old, new):
+        if isinstance(old, (int, float)) and isinstance(new, (int, float)):
+            return abs(new - old) > self.thresholds.get(qty, 0)
+        return old != new
+
+    def forceKeyframe(self):
+        """Send the next record of every quantity as a keyframe, e.g. after
+        records were dropped on the way to the receiver"""
+        self.sent.clear()
+
+    def encode(self, rec):
+        """Return the delta-encoded version of a HubMoniRecord"""
+        if rec.countQty:
+            return rec
+        qty = rec["varname"]
+        seq = self.seq.get(qty, -1) + 1
+        self.seq[qty] = seq
+        values = rec["value"]["value"]
+
+        enc = copy.copy(rec)
+        enc["value"] = dict(rec["value"])
+        enc["value"]["seq"] = seq
+        keyframe = (qty not in self.sent) or (seq % self.keyframePeriod == 0)
+        enc["value"]["keyframe"] = keyframe
+        if keyframe:
+            self.sent[qty] = dict(values)
+            return enc
+
+        ref = self.sent[qty]
+        delta = {}
+        for omkey in values:
+            if (omkey not in ref) or self.changed(qty, ref[omkey], values[omkey]):
+                delta[omkey] = values[omkey]
+                ref[omkey] = values[omkey]
+        removed = sorted(k for k in ref if k not in values)
+        for omkey in removed:
+            del ref[omkey]
+        enc["value"]["value"] = delta
+        if removed:
+            enc["value"]["removed"] = removed
+        return enc
+
+class MoniDeltaDecoder(object):
+    """Receiver-side reconstruction of full records from the output of
+    MoniDeltaEncoder"""
+
+    def __init__(self):
+        self.seq = {}
+        self.values = {}
+        # Statistics
+        self.gaps = 0
+
+    def decode(self, rec):
+        """Return the record with its full per-DOM map restored, or None if
+        records were missed and we're waiting for the next keyframe"""
+        if "seq" not in rec["value"]:
+            return rec
+        qty = rec["varname"]
+        seq = rec["value"]["seq"]
+        if rec["value"]["keyframe"]:
+            self.values[qty] = dict(rec["value"]["value"])
+        elif (qty not in self.values) or (seq != self.seq.get(qty, -1) + 1):
+            # Gap; the reference values can't be trusted any more
+            if qty in self.values:
+                self.gaps += 1
+            self.values.pop(qty, None)
+            self.seq[qty] = seq
+            return None
+        else:
+            self.values[qty].update(rec["value"]["value"])
+            for omkey in rec["value"].get("removed", []):
+                self.values[qty].pop(omkey, None)
+        self.seq[qty] = seq
+        full = copy.deepcopy(rec)
+        full["value"]["value"] = dict(self.values[qty])
+        for k in ("seq", "keyframe", "removed"):
+            full["value"].pop(k, None)
+        return full
@@ -0,0 +1,172 @@
+"""
+Streaming statistics of hubmoni samples over a report window.
+
+Each DOM and quantity gets a RunningStats accumulator that takes every
+intermediate sample in O(1) time and memory: count, min/max, mean and
+variance (Welford's method), and approximate quantiles (the P-squared
+algorithm of Jain and Chlamtac, 1985).  Comstat counters are tracked as
+rates per second over each sample interval, so short bursts of
+retransmits or bad packets show up even if the window total is small.
+"""
+
+import datetime
+
+__all__ = ['P2Quantile', 'RunningStats', 'MoniStats']
+
+def timestamp(t):
+    """Seconds since the epoch for a HubMoniDOM.updateTime string"""
+    try:
+        dt = datetime.datetime.strptime(t, "%Y-%m-%d %H:%M:%S.%f")
+    except ValueError:
+        # str() of a datetime leaves off zero microseconds
+        dt = datetime.datetime.strptime(t, "%Y-%m-%d %H:%M:%S")
+    return (dt - datetime.datetime(1970, 1, 1)).total_seconds()
+
+class P2Quantile(object):
+    """P-squared estimate of the p-th quantile, using five markers"""
+
+    def __init__(self, p):
+        self.p = p
+        self.q = []
+        self.n = [0, 1, 2, 3, 4]
+        self.np = [0, 2*p, 4*p, 2+2*p, 4]
+        self.dn = [0, p/2., p, (1+p)/2., 1]
+
+    def add(self, x):
+        q = self.q
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k+1]:
+                k += 1
+        for i in range(k+1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+        # Adjust the middle markers if they're off their desired positions
+        for i in (1, 2, 3):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i+1]-n[i] > 1) or (d <= -1 and n[i-1]-n[i] < -1):
+                d = (d > 0) and 1 or -1
+                qp = self.parabolic(i, d)
+                if not (q[i-1] < qp < q[i+1]):
+                    qp = q[i] + d*(q[i+d]-q[i])/float(n[i+d]-n[i])
+                q[i] = qp
+                n[i] += d
+
+    def parabolic(self, i, d):
+        q = self.q
+        n = self.n
+        return q[i] + d/float(n[i+1]-n[i-1]) * \
+            ((n[i]-n[i-1]+d)*(q[i+1]-q[i])/float(n[i+1]-n[i]) +
+             (n[i+1]-n[i]-d)*(q[i]-q[i-1])/float(n[i]-n[i-1]))
+
+    def value(self):
+        if not self.q:
+            return None
+        if self.n[4] == 4:
+            # Still exact; interpolate the stored values
+            pos = self.p*(len(self.q)-1)
+            lo = int(pos)
+            hi = min(lo+1, len(self.q)-1)
+            return self.q[lo] + (pos-lo)*(self.q[hi]-self.q[lo])
+        return self.q[2]
+
+class RunningStats(object):
+    """Count, min, max, mean, variance, and quantiles of a stream"""
+
+    def __init__(self, quantiles=(0.5, 0.9, 0.99)):
+        self.n = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x):
+        self.n += 1
+        if self.n == 1:
+            self.min = self.max = x
+        else:
+            self.min = min(self.min, x)
+            self.max = max(self.max, x)
+        delta = x - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(x - self.mean)
+        for q in self.quantiles:
+            q.add(x)
+
+    def variance(self):
+        """Sample variance"""
+        if self.n < 2:
+            return 0.0
+        return self.m2/(self.n-1)
+
+    def summary(self):
+        """Dict of the statistics, for a monitoring record"""
+        d = { "n" : self.n, "min" : self.min, "max" : self.max,
+              "mean" : self.mean, "var" : self.variance() }
+        for q in self.quantiles:
+            d["p%g" % (100*q.p)] = q.value()
+        return d
+
+class MoniStats(object):
+    """Per-DOM, per-quantity streaming statistics over one report window"""
+
+    # Instantaneous values, and comstat counters tracked as rates
+    VALUES = ("voltage", "current")
+    RATES = ("nretxb", "badpkt", "rxbytes", "txbytes")
+
+    def __init__(self, quantiles=(0.5, 0.9, 0.99), rates=RATES):
+        self.quantiles = tuple(quantiles)
+        self.rates = tuple(rates)
+        self.stats = {}
+        # Last sample for each DOM, kept across windows for rates
+        self.last = {}
+
+    def get(self, cwd, qty):
+        """Statistics for one DOM and quantity, or None"""
+        return self.stats.get((cwd, qty))
+
+    def accumulate(self, cwd, qty, x):
+        s = self.stats.get((cwd, qty))
+        if s is None:
+            s = self.stats[(cwd, qty)] = RunningStats(self.quantiles)
+        s.add(x)
+
+    def add(self, moniDOMs):
+        """Add a sample, a dict of HubMoniDOMs keyed by CWD"""
+        for cwd in moniDOMs:
+            m = moniDOMs[cwd]
+            for qty in MoniStats.VALUES:
+                x = getattr(m, qty, None)
+                if x is not None:
+                    self.accumulate(cwd, qty, x)
+            if getattr(m, "comstat", None) is None:
+                continue
+            prev = self.last.get(cwd)
+            self.last[cwd] = m
+            if prev is None or getattr(prev, "comstat", None) is None:
+                continue
+            dt = timestamp(m.updateTime) - timestamp(prev.updateTime)
+            if dt <= 0:
+                continue
+            for qty in self.rates:
+                delta = getattr(m.comstat, qty) - getattr(prev.comstat, qty)
+                # Counters went backwards; comstats were reset
+                if delta >= 0:
+                    self.accumulate(cwd, qty, delta/dt)
+
+    def reset(self):
+        """Start a new report window"""
+        self.stats = {}
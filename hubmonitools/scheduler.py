@@ -0,0 +1,88 @@
+import time
+import logging
+
+__all__ = ['PeriodicTimer', 'Scheduler']
+
+# Monotonic clock where available (Python 3.3+)
+monotonic = getattr(time, "monotonic", time.time)
+
+class PeriodicTimer(object):
+    """A timer that fires every period seconds, phase-locked to a start
+    time: tick k is due at start + offset + k*period, no matter how late
+    earlier ticks were handled.  Ticks that are missed entirely are
+    skipped, not bunched up, and counted as overruns."""
+
+    def __init__(self, name, period, start, offset=0.0):
+        if period <= 0:
+            raise ValueError("timer %s: period must be positive" % name)
+        self.name = name
+        self.period = float(period)
+        self.next = start + offset
+        # Accounting
+        self.ticks = 0
+        self.late = 0
+        self.overruns = 0
+        self.maxLateness = 0.0
+
+    def due(self, now):
+        return now >= self.next
+
+    def fire(self, now):
+        """Advance past the current tick.  Returns (lateness, skipped):
+        how late the tick was handled, in seconds, and how many further
+        ticks were missed entirely."""
+        lateness = now - self.next
+        skipped = int(lateness // self.period)
+        self.next += (skipped + 1) * self.period
+        self.ticks += 1
+        self.overruns += skipped
+        self.maxLateness = max(self.maxLateness, lateness)
+        return lateness, skipped
+
+class Scheduler(object):
+    """Runs a set of independent, phase-locked periodic timers off the
+    monotonic clock"""
+
+    def __init__(self, clock=monotonic, sleep=time.sleep, logger=None,
+                 lateTolerance=1.0):
+        self.clock = clock
+        self.sleep = sleep
+        self.logger = logger or logging.getLogger('hubMoniLogger')
+        # Lateness (in seconds) beyond which a tick is logged as late
+        self.lateTolerance = lateTolerance
+        self.start = clock()
+        self.timers = []
+
+    def add(self, name, period, offset=0.0):
+        """Add a timer with its first tick offset seconds after the
+        scheduler start"""
+        t = PeriodicTimer(name, period, self.start, offset)
+        self.timers.append(t)
+        return t
+
+    def __getitem__(self, name):
+        for t in self.timers:
+            if t.name == name:
+                return t
+        raise KeyError(name)
+
+    def wait(self):
+        """Sleep until at least one timer is due, then return the names of
+        all due timers, in the order they were added"""
+        while True:
+            now = self.clock()
+            due = [t for t in self.timers if t.due(now)]
+            if due:
+                break
+            self.sleep(min([t.next for t in self.timers]) - now)
+
+        for t in due:
+            lateness, skipped = t.fire(now)
+            if skipped:
+                self.logger.warn("%s timer overrun: %d tick(s) skipped, %.1f s late "
+                                 "(%d overruns in %d ticks)" %
+                                 (t.name, skipped, lateness, t.overruns, t.ticks))
+            elif lateness > self.lateTolerance:
+                t.late += 1
+                self.logger.info("%s timer tick %.1f s late" % (t.name, lateness))
+        return [t.name for t in due]
@@ -0,0 +1,340 @@
+"""
+Background ZMQ transmission of hubmoni records and alerts.
+
+The monitoring loop only ever appends to a pair of bounded in-memory
+queues; a daemon thread owns the ZMQ socket, drains the queues, and
+reconnects with exponential backoff when the listener goes away.  Alerts
+are always sent ahead of records, and the queues overflow differently:
+old records are simply dropped, while dropped alerts are logged as errors.
+
+If a spool is given, messages that can't be sent are written to it
+instead of being held in memory, and replayed in order, rate-limited,
+once the listener is back; everything newer waits behind the replay.
+
+A list of records queued with sendBatch() goes out as a single envelope
+message (see encode()), optionally zlib-compressed.
+"""
+
+import json
+import zlib
+import logging
+import threading
+import collections
+import time
+import zmq
+
+from .spool import ALERT, RECORD
+
+# Initial reconnection backoff, in seconds; doubles up to the maximum
+MIN_BACKOFF = 1.0
+
+# Envelope varname for a batch of records
+BATCH_VARNAME = "moni_batch"
+
+# Header fields shared by all records in a report cycle, stored once per batch
+BATCH_COMMON = ("service", "prio", "time")
+
+def encode(msg, compress=False):
+    """Serialize a record, an alert, or a list of records to bytes.  A list
+    becomes one envelope with the header fields common to every record
+    hoisted out of the individual records:
+
+      {"varname": "moni_batch", "service": ..., "prio": ..., "time": ...,
+       "records": [{"varname": ..., "value": ...}, ...]}
+
+    If compress is set, batches are zlib-compressed; single records and
+    alerts are always plain JSON."""
+    if not isinstance(msg, list):
+        return json.dumps(msg).encode("utf-8")
+    env = {"varname" : BATCH_VARNAME}
+    for k in BATCH_COMMON:
+        if all((k in m) and (m[k] == msg[0][k]) for m in msg):
+            env[k] = msg[0][k]
+    hoisted = [k for k in BATCH_COMMON if k in env]
+    env["records"] = [dict((k, v) for k, v in m.items() if k not in hoisted)
+                      for m in msg]
+    buf = json.dumps(env).encode("utf-8")
+    if compress:
+        buf = zlib.compress(buf)
+    return buf
+
+def decode(buf):
+    """Inverse of encode(); always returns a list of records"""
+    if buf[:1] not in (b"{", b"["):
+        buf = zlib.decompress(buf)
+    msg = json.loads(buf.decode("utf-8"))
+    if msg.get("varname") != BATCH_VARNAME:
+        return [msg]
+    recs = []
+    for r in msg["records"]:
+        rec = dict((k, msg[k]) for k in BATCH_COMMON if k in msg)
+        rec.update(r)
+        recs.append(rec)
+    return recs
+
+class MoniSender(threading.Thread):
+    """Daemon thread sending queued records and alerts to a ZMQ PUSH socket"""
+
+    def __init__(self, addr, maxRecords=1000, maxAlerts=1000,
+                 minBackoff=MIN_BACKOFF, maxBackoff=60.0, compress=False,
+                 spool=None, replayRate=10.0, logger=None, context=None):
+        threading.Thread.__init__(self, name="MoniSender")
+        self.daemon = True
+        self.addr = addr
+        self.minBackoff = minBackoff
+        self.maxBackoff = max(minBackoff, maxBackoff)
+        self.logger = logger or logging.getLogger('hubMoniLogger')
+        self.context = context or zmq.Context.instance()
+        self.alerts = collections.deque()
+        self.records = collections.deque()
+        self.maxAlerts = maxAlerts
+        self.maxRecords = maxRecords
+        self.compress = compress
+        # Optional spool.Spool for messages that couldn't be sent, and
+        # the maximum replay rate, in messages per second
+        self.spool = spool
+        self.replayRate = replayRate
+        self.replaying = False
+        self.cond = threading.Condition()
+        self.running = True
+        self.stopped = threading.Event()
+        self.sending = False
+        self.socket = None
+        # Statistics
+        self.sent = 0
+        self.sentBytes = 0
+        self.droppedRecords = 0
+        self.droppedAlerts = 0
+        self.failures = 0
+
+    #-------------------------------------------------------------------
+    # Producer side; these never block on the network
+
+    def sendRecord(self, rec):
+        """Queue a monitoring record; if the queue is full the oldest
+        record is discarded.  Returns False if a record was dropped."""
+        with self.cond:
+            dropped = (len(self.records) >= self.maxRecords)
+            if dropped:
+                self.records.popleft()
+                self.droppedRecords += 1
+            self.records.append((rec, None))
+            self.cond.notify()
+        if dropped:
+            self.logger.warn("moni record queue full, dropped oldest record")
+        return not dropped
+
+    def sendBatch(self, recs):
+        """Queue a list of records to be sent as a single message; the
+        batch takes one slot in the record queue"""
+        if recs:
+            return self.sendRecord(list(recs))
+        return True
+
+    def sendAlert(self, alert):
+        """Queue an alert; alerts go out before any queued records.  If
+        the queue is full the oldest alert is discarded and logged.
+        Returns False if an alert was dropped."""
+        with self.cond:
+            dropped = None
+            if len(self.alerts) >= self.maxAlerts:
+                dropped = self.alerts.popleft()
+                self.droppedAlerts += 1
+            self.alerts.append((alert, None))
+            self.cond.notify()
+        if dropped is not None:
+            self.logger.error("moni alert queue full, dropped alert: %s" %
+                              json.dumps(dropped[0]))
+        return dropped is None
+
+    def pending(self):
+        with self.cond:
+            return (len(self.alerts) + len(self.records) + int(self.sending) +
+                    int(self.replaying))
+
+    def flush(self, timeout=None):
+        """Wait up to timeout seconds for the queues to drain.  Returns
+        True if everything queued was sent."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.cond:
+            while self.alerts or self.records or self.sending or self.replaying:
+                if deadline is None:
+                    self.cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=None):
+        """Try to flush the queues, then stop the thread"""
+        flushed = self.flush(timeout)
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.stopped.set()
+        self.join(timeout)
+        return flushed
+
+    #-------------------------------------------------------------------
+    # Sender thread
+
+    def connect(self):
+        self.socket = self.context.socket(zmq.PUSH)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        # Only queue messages once the listener is actually connected, so
+        # they wait in our bounded queues instead of inside ZMQ
+        self.socket.setsockopt(zmq.IMMEDIATE, 1)
+        self.socket.setsockopt(zmq.RECONNECT_IVL, int(self.minBackoff*1000))
+        self.socket.setsockopt(zmq.RECONNECT_IVL_MAX, int(self.maxBackoff*1000))
+        self.socket.connect(self.addr)
+        self.logger.info("Connecting to ZMQ listener at %s" % self.addr)
+
+    def disconnect(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def nextMessage(self):
+        """Block until there's something to send; alerts first.  Returns
+        (queue, msg, buf), where buf is the encoded message if it has
+        already been encoded on an earlier attempt."""
+        # Wake up now and then while idle to sync the spool
+        wait = self.spool is not None and self.spool.syncInterval or None
+        while True:
+            with self.cond:
+                if self.running and not (self.alerts or self.records):
+                    self.cond.wait(wait)
+                if not self.running:
+                    return None
+                if self.alerts or self.records:
+                    self.sending = True
+                    if self.alerts:
+                        return (self.alerts,) + self.alerts.popleft()
+                    return (self.records,) + self.records.popleft()
+            self.spool.maybeSync()
+
+    def requeue(self, queue, msg, buf):
+        """Put a message we failed to send back at the head of its queue"""
+        with self.cond:
+            if queue is self.alerts:
+                self.alerts.appendleft((msg, buf))
+            elif len(self.records) < self.maxRecords:
+                self.records.appendleft((msg, buf))
+            else:
+                self.droppedRecords += 1
+            self.sending = False
+            self.cond.notify_all()
+
+    def done(self):
+        with self.cond:
+            self.sending = False
+            self.cond.notify_all()
+
+    def transmit(self, buf, delay):
+        """Send an encoded message, waiting up to delay seconds for a
+        listener; raises zmq.ZMQError on failure"""
+        if self.socket is None:
+            self.connect()
+        if not self.socket.poll(int(delay*1000), zmq.POLLOUT):
+            raise zmq.Again()
+        self.socket.send(buf, flags=zmq.NOBLOCK)
+
+    def failed(self, e, delay):
+        """Handle a failed send; returns the next backoff delay"""
+        self.failures += 1
+        if delay == self.minBackoff:
+            self.logger.warn("couldn't send to ZMQ listener at %s (%s), will keep trying" %
+                             (self.addr, e))
+        # ZMQ reconnects on its own if the listener is just
+        # unreachable; start over with a new socket otherwise
+        if e.errno != zmq.EAGAIN:
+            self.disconnect()
+            self.stopped.wait(delay)
+        return min(delay*2, self.maxBackoff)
+
+    def logSent(self, kind, msg, buf):
+        self.sent += 1
+        self.sentBytes += len(buf)
+        if kind == ALERT:
+            self.logger.info("sent %dB moni alert" % len(buf))
+        elif isinstance(msg, list):
+            self.logger.info("sent %dB moni batch of %d records" % (len(buf), len(msg)))
+        else:
+            self.logger.info("sent %dB moni record" % len(buf))
+
+    def spoolQueued(self):
+        """Move everything queued in memory to the end of the spool"""
+        with self.cond:
+            items = ([(ALERT, m, b) for m, b in self.alerts] +
+                     [(RECORD, m, b) for m, b in self.records])
+            self.alerts.clear()
+            self.records.clear()
+        for kind, msg, buf in items:
+            if buf is None:
+                buf = encode(msg, self.compress)
+            self.spool.append(kind, buf)
+
+    def replay(self, delay):
+        """Send the oldest spooled message, rate-limited.  Returns the next
+        backoff delay."""
+        self.spoolQueued()
+        kind, buf = self.spool.peek()
+        try:
+            self.transmit(buf, delay)
+        except zmq.ZMQError as e:
+            return self.failed(e, delay)
+        self.spool.ack()
+        self.logSent(kind, None, buf)
+        self.stopped.wait(1.0/self.replayRate)
+        return self.minBackoff
+
+    def setReplaying(self, replaying):
+        with self.cond:
+            if self.replaying and not replaying:
+                self.logger.info("spool replay complete")
+            self.replaying = replaying
+            self.cond.notify_all()
+
+    def run(self):
+        delay = self.minBackoff
+        while self.running:
+            # Spooled messages go out in order, ahead of anything newer
+            if self.spool is not None:
+                self.spool.maybeSync()
+                self.setReplaying(self.spool.pending())
+                if self.replaying:
+                    delay = self.replay(delay)
+                    continue
+
+            item = self.nextMessage()
+            if item is None:
+                break
+            queue, msg, buf = item
+            kind = (queue is self.alerts) and ALERT or RECORD
+            # Serialize each message once, however many attempts it takes
+            if buf is None:
+                buf = encode(msg, self.compress)
+            try:
+                self.transmit(buf, delay)
+            except zmq.ZMQError as e:
+                if self.spool is not None:
+                    self.spool.append(kind, buf)
+                    self.done()
+                else:
+                    self.requeue(queue, msg, buf)
+                delay = self.failed(e, delay)
+                continue
+
+            if delay > self.minBackoff:
+                self.logger.info("Connected to ZMQ listener at %s" % self.addr)
+            delay = self.minBackoff
+            self.logSent(kind, msg, buf)
+            self.done()
+        self.disconnect()
+        if self.spool is not None:
+            self.spoolQueued()
+            self.spool.close()
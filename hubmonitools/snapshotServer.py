@@ -0,0 +1,312 @@
+"""
+Local query server for hubmoni's latest DOR snapshot and DOM states.
+
+hubmoni publishes each snapshot it takes to a SnapshotServer, which
+answers requests on a Unix-domain socket, so tools like status.py and
+domstate.py can get the hub's state without rescanning the driver tree
+or opening the DOM devices themselves.  The protocol is one JSON object
+per line each way:
+
+    {"req": "snapshot"}
+        -> {"snapshot": {...}, "age": <seconds>}
+    {"req": "states", "cwds": ["00A", ...], "maxAge": <seconds>}
+        -> {"states": {"00A": "domapp", ...}}
+
+and {"error": "..."} if the request can't be answered.  DOM states are
+probed by the server on demand, for the requested DOMs, and cached for a
+while, so any number of clients polling together cost at most one
+probe per DOM per cache period; a client can ask for fresher states, but
+not fresher than MIN_STATE_AGE.
+
+The socket is only accessible to the user running hubmoni, and lives in
+a private directory by default.  Each connection is served on its own
+thread and is closed after CONNECTION_TIME seconds, so a stuck client
+can't hold up the others.
+"""
+
+import os
+import sys
+import json
+import time
+import stat
+import errno
+import select
+import socket
+import threading
+
+import dor
+import nicknames
+
+__all__ = ['SnapshotServer', 'SnapshotClient', 'QueryException',
+           'encodeSnapshot', 'decodeSnapshot', 'SOCKET']
+
+# Default socket path; its directory is created private to the user
+SOCKET = os.path.join("~", ".hubmoni", "query.sock")
+
+# How long probed DOM states are reused, in seconds, and the youngest
+# a client can insist on
+STATE_CACHE_TIME = 60
+MIN_STATE_AGE = 5
+
+# Longest a connection is served, in seconds, and the most served at once
+CONNECTION_TIME = 5
+MAX_CONNECTIONS = 8
+
+# Longest request line accepted
+MAX_REQUEST = 65536
+
+class QueryException(Exception):
+    pass
+
+def encodeSnapshot(snapshot):
+    """Plain dict of a dor.HubSnapshot, for JSON"""
+    def pwrcheck(w):
+        pc = w.pwrCheck()
+        return pc.text if pc is not None else None
+    def comstat(d):
+        cs = d.commStats()
+        return cs.text if cs is not None else None
+    return { "time" : snapshot.time, "prefix" : snapshot.prefix,
+             "missing" : list(snapshot.missing), "deferred" : list(snapshot.deferred),
+             "cards" : [ { "id" : c.id, "serial" : c.serial(),
+                           "pairs" : [ { "id" : w.id, "plugged" : w.isPlugged(),
+                                         "current" : w.current(), "voltage" : w.voltage(),
+                                         "pwrcheck" : pwrcheck(w), "missing" : list(w.missing),
+                                         "doms" : [ { "id" : d.id,
+                                                      "comm" : d.isCommunicating(),
+                                                      "notConfigboot" : d.isNotConfigboot(),
+                                                      "mbid" : d.mbid(),
+                                                      "comstat" : comstat(d),
+                                                      "missing" : list(d.missing) }
+                                                    for d in w.doms ] }
+                                       for w in c.pairs ] }
+                         for c in snapshot.cards ] }
+
+def decodeSnapshot(data, nicks=None):
+    """Rebuild a dor.HubSnapshot from encodeSnapshot()'s dict"""
+    cards = []
+    for c in data["cards"]:
+        pairs = []
+        for w in c["pairs"]:
+            doms = [dor.DOMSnapshot(d["id"], d["comm"], d["notConfigboot"], d["mbid"],
+                                    d["comstat"] and dor.CommStats(d["comstat"]),
+                                    missing=d["missing"])
+                    for d in w["doms"]]
+            pairs.append(dor.PairSnapshot(w["id"], w["plugged"], w["current"], w["voltage"],
+                                          w["pwrcheck"] and dor.PwrCheck(w["pwrcheck"]),
+                                          doms, missing=w["missing"]))
+        cards.append(dor.CardSnapshot(c["id"], c["serial"], pairs))
+    return dor.HubSnapshot(data["prefix"], nicks, cards, time=data["time"],
+                           missing=data["missing"], deferred=data.get("deferred", ()))
+
+class SnapshotServer(threading.Thread):
+    """Answers snapshot and DOM state queries on a Unix-domain socket,
+    from a daemon thread"""
+
+    def __init__(self, path=SOCKET, driver=None, stateCacheTime=STATE_CACHE_TIME,
+                 minStateAge=MIN_STATE_AGE, connectionTime=CONNECTION_TIME, logger=None):
+        threading.Thread.__init__(self, name="SnapshotServer")
+        self.daemon = True
+        self.path = os.path.expanduser(path)
+        # Driver used to probe DOM states, or None to not answer
+        self.driver = driver
+        self.stateCacheTime = stateCacheTime
+        self.minStateAge = minStateAge
+        self.connectionTime = connectionTime
+        self.logger = logger
+        self.lock = threading.Lock()
+        # Probes are made one at a time
+        self.probeLock = threading.Lock()
+        self.connections = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self.snapshot = None
+        self.published = None
+        self.encoded = None
+        # Probed DOM states: CWD -> (monotonic time, state)
+        self.states = {}
+        self.stopped = threading.Event()
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        self.removeStale()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen(MAX_CONNECTIONS)
+
+    def removeStale(self):
+        """Remove a socket left behind by a previous run.  Anything else
+        at our path, or a socket something is still answering on, is left
+        alone and raises an EnvironmentError."""
+        try:
+            mode = os.lstat(self.path).st_mode
+        except OSError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise OSError(errno.EEXIST, "%s exists and isn't a socket" % self.path)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except socket.error:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, "%s is in use" % self.path)
+
+    def publish(self, snapshot):
+        """Make a dor.HubSnapshot the one served"""
+        with self.lock:
+            self.snapshot = snapshot
+            self.published = time.time()
+            self.encoded = None
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                r, w, x = select.select([self.sock], [], [], 0.5)
+                if not r:
+                    continue
+                try:
+                    conn, addr = self.sock.accept()
+                except socket.error:
+                    continue
+                if not self.connections.acquire(False):
+                    # Too many clients already
+                    conn.close()
+                    continue
+                t = threading.Thread(target=self.handle, args=(conn,),
+                                     name="SnapshotServer connection")
+                t.daemon = True
+                t.start()
+        finally:
+            self.sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.join(timeout)
+
+    def handle(self, conn):
+        try:
+            self.serve(conn)
+        except Exception:
+            if self.logger is not None:
+                self.logger.error("snapshot query failed", exc_info=sys.exc_info())
+        finally:
+            conn.close()
+            self.connections.release()
+
+    def serve(self, conn):
+        """Answer requests on a connection until the client closes it or
+        its time is up"""
+        deadline = dor.dor.monotonic() + self.connectionTime
+        buf = b""
+        while True:
+            left = deadline - dor.dor.monotonic()
+            if left <= 0:
+                return
+            conn.settimeout(left)
+            try:
+                chunk = conn.recv(4096)
+            except socket.timeout:
+                return
+            if not chunk:
+                return
+            buf += chunk
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                conn.sendall(json.dumps(self.answer(line)).encode("utf-8") + b"\n")
+            if len(buf) > MAX_REQUEST:
+                return
+
+    def answer(self, line):
+        try:
+            req = json.loads(line.decode("utf-8"))
+            kind = req["req"]
+        except (ValueError, KeyError, TypeError):
+            return { "error" : "bad request" }
+        if kind == "snapshot":
+            with self.lock:
+                if self.snapshot is None:
+                    return { "error" : "no snapshot yet" }
+                if self.encoded is None:
+                    self.encoded = encodeSnapshot(self.snapshot)
+                return { "snapshot" : self.encoded, "age" : time.time() - self.published }
+        elif kind == "states":
+            return self.answerStates(req.get("cwds"), req.get("maxAge"))
+        return { "error" : "unknown request %s" % kind }
+
+    def answerStates(self, cwds, maxAge):
+        with self.lock:
+            snapshot = self.snapshot
+        if (self.driver is None) or (snapshot is None):
+            return { "error" : "no DOM states" }
+        if cwds is None:
+            cwds = [d.cwd() for d in snapshot.getCommunicatingDOMs()]
+        maxAge = self.stateCacheTime if maxAge is None else min(maxAge, self.stateCacheTime)
+        maxAge = max(maxAge, self.minStateAge)
+        with self.probeLock:
+            now = dor.dor.monotonic()
+            stale = [c for c in cwds
+                     if (c not in self.states) or (now - self.states[c][0] > maxAge)]
+            doms = [d for d in (snapshot.getDOM(c) for c in stale) if d is not None]
+            if doms:
+                # Pick up DOMs that have appeared since the driver was scanned
+                self.driver.refresh()
+                probed = self.driver.getDOMStates(doms, maxAge)
+                now = dor.dor.monotonic()
+                for cwd in probed:
+                    self.states[cwd] = (now, probed[cwd])
+            return { "states" : dict((c, self.states[c][1] if c in self.states else "noplug")
+                                     for c in cwds) }
+
+class SnapshotClient(object):
+    """Queries a SnapshotServer; raises QueryException if there is none
+    or it can't answer"""
+
+    def __init__(self, path=SOCKET, timeout=5.0):
+        self.path = os.path.expanduser(path)
+        self.timeout = timeout
+
+    def request(self, req):
+        if not os.path.exists(self.path):
+            raise QueryException("no hubmoni query socket %s" % self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+            sock.sendall(json.dumps(req).encode("utf-8") + b"\n")
+            buf = b""
+            while not buf.endswith(b"\n"):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                buf += chunk
+        except (socket.error, socket.timeout) as e:
+            raise QueryException("hubmoni query failed: %s" % e)
+        finally:
+            sock.close()
+        try:
+            reply = json.loads(buf.decode("utf-8"))
+        except ValueError:
+            raise QueryException("bad reply from hubmoni")
+        if "error" in reply:
+            raise QueryException(reply["error"])
+        return reply
+
+    def snapshot(self, nicks=None):
+        """Return hubmoni's latest dor.HubSnapshot and its age in seconds"""
+        reply = self.request({ "req" : "snapshot" })
+        if nicks is None:
+            nicks = nicknames.Nicknames()
+        return decodeSnapshot(reply["snapshot"], nicks), reply["age"]
+
+    def states(self, cwds=None, maxAge=None):
+        """Return a dict of DOM states keyed by CWD, probed by hubmoni at
+        most maxAge seconds ago (but see MIN_STATE_AGE); cwds defaults to
+        all communicating DOMs"""
+        return self.request({ "req" : "states", "cwds" : cwds, "maxAge" : maxAge })["states"]
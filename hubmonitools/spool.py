@@ -0,0 +1,260 @@
+"""
+Durable, size-capped on-disk spool of encoded hubmoni messages.
+
+Messages that can't be delivered to the ZMQ listener are appended to a
+sequence of segment files in the spool directory and read back in order
+for replay once the listener returns.  Each entry is framed as
+
+    4-byte big-endian payload length, 1-byte kind ('A'lert or 'R'ecord),
+    payload (the encoded message, as sent on the wire)
+
+Each entry is flushed to the file as it is appended, so it survives the
+process dying; fsyncs are batched, at most once per syncInterval seconds,
+and the replay position is saved on the same schedule, so after a crash a
+few already-sent messages may be sent again (at-least-once delivery).  The
+owner calls maybeSync() periodically, so the batch is bounded in time even
+when nothing more is appended.  When the spool exceeds maxBytes, the
+oldest segments are discarded.
+"""
+
+import os
+import glob
+import time
+import errno
+import struct
+import fcntl
+
+__all__ = ['Spool', 'SpoolException', 'SpoolLockedException']
+
+HEADER = struct.Struct(">IB")
+ALERT = ord('A')
+RECORD = ord('R')
+
+SEGMENT_PREFIX = "spool."
+OFFSET_FILE = "offset"
+LOCK_FILE = "lock"
+
+class SpoolException(Exception):
+    pass
+
+class SpoolLockedException(SpoolException):
+    pass
+
+class Spool:
+    """Append-only message spool in a directory.  Only one process at a
+    time can open a spool."""
+
+    def __init__(self, directory, maxBytes=50*1024*1024, syncInterval=5.0,
+                 segmentBytes=None):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.syncInterval = syncInterval
+        if segmentBytes is None:
+            segmentBytes = max(4096, maxBytes // 8)
+        self.segmentBytes = segmentBytes
+        # Statistics
+        self.dropped = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.lockFile = open(os.path.join(directory, LOCK_FILE), "a")
+        try:
+            fcntl.flock(self.lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            self.lockFile.close()
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                raise SpoolLockedException("spool %s is in use" % directory)
+            raise
+
+        # Segment sequence numbers and sizes, oldest first
+        self.segments = []
+        for f in glob.glob(os.path.join(directory, SEGMENT_PREFIX+"*")):
+            try:
+                seq = int(os.path.basename(f)[len(SEGMENT_PREFIX):])
+            except ValueError:
+                continue
+            self.segments.append([seq, os.path.getsize(f)])
+        self.segments.sort()
+
+        # Replay position
+        self.readSeq, self.readOffset = self.loadOffset()
+        if not self.segments or self.readSeq < self.segments[0][0]:
+            self.readSeq = self.segments and self.segments[0][0] or 0
+            self.readOffset = 0
+        for seq in [s[0] for s in self.segments if s[0] < self.readSeq]:
+            self.removeSegment(seq)
+        self.peeked = None
+
+        # Append to a fresh segment so that a torn entry at the end of the
+        # last one (from a crash) is never followed by good data.  It's
+        # created on the first append, so just looking at the spool
+        # leaves no empty segments behind.
+        self.writeSeq = self.segments and self.segments[-1][0]+1 or 0
+        self.writer = None
+        self.lastSync = time.time()
+        self.dirty = False
+        # Replay position changed since it was saved
+        self.moved = False
+
+    def path(self, seq):
+        return os.path.join(self.directory, "%s%08d" % (SEGMENT_PREFIX, seq))
+
+    def loadOffset(self):
+        try:
+            with open(os.path.join(self.directory, OFFSET_FILE)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (IOError, OSError, ValueError):
+            return 0, 0
+
+    def saveOffset(self):
+        fname = os.path.join(self.directory, OFFSET_FILE)
+        tmp = fname + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("%d %d\n" % (self.readSeq, self.readOffset))
+        os.rename(tmp, fname)
+
+    def openSegment(self, seq):
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = open(self.path(seq), "ab")
+        if not self.segments or self.segments[-1][0] != seq:
+            self.segments.append([seq, 0])
+
+    def size(self):
+        return sum(s[1] for s in self.segments)
+
+    #-------------------------------------------------------------------
+    # Writing
+
+    def append(self, kind, buf):
+        """Append an encoded message of the given kind (ALERT or RECORD)"""
+        if self.writer is None:
+            self.openSegment(self.writeSeq)
+        elif self.segments[-1][1] >= self.segmentBytes:
+            self.openSegment(self.segments[-1][0]+1)
+        entry = HEADER.pack(len(buf), kind) + buf
+        self.writer.write(entry)
+        self.writer.flush()
+        self.segments[-1][1] += len(entry)
+        self.dirty = True
+        self.trim()
+        self.maybeSync()
+
+    def trim(self):
+        """Discard the oldest segments while we're over the size cap"""
+        while len(self.segments) > 1 and self.size() > self.maxBytes:
+            seq = self.segments[0][0]
+            if seq == self.readSeq:
+                self.dropped += self.count(seq, self.readOffset)
+                self.readSeq = self.segments[1][0]
+                self.readOffset = 0
+                self.peeked = None
+                self.moved = True
+            self.removeSegment(seq)
+
+    def removeSegment(self, seq):
+        try:
+            os.unlink(self.path(seq))
+        except OSError:
+            pass
+        self.segments = [s for s in self.segments if s[0] != seq]
+
+    def maybeSync(self):
+        """Sync if there is anything to sync and the last sync was at
+        least syncInterval seconds ago"""
+        if (self.dirty or self.moved) and time.time() - self.lastSync >= self.syncInterval:
+            self.sync()
+
+    def sync(self):
+        """Flush appended entries to disk and save the replay position"""
+        if self.dirty:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            self.dirty = False
+        self.saveOffset()
+        self.moved = False
+        self.lastSync = time.time()
+
+    def close(self):
+        self.sync()
+        if self.writer is not None:
+            self.writer.close()
+        self.lockFile.close()
+
+    #-------------------------------------------------------------------
+    # Reading
+
+    def readEntry(self, f):
+        """Read one entry from f; returns (kind, buf) or None at the end of
+        the segment or at a torn entry"""
+        hdr = f.read(HEADER.size)
+        if len(hdr) < HEADER.size:
+            return None
+        length, kind = HEADER.unpack(hdr)
+        buf = f.read(length)
+        if len(buf) < length:
+            return None
+        return kind, buf
+
+    def count(self, seq, offset=0):
+        n = 0
+        for entry in self.entries(seq, offset):
+            n += 1
+        return n
+
+    def entries(self, seq, offset=0):
+        """Generate (kind, buf, nextOffset) for entries in a segment"""
+        if (self.writer is not None) and (seq == self.segments[-1][0]):
+            self.writer.flush()
+        try:
+            f = open(self.path(seq), "rb")
+        except IOError:
+            return
+        with f:
+            f.seek(offset)
+            while True:
+                entry = self.readEntry(f)
+                if entry is None:
+                    return
+                yield entry + (f.tell(),)
+
+    def peek(self):
+        """Return the oldest unsent (kind, buf), or None if the spool is
+        empty"""
+        if self.peeked is not None:
+            return self.peeked[:2]
+        while True:
+            for entry in self.entries(self.readSeq, self.readOffset):
+                self.peeked = entry
+                return entry[:2]
+            # End of this segment; move on if there's a newer one
+            later = [s[0] for s in self.segments if s[0] > self.readSeq]
+            if not later:
+                return None
+            done = self.readSeq
+            self.readSeq = later[0]
+            self.readOffset = 0
+            self.moved = True
+            self.removeSegment(done)
+
+    def ack(self):
+        """Mark the entry returned by peek() as sent"""
+        if self.peeked is None:
+            return
+        self.readOffset = self.peeked[2]
+        self.peeked = None
+        self.moved = True
+        self.maybeSync()
+
+    def pending(self):
+        """True if there are spooled entries that haven't been sent"""
+        return self.peek() is not None
+
+    def __iter__(self):
+        """Iterate over all unsent (kind, buf) without consuming them"""
+        offset = self.readOffset
+        for seq in [s[0] for s in self.segments if s[0] >= self.readSeq]:
+            for entry in self.entries(seq, offset):
+                yield entry[:2]
+            offset = 0
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# Microbenchmark of comstat parsing: the original CommStats parser
+# (CSPAT match, then all 33 groups popped into attributes one at a time)
+# vs. the current CommStats, which converts counters on first access.
+#
+# Run from the top-level directory:
+#    $ PYTHONPATH=. python misc/benchComstat.py [procdir] [iterations]
+#
+from __future__ import print_function
+import sys
+import os
+import re
+import glob
+import timeit
+
+import dor
+
+procdir = "tests/ichub29_proc"
+iterations = 2000
+if len(sys.argv) > 1:
+    procdir = sys.argv[1]
+if len(sys.argv) > 2:
+    iterations = int(sys.argv[2])
+
+texts = []
+for fname in sorted(glob.glob(os.path.join(procdir, "card*", "pair*", "dom*", "comstat"))):
+    with open(fname) as f:
+        texts.append(f.read())
+
+if not texts:
+    print("No comstat files found under %s" % procdir)
+    sys.exit(-1)
+
+class LegacyCommStats:
+    """The original CommStats parser, for comparison"""
+    def __init__(self, txt):
+        m = re.search(dor.CommStats.CSPAT, txt)
+        groups = list(m.groups())
+        for k in dor.CommStats.FIELDS:
+            v = groups.pop(0)
+            if k in ('card', 'pair') or k in dor.CommStats.COUNTER_INDEX:
+                v = int(v)
+            elif k in ('open', 'connected'):
+                v = (v == 'true') and True or False
+            setattr(self, k, v)
+
+# Make sure the parsers agree before timing them
+for txt in texts:
+    old = LegacyCommStats(txt)
+    new = dor.CommStats(txt)
+    for k in dor.CommStats.FIELDS:
+        if getattr(old, k) != getattr(new, k):
+            print("Parser mismatch for %s in comstat text:\n%s" % (k, txt))
+            sys.exit(-1)
+
+def parseAll(parser):
+    for txt in texts:
+        parser(txt)
+
+def hubmoniCounters(txt):
+    # The counters hubmoni reports every cycle
+    cs = dor.CommStats(txt)
+    return (cs.nretxb, cs.badpkt, cs.rxbytes, cs.txbytes)
+
+def allCounters(txt):
+    return dor.CommStats(txt).counters()
+
+results = {}
+for name, parser in (("legacy", LegacyCommStats),
+                     ("CommStats", dor.CommStats),
+                     ("+4 ctrs", hubmoniCounters),
+                     ("+all ctrs", allCounters)):
+    t = min(timeit.repeat(lambda: parseAll(parser), number=iterations, repeat=7))
+    results[name] = t
+    print("%-10s %8.2f us/parse" % (name, 1e6*t/(iterations*len(texts))))
+
+print("speedup (legacy/CommStats+4 counters): %.2fx over %d comstat files" %
+      (results["legacy"]/results["+4 ctrs"], len(texts)))
@@ -9,30 +9,98 @@
 from __future__ import print_function
 import sys
 import os
+import json
+import tempfile
 
 NICKPATHS = ["./resources", "/mnt/data/testdaq", ".", os.environ['HOME']]
 NICKFILE = "nicknames.txt"
 
+# Compiled copy of the nicknames file, stored next to it
+CACHE_SUFFIX = ".cache"
+CACHE_VERSION = 2
+
 class NicknamesException(Exception): pass
 
 class Nicknames:
+    """DOM names, production IDs, and positions keyed by mainboard ID.
+    The nicknames file is located when the object is created but is only
+    loaded on the first lookup, from a compiled cache file if it is
+    newer than the text file."""
+
+    # Attributes that are filled in on demand
+    LOADED = ('posDict', 'idDict', 'nameDict')
+    INDEXED = ('index', 'indexLower')
     
     def __init__(self, nicknameFile=NICKFILE):
+        self.filename = self.findFile(nicknameFile)
+
+    def __getattr__(self, attr):
+        if attr in Nicknames.LOADED:
+            self.load()
+        elif attr in Nicknames.INDEXED:
+            self.buildIndex()
+        else:
+            raise AttributeError(attr)
+        return self.__dict__[attr]
+
+    def findFile(self, filename):
+        for path in NICKPATHS:
+            fullpath = os.path.join(path, filename)
+            if os.path.isfile(fullpath):
+                return fullpath
+        raise NicknamesException("Couldn't find nicknames file for MBID mapping.")
+
+    def cacheKey(self):
+        st = os.stat(self.filename)
+        return (CACHE_VERSION, st.st_size, st.st_mtime)
+
+    def load(self):
+        """Load the nicknames from the compiled cache if it's current,
+        otherwise parse the text file and refresh the cache"""
+        cacheFile = self.filename + CACHE_SUFFIX
+        try:
+            key = self.cacheKey()
+        except EnvironmentError:
+            raise NicknamesException("Couldn't read nicknames file %s" % self.filename)
+        try:
+            # Plain JSON data, so a planted cache can't run code
+            with open(cacheFile, "r") as f:
+                cache = json.load(f)
+            if cache["key"] == list(key):
+                self.posDict = dict((mbid, tuple(pos)) for mbid, pos in cache["pos"].items())
+                self.idDict = cache["id"]
+                self.nameDict = cache["name"]
+                return
+        except Exception:
+            # Missing, stale, or unreadable; rebuild it
+            pass
+
+        self.initializeDicts(self.filename)
+        tmpFile = None
+        try:
+            # Fresh file that can't be a planted one or a symlink
+            fd, tmpFile = tempfile.mkstemp(prefix=os.path.basename(cacheFile)+".",
+                                           dir=os.path.dirname(cacheFile) or ".")
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "w") as f:
+                json.dump({ "key" : list(key), "pos" : self.posDict,
+                            "id" : self.idDict, "name" : self.nameDict }, f)
+            os.rename(tmpFile, cacheFile)
+        except EnvironmentError:
+            # Not writable; we just won't have a cache
+            if tmpFile is not None:
+                try:
+                    os.unlink(tmpFile)
+                except EnvironmentError:
+                    pass
+        
+    def initializeDicts(self, filename):
         self.posDict = {}
         self.idDict = {}
         self.nameDict = {}
-        self.initializeDicts(nicknameFile)
-        
-    def initializeDicts(self, filename):
-        f = None
-        for path in NICKPATHS:
-            try:
-                f = open(os.path.join(path, filename), "r")
-                break
-            except EnvironmentError:
-                pass
-
-        if f is None:
+        try:
+            f = open(filename, "r")
+        except EnvironmentError:
             raise NicknamesException("Couldn't find nicknames file for MBID mapping.")
 
         # Skip header
@@ -53,6 +121,30 @@ class Nicknames:
                     pass
         f.close()
         
+    def buildIndex(self):
+        """Build the reverse lookup tables used by findMBID.  Keys are
+        MBIDs, names, production IDs, and positions both as a (string, dom)
+        tuple and as a "string-dom" OMKey string.  An MBID always maps to
+        itself; otherwise the first DOM in the nicknames file with a
+        matching name, position, or production ID wins."""
+        index = {}
+        for mbid in self.nameDict:
+            index[mbid] = mbid
+        for mbid in self.nameDict:
+            keys = [self.nameDict[mbid]]
+            if mbid in self.posDict:
+                keys += [self.posDict[mbid], "%d-%d" % self.posDict[mbid]]
+            if mbid in self.idDict:
+                keys.append(self.idDict[mbid])
+            for k in keys:
+                index.setdefault(k, mbid)
+        indexLower = {}
+        for k in index:
+            if isinstance(k, str):
+                indexLower.setdefault(k.lower(), index[k])
+        self.index = index
+        self.indexLower = indexLower
+
     def getDOMPosition(self, mbid):
         if mbid in self.posDict:
             return self.posDict[mbid]
@@ -72,27 +164,31 @@ class Nicknames:
             return None
         
     def findMBID(self, dom):
-        # Is this a mainboard ID already?
-        if dom in self.nameDict:
-            return dom
-        for mbid in self.nameDict:
-            if dom == self.nameDict[mbid]:
-                return mbid
-            if (mbid in self.posDict) and (dom == self.posDict[mbid]):
-                return mbid    
-            if (mbid in self.idDict) and (dom == self.idDict[mbid]):
-                return mbid
-        return None
+        """Find the MBID for a DOM given its MBID, name, production ID, or
+        position (either a (string, dom) tuple or a "string-dom" string).
+        Exact matches are preferred, then case-insensitive ones."""
+        try:
+            mbid = self.index.get(dom)
+        except TypeError:
+            # Unhashable query
+            return None
+        if (mbid is None) and isinstance(dom, str):
+            mbid = self.indexLower.get(dom.lower())
+        return mbid
+
+    def resolve(self, doms):
+        """Find the MBIDs for a list of DOMs; see findMBID.  Returns a list
+        in the same order, with None for any DOM that isn't found."""
+        return [self.findMBID(dom) for dom in doms]
 
 def main():    
-    if len(sys.argv) != 2:
-        print("Usage: %s <dom>" % sys.argv[0])
+    if len(sys.argv) < 2:
+        print("Usage: %s <dom> [<dom> ...]" % sys.argv[0])
         sys.exit(0)
-    dom = sys.argv[1]
     nicks = Nicknames()
-    mbid = nicks.findMBID(dom)
-    if mbid is not None:
-        print(mbid, nicks.getDOMID(mbid), nicks.getDOMName(mbid), nicks.getDOMPosition(mbid))
+    for mbid in nicks.resolve(sys.argv[1:]):
+        if mbid is not None:
+            print(mbid, nicks.getDOMID(mbid), nicks.getDOMName(mbid), nicks.getDOMPosition(mbid))
     
 if __name__ == "__main__":
     main()
@@ -15,6 +15,7 @@ setup(name='domhub-tools-python',
       author_email='jkelley@icecube.wisc.edu',
       url='http://icecube.wisc.edu',
       test_suite="tests",
-      scripts=['bin/hubmoni', 'bin/domstate.py', 'bin/status.py', 'bin/flasher.py'],
+      scripts=['bin/hubmoni', 'bin/domstate.py', 'bin/status.py', 'bin/flasher.py',
+               'bin/hubmonispool.py', 'bin/hubmonihistory.py', 'bin/simhub.py'],
       packages=find_packages(exclude=["tests"])
       )
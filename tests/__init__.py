@@ -1,2 +1,2 @@
-__all__ = ['test_dor', 'test_nicknames', 'test_moniDOMs', 'test_hubconfig']
+__all__ = ['test_dor', 'test_nicknames', 'test_moniDOMs', 'test_hubconfig', 'test_scheduler', 'test_sender', 'test_spool', 'test_history', 'test_moniStats', 'test_comstats', 'test_alertManager', 'test_alertRules', 'test_snapshotServer', 'test_dorsim']
 
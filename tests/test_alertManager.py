@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import hubmonitools
+from hubmonitools import AlertManager, HubMoniAlert
+
+class AlertManagerTests(unittest.TestCase):
+
+    HUBMONICONFIG = os.path.dirname(os.path.abspath(__file__))+"/hubmoni.config"
+
+    def setUp(self):
+        self.config = hubmonitools.HubMoniConfig(AlertManagerTests.HUBMONICONFIG)
+
+    def alert(self, cond, desc="details", hub="ichub29", cluster="spts"):
+        return HubMoniAlert(self.config, hub, cluster, alert_txt=cond, alert_desc=desc)
+
+    def testKey(self):
+        a = self.alert("cond1", "first")
+        b = self.alert("cond1", "second")
+        self.assertEqual(a.key(), ("cond1", "ichub29", "spts"))
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, self.alert("cond1", hub="ichub30"))
+        self.assertEqual(len(set([a, b, self.alert("cond2")])), 2)
+
+    def testRaiseClear(self):
+        mgr = AlertManager()
+        a, b, c = self.alert("a"), self.alert("b"), self.alert("c")
+        self.assertEqual(mgr.update([a, b, c], now=0), [a, b, c])
+        for x in (a, b, c):
+            mgr.sent(x, now=0)
+        # Active alerts aren't sent again
+        self.assertEqual(mgr.update([a, b, c], now=10), [])
+        self.assertEqual(mgr[a.key()].firstSeen, 0)
+        self.assertEqual(mgr[a.key()].lastSeen, 10)
+
+        # Clearing several at once clears all of them
+        self.assertEqual(mgr.update([c], now=20), [])
+        self.assertEqual(mgr.active(), [c])
+        self.assertFalse(a.key() in mgr)
+
+        # A cleared alert that comes back is new
+        self.assertEqual(mgr.update([a, c], now=30), [a])
+        self.assertEqual(mgr[a.key()].firstSeen, 30)
+
+    def testPending(self):
+        # Alerts that weren't sent (paused) stay due
+        mgr = AlertManager()
+        a = self.alert("a")
+        self.assertEqual(mgr.update([a], now=0), [a])
+        self.assertEqual(mgr.update([a], now=1), [a])
+        mgr.sent(a, now=1)
+        self.assertEqual(mgr.update([a], now=2), [])
+
+    def testRenotify(self):
+        mgr = AlertManager(renotify=100)
+        a = self.alert("a")
+        for x in mgr.update([a], now=0):
+            mgr.sent(x, now=0)
+        self.assertEqual(mgr.update([a], now=99), [])
+        self.assertEqual(mgr.update([a], now=100), [a])
+        mgr.sent(a, now=100)
+        self.assertEqual(mgr[a.key()].sendCount, 2)
+
+    def testHoldoff(self):
+        mgr = AlertManager(holdoff=60)
+        a = self.alert("a")
+        for x in mgr.update([a], now=0):
+            mgr.sent(x, now=0)
+        mgr.update([], now=10)
+        self.assertEqual(len(mgr), 0)
+        # Flapping back within the holdoff isn't a new occurrence
+        self.assertEqual(mgr.update([a], now=30), [])
+        self.assertEqual(mgr[a.key()].firstSeen, 0)
+        mgr.update([], now=40)
+        self.assertEqual(mgr.update([a], now=200), [a])
+
+    def testSuppress(self):
+        mgr = AlertManager()
+        a = self.alert("a")
+        mgr.suppress(a.key(), 50, now=0)
+        self.assertEqual(mgr.update([a], now=10), [])
+        self.assertEqual(len(mgr), 1)
+        self.assertEqual(mgr.update([a], now=50), [a])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(AlertManagerTests)
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import dor
+import hubmonitools
+from hubmonitools.alertRules import AlertRules, RuleException
+from hubmonitools.comstats import ComstatArray
+from hubmonitools.moniStats import timestamp
+
+class AlertRulesTests(unittest.TestCase):
+
+    HUBMONICONFIG = os.path.dirname(os.path.abspath(__file__))+"/hubmoni.config"
+
+    def setUp(self):
+        self.config = hubmonitools.HubMoniConfig(AlertRulesTests.HUBMONICONFIG)
+        self.dor = dor.DOR(prefix=self.config.DOR_PREFIX)
+        self.snapshot = self.dor.snapshot()
+        self.hubconfig = hubmonitools.HubConfig(self.config.HUBCONFIG)
+        self.hub, self.cluster = hubmonitools.getHostCluster(self.config.HOSTNAME)
+
+    def rules(self, *specs):
+        return AlertRules(self.config, specs, self.hubconfig, self.hub, self.cluster)
+
+    def descs(self, alerts):
+        return [a["value"]["desc"] for a in alerts]
+
+    def testThresholds(self):
+        rules = self.rules({ "name" : "high current", "type" : "threshold",
+                             "quantity" : "current", "max" : 100 },
+                           { "name" : "low voltage", "type" : "threshold",
+                             "quantity" : "voltage", "min" : 89 },
+                           { "name" : "ok voltage", "type" : "threshold",
+                             "quantity" : "voltage", "min" : 80, "max" : 90 })
+        self.assertEqual(len(rules), 3)
+        alerts = rules.evaluate(self.snapshot)
+        self.assertEqual([a["value"]["condition"] for a in alerts],
+                         ["%s: high current" % self.hub, "%s: low voltage" % self.hub])
+        self.assertEqual(self.descs(alerts),
+                         ["spts-ichub29: current above 100: c0p1 (101)",
+                          "spts-ichub29: voltage below 89: c0p1 (88.928)"])
+
+        # The live driver gives the same answers
+        self.assertEqual(self.descs(rules.evaluate(self.dor)), self.descs(alerts))
+
+    def testWaivers(self):
+        spec = { "name" : "high current", "type" : "threshold",
+                 "quantity" : "current", "max" : 98 }
+        self.assertEqual(self.descs(self.rules(spec).evaluate(self.snapshot)),
+                         ["spts-ichub29: current above 98: c0p0 (99), c0p1 (101)"])
+        spec["waive"] = ["c0p0"]
+        self.assertEqual(self.descs(self.rules(spec).evaluate(self.snapshot)),
+                         ["spts-ichub29: current above 98: c0p1 (101)"])
+
+        # Waivers from the hub configuration apply unless turned off
+        self.hubconfig[self.cluster][self.hub]["waive"] = ["c0p1"]
+        self.assertEqual(self.rules(spec).evaluate(self.snapshot), [])
+        spec["waive"] = False
+        self.assertEqual(len(self.rules(spec).evaluate(self.snapshot)), 1)
+
+    def testCounts(self):
+        rules = self.rules({ "name" : "DOMs in configboot", "type" : "count",
+                             "quantity" : "notconfigboot", "expect" : "iceboot" },
+                           { "name" : "DOR cards", "type" : "count",
+                             "quantity" : "cards", "expect" : "dor" },
+                           { "name" : "too few plugged", "type" : "count",
+                             "quantity" : "plugged", "min" : 3 })
+        alerts = rules.evaluate(self.snapshot)
+        self.assertEqual(self.descs(alerts),
+                         ["spts-ichub29: notconfigboot count not 4: found 3",
+                          "spts-ichub29: plugged count below 3: found 2"])
+
+        # DOMs whose is-not-configboot wasn't read aren't counted either way
+        readProcFile = dor.dor.readProcFile
+        def failingRead(path):
+            if path.endswith(os.path.join("domB", "is-not-configboot")):
+                raise IOError("bogus")
+            return readProcFile(path)
+        dor.dor.readProcFile = failingRead
+        try:
+            snapshot = self.dor.snapshot(timeout=1)
+        finally:
+            dor.dor.readProcFile = readProcFile
+        rules = self.rules({ "name" : "DOMs in configboot", "type" : "count",
+                             "quantity" : "configboot", "max" : 0 },
+                           { "name" : "DOMs out of configboot", "type" : "count",
+                             "quantity" : "notconfigboot", "expect" : 2 })
+        self.assertEqual(rules.evaluate(snapshot), [])
+
+    def testCounterThresholdsAndRates(self):
+        rules = self.rules({ "name" : "rx bytes", "type" : "threshold",
+                             "quantity" : "rxbytes", "max" : 0 },
+                           { "name" : "bad packets", "type" : "rate",
+                             "quantity" : "badpkt", "max" : 1 })
+        alerts = rules.evaluate(self.snapshot)
+        # No rates until there's a previous sample
+        self.assertEqual([a["value"]["condition"] for a in alerts], ["%s: rx bytes" % self.hub])
+        self.assertEqual(alerts[0]["value"]["desc"].count("("), 4)
+
+        # Fake an earlier sample with fewer bad packets on one DOM
+        t = timestamp(self.snapshot.time)
+        prev = ComstatArray.fromSnapshot(self.snapshot, t-2)
+        prev.counts[:, dor.CommStats.COUNTER_INDEX["badpkt"]] -= 1
+        prev.counts[1, dor.CommStats.COUNTER_INDEX["badpkt"]] -= 9
+        rules.prev = prev
+        alerts = rules.evaluate(self.snapshot)
+        self.assertEqual(alerts[1]["value"]["desc"],
+                         "spts-ichub29: badpkt rate above 1: 00B (5)")
+        self.assertEqual(rules.prev.time, t)
+
+    def testMoniAlerts(self):
+        rules = self.rules({ "name" : "high current", "type" : "threshold",
+                             "quantity" : "current", "max" : 100 })
+        alerts = hubmonitools.moniAlerts(self.config, self.snapshot, self.hubconfig,
+                                         self.hub, self.cluster, rules)
+        self.assertEqual([a["value"]["condition"] for a in alerts],
+                         ["%s: DOM power check failure" % self.hub,
+                          "%s: high current" % self.hub])
+
+    def testBadRules(self):
+        good = { "name" : "x", "type" : "threshold", "quantity" : "current", "max" : 1 }
+        for change in ({ "type" : "bogus" }, { "quantity" : "bogus" },
+                       { "type" : "rate", "quantity" : "current" },
+                       { "max" : None }, { "max" : "bogus" }, { "max" : "waive" },
+                       { "waive" : ["c9p9"] }, { "waive" : "c0p0" }):
+            spec = dict(good)
+            spec.update(change)
+            self.assertRaises(RuleException, self.rules, spec)
+        self.assertRaises(RuleException, self.rules, { "type" : "count" })
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(AlertRulesTests)
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import numpy
+import dor
+import hubmonitools
+from hubmonitools.comstats import ComstatArray
+from hubmonitools.history import CWDS
+
+class ComstatArrayTests(unittest.TestCase):
+
+    HUBMONICONFIG = os.path.dirname(os.path.abspath(__file__))+"/hubmoni.config"
+
+    def setUp(self):
+        self.config = hubmonitools.HubMoniConfig(ComstatArrayTests.HUBMONICONFIG)
+        self.dor = dor.DOR(prefix=self.config.DOR_PREFIX)
+
+    def sample(self):
+        return dict((d.cwd(), hubmonitools.HubMoniDOM(d, "ichub29"))
+                    for d in self.dor.getCommunicatingDOMs())
+
+    def testFromSnapshot(self):
+        snapshot = self.dor.snapshot()
+        arr = ComstatArray.fromSnapshot(snapshot)
+        self.assertEqual(arr.cwds(), sorted(d.cwd() for d in snapshot.getCommunicatingDOMs()))
+        for d in snapshot.getCommunicatingDOMs():
+            cs = d.commStats()
+            for c in dor.CommStats.COUNTERS:
+                self.assertEqual(arr.get(d.cwd(), c), getattr(cs, c))
+        self.assertEqual(arr.get('71B', 'rxbytes'), None)
+        self.assertEqual(arr.counts.shape, (64, len(dor.CommStats.COUNTERS)))
+
+    def testDeltaRateResets(self):
+        prev = self.sample()
+        cur = self.sample()
+        cur['01A'].comstat.badpkt += 8
+        cur['00A'].comstat.rxbytes -= 1
+        a0 = ComstatArray.fromMoniDOMs(prev, t=100.0)
+        a1 = ComstatArray.fromMoniDOMs(cur, t=104.0)
+
+        i = CWDS.index('01A')
+        d, both = a1.delta(a0)
+        col = dor.CommStats.COUNTER_INDEX['badpkt']
+        self.assertEqual(list(numpy.nonzero(d[:, col])[0]), [i])
+        self.assertEqual(int(both.sum()), len(prev))
+
+        resets = a1.resets(a0)
+        self.assertEqual(int(resets.sum()), 1)
+        self.assertTrue(resets[0, dor.CommStats.COUNTER_INDEX['rxbytes']])
+
+        r = a1.rate(a0)
+        self.assertEqual(r[i, col], 2.0)
+        self.assertTrue(numpy.isnan(r[0, dor.CommStats.COUNTER_INDEX['rxbytes']]))
+        self.assertTrue(numpy.isnan(r[63]).all())
+        self.assertRaises(ValueError, a0.rate, a1)
+
+    def testAllCounterRecords(self):
+        # Any counter can be reported
+        self.config.MONI_COMSTAT_COUNTERS = ['nconnects', 'badpkt']
+        prev = self.sample()
+        cur = self.sample()
+        cur['01A'].comstat.nconnects += 2
+        recs = hubmonitools.moniRecords(self.config, cur, prev)
+        names = [r["varname"] for r in recs]
+        self.assertEqual(names.count("dom_comstat_badpkt"), 1)
+        self.assertEqual(names[-1], "dom_cabling")
+        rec = [r for r in recs if r["varname"] == "dom_comstat_nconnects"][0]
+        self.assertTrue(rec.valid and rec.countQty)
+        self.assertEqual(rec.getDOMValue("2029-4"), 2)
+        self.assertEqual(rec.getDOMValue("2029-2"), 0)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ComstatArrayTests)
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
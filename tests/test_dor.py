@@ -4,6 +4,51 @@ import unittest
 import math
 import dor
 import os
+import shutil
+import tempfile
+import glob
+import re
+import time
+import threading
+import select
+import tty
+
+class DOMResponder(threading.Thread):
+    """Answers DOM state probes on the master side of a set of ptys"""
+    def __init__(self, modes):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.devdir = tempfile.mkdtemp()
+        self.modes = {}
+        self.slaves = []
+        for cwd in modes:
+            master, slave = os.openpty()
+            tty.setraw(slave)
+            self.slaves.append(slave)
+            self.modes[master] = modes[cwd]
+            os.symlink(os.ttyname(slave),
+                       os.path.join(self.devdir, "dhc%sw%sd%s" % (cwd[0], cwd[1], cwd[2])))
+        self.keepAlive = True
+
+    def run(self):
+        while self.keepAlive:
+            r, w, x = select.select(list(self.modes.keys()), [], [], 0.05)
+            for fd in r:
+                msg = os.read(fd, 1024)
+                mode = self.modes[fd]
+                if mode == "domapp" and msg == bytes(dor.dor.DOMAPP_REQUEST_ID):
+                    os.write(fd, bytes(dor.dor.DOMAPP_ID_RESPONSE)+b'\x00'*12)
+                elif mode == "iceboot" and msg == b'\r':
+                    os.write(fd, b'\r\n> ')
+                elif mode == "configboot" and msg == b'\r':
+                    os.write(fd, b'\r\n# ')
+
+    def stop(self):
+        self.keepAlive = False
+        self.join()
+        for fd in list(self.modes.keys()) + self.slaves:
+            os.close(fd)
+        shutil.rmtree(self.devdir)
 
 class DORTests(unittest.TestCase):
 
@@ -57,6 +102,47 @@ class DORTests(unittest.TestCase):
         self.assertTrue((cs.rxbytes == 157090610) and (cs.nretxb == 0) and
                         (cs1.txacks == 26566) and (cs1.rxacks == 478))
 
+    def testCommStatsAllFields(self):
+        for fname in glob.glob(DORTests.PREFIX+"/card*/pair*/dom*/comstat"):
+            with open(fname) as f:
+                txt = f.read()
+            groups = re.search(dor.CommStats.CSPAT, txt).groups()
+            cs = dor.CommStats(txt)
+            for k, v in zip(dor.CommStats.FIELDS, groups):
+                if k in dor.CommStats.COUNTERS:
+                    self.assertEqual(getattr(cs, k), int(v))
+            self.assertEqual(cs.counters(), tuple(int(v) for v in groups[3:29]))
+        cs = self.dor.getDOM('01B').commStats()
+        self.assertTrue((cs.card == 0) and (cs.pair == 1) and (cs.dom == 'B') and
+                        (cs.nackq == -1) and cs.open and cs.connected and
+                        (cs.txfifo == "almost empty,notempty") and
+                        (cs.dom_rxfifo == "notfull"))
+
+    def testCommStatsFlags(self):
+        # The driver prints the OPEN/CONNECTED flags in either case
+        txt = self.dor.getDOM('01B').commStats().text
+        self.assertTrue("OPEN=true CONNECTED=true" in txt)
+        for flags, expected in (("OPEN=true CONNECTED=true", (True, True)),
+                                ("OPEN=TRUE CONNECTED=FALSE", (True, False)),
+                                ("OPEN=false CONNECTED=TRUE", (False, True)),
+                                ("OPEN=FALSE CONNECTED=FALSE", (False, False))):
+            cs = dor.CommStats(txt.replace("OPEN=true CONNECTED=true", flags))
+            self.assertEqual((cs.open, cs.connected), expected)
+            self.assertEqual(dor.dor.inferState((True, True, cs.open, cs.connected, 0, 0, 0)),
+                             cs.open and "busy" or None)
+
+    def testCommStatsModified(self):
+        cs = self.dor.getDOM('00A').commStats()
+        cs.badpkt += 8
+        self.assertEqual(cs.badpkt, 10)
+        self.assertEqual(cs.counters()[dor.CommStats.COUNTER_INDEX['badpkt']], 10)
+        self.assertRaises(AttributeError, getattr, cs, 'bogus')
+
+    def testCommStatsGarbage(self):
+        self.assertRaises(dor.InvalidComstatException, dor.CommStats, None)
+        self.assertRaises(dor.InvalidComstatException, dor.CommStats,
+                          "/dev/dhc0w0dA is not ready (not powered, communicating and/or opened)")
+
     def testPwrCheck(self):
         pc = self.dor.cards[0].pairs[0].pwrCheck()
         self.assertTrue((pc.card == 0) and (pc.pair == 0) and pc.plugged and
@@ -76,6 +162,301 @@ class DORTests(unittest.TestCase):
         dom = self.dor.getDOM('01B')
         self.assertEqual(dom.dev(), "/dev/dhc0w1dB")
 
+    def testDOMReadTerminates(self):
+        dom = self.dor.getDOM('00A')
+        r, w = os.pipe()
+        dom.f = r
+        try:
+            os.write(w, bytes(dor.dor.DOMAPP_ID_RESPONSE)+b'\x00'*12)
+            t = time.time()
+            resp = dom.read(timeout=2, length=dor.dor.DOMAPP_ID_RESPONSE_LEN)
+            self.assertEqual(len(resp), dor.dor.DOMAPP_ID_RESPONSE_LEN)
+            self.assertTrue(time.time()-t < 0.5)
+
+            # Prompt arrives in pieces, after a pause
+            os.write(w, b'enableFB .\r\n')
+            def reply():
+                time.sleep(0.3)
+                os.write(w, b'0\r\n> ')
+            thread = threading.Thread(target=reply)
+            thread.start()
+            t = time.time()
+            resp = dom.read(timeout=2, prompt='> ')
+            thread.join()
+            self.assertEqual(resp, b'enableFB .\r\n0\r\n> ')
+            self.assertTrue(time.time()-t < 1)
+        finally:
+            dom.f = None
+            os.close(r)
+            os.close(w)
+
+    def testDOMReadTimeout(self):
+        dom = self.dor.getDOM('00A')
+        r, w = os.pipe()
+        dom.f = r
+        try:
+            t = time.time()
+            self.assertEqual(dom.read(timeout=0.2), b'')
+            self.assertTrue(time.time()-t >= 0.2)
+            # Without a termination condition, a quiet reply is complete
+            os.write(w, b'garbage')
+            t = time.time()
+            self.assertEqual(dom.read(timeout=5, idle=0.1), b'garbage')
+            self.assertTrue(time.time()-t < 1)
+        finally:
+            dom.f = None
+            os.close(r)
+            os.close(w)
+
+    def testDOMStates(self):
+        responder = DOMResponder({'00A':'domapp', '00B':'configboot',
+                                  '01A':'iceboot', '01B':'hung'})
+        responder.start()
+        devpath = dor.dor.DEVPATH
+        dor.dor.DEVPATH = responder.devdir
+        try:
+            doms = self.dor.getPluggedDOMs()
+            # Record when each DOM's device is let go of
+            closed = {}
+            def closer(dom, close):
+                def recordClose():
+                    closed.setdefault(dom.cwd(), time.time())
+                    close()
+                return recordClose
+            for d in doms:
+                d.close = closer(d, d.close)
+            t = time.time()
+            states = dor.DOMStateProber(doms, timeout=1).run()
+            elapsed = time.time()-t
+            for d in doms:
+                del d.close
+            # Answered DOMs are closed at once, not at the deadline
+            self.assertTrue(closed['00A'] - t < 0.5)
+            self.assertTrue(closed['01B'] - t >= 1)
+            self.assertEqual(states, {'00A':'domapp', '00B':'configboot',
+                                      '01A':'iceboot', '01B':'busy'})
+            # All DOMs are probed concurrently within one deadline
+            self.assertTrue(elapsed < 1.5)
+            self.assertTrue(all([d.f is None for d in doms]))
+            self.assertEqual(self.dor.getDOM('01A').state(), 'iceboot')
+            self.assertEqual(self.dor.getDOMStates([self.dor.snapshot().getDOM('00A'),
+                                                    self.dor.getDOM('10A')]),
+                             {'00A':'domapp', '10A':'nocomm'})
+        finally:
+            dor.dor.DEVPATH = devpath
+            responder.stop()
+
+    def testStateInference(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prefix = os.path.join(tmpdir, "domhub")
+            shutil.copytree(DORTests.PREFIX, prefix)
+            d = dor.DOR(prefix)
+            # Open by someone else
+            path = os.path.join(prefix, "card0", "pair1", "domA", "comstat")
+            with open(path) as f:
+                txt = f.read()
+            with open(path, "w") as f:
+                f.write(txt.replace("OPEN=FALSE", "OPEN=TRUE"))
+            self.assertTrue(d.getDOM('01A').commStats().open)
+
+            # Nothing needs a probe; there are no devices to answer one
+            self.assertEqual(d.getDOMStates([d.getDOM(c) for c in ('00B', '01A', '10A')]),
+                             { '00B' : 'configboot', '01A' : 'busy', '10A' : 'nocomm' })
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testStateCache(self):
+        tmpdir = tempfile.mkdtemp()
+        responder = DOMResponder({'00A':'domapp', '01A':'iceboot'})
+        responder.start()
+        devpath = dor.dor.DEVPATH
+        dor.dor.DEVPATH = responder.devdir
+        try:
+            prefix = os.path.join(tmpdir, "domhub")
+            shutil.copytree(DORTests.PREFIX, prefix)
+            d = dor.DOR(prefix)
+            now = [1000.0]
+            d.stateCache.clock = lambda : now[0]
+            doms = [d.getDOM(c) for c in ('00A', '01A', '01B')]
+            self.assertEqual(d.getDOMStates(doms),
+                             { '00A' : 'domapp', '01A' : 'iceboot', '01B' : 'busy' })
+
+            # Answered from the cache (01B is open, so never probed)
+            dor.dor.DEVPATH = "/bogus"
+            self.assertEqual(d.getDOMStates(doms),
+                             { '00A' : 'domapp', '01A' : 'iceboot', '01B' : 'busy' })
+            self.assertEqual(d.getDOM('01A').state(), 'iceboot')
+
+            # ...until they're too old
+            self.assertEqual(d.getDOM('01A').state(maxAge=10), 'iceboot')
+            now[0] += 11
+            self.assertEqual(d.getDOM('01A').state(maxAge=10), 'error')
+            dor.dor.DEVPATH = responder.devdir
+            self.assertEqual(d.getDOM('01A').state(), 'iceboot')
+            now[0] += dor.dor.STATE_CACHE_TTL + 1
+            dor.dor.DEVPATH = "/bogus"
+            self.assertEqual(d.getDOM('00A').state(), 'error')
+
+            # ...or the DOM's proc indicators change
+            dor.dor.DEVPATH = responder.devdir
+            self.assertEqual(d.getDOM('00A').state(), 'domapp')
+            dor.dor.DEVPATH = "/bogus"
+            path = os.path.join(prefix, "card0", "pair0", "domA", "comstat")
+            with open(path) as f:
+                txt = f.read()
+            with open(path, "w") as f:
+                f.write(txt.replace("NCONNECTS=0", "NCONNECTS=1"))
+            self.assertEqual(d.getDOM('00A').state(), 'error')
+
+            # maxAge=0 always probes
+            dor.dor.DEVPATH = responder.devdir
+            self.assertEqual(d.getDOM('01A').state(), 'iceboot')
+            dor.dor.DEVPATH = "/bogus"
+            self.assertEqual(d.getDOM('01A').state(), 'iceboot')
+            self.assertEqual(d.getDOM('01A').state(maxAge=0), 'error')
+        finally:
+            dor.dor.DEVPATH = devpath
+            responder.stop()
+            shutil.rmtree(tmpdir)
+
+    def testEpochCache(self):
+        reads = []
+        readProcFile = dor.dor.readProcFile
+        def countingRead(path):
+            reads.append(path)
+            return readProcFile(path)
+        dor.dor.readProcFile = countingRead
+        try:
+            dom = self.dor.getDOM('00A')
+            # No caching by default
+            dom.name(); dom.omkey()
+            self.assertEqual(len(reads), 2)
+
+            del reads[:]
+            self.dor.newEpoch()
+            dom.name(); dom.prodID(); dom.omkey(); dom.pos()
+            dom.pair.current(); dom.pair.current(); dom.pair.card.serial()
+            self.dor.getDOM('00B').pair.card.serial()
+            # The ID is only kept once the DOM is known to be out of configboot
+            self.assertEqual(len(reads), 4)
+
+            # New epoch re-reads dynamic values but not static ones
+            del reads[:]
+            self.dor.newEpoch()
+            dom.pair.current(); dom.mbid(); dom.pair.card.serial()
+            self.assertEqual(len(reads), 1)
+
+            # Static values are dropped when the topology is rescanned
+            del reads[:]
+            self.dor.invalidate()
+            self.dor.getDOM('00A').mbid()
+            self.assertTrue(len([r for r in reads if r.endswith("/id")]) == 1)
+
+            self.dor.endEpoch()
+            del reads[:]
+            dom.pair.current(); dom.pair.current()
+            self.assertEqual(len(reads), 2)
+
+            # Snapshots in an epoch share the static values
+            def static(paths):
+                return [r for r in paths if r.endswith("/id") or r.endswith("/test-log")]
+            snap = self.dor.snapshot()
+            self.assertEqual(len(static(reads)), 6)
+            del reads[:]
+            self.dor.invalidate()
+            self.dor.newEpoch()
+            for timeout in (None, 1, None):
+                self.assertEqual(self.dor.snapshot(timeout=timeout).getDOM('01B').mbid(),
+                                 snap.getDOM('01B').mbid())
+            # except for 00B's, which is in configboot
+            self.assertEqual(len(static(reads)), 6+2)
+            self.assertEqual(len([r for r in reads if r.endswith("/comstat")]), 3*4)
+            self.dor.endEpoch()
+        finally:
+            dor.dor.readProcFile = readProcFile
+
+    def testIDCache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prefix = os.path.join(tmpdir, "domhub")
+            shutil.copytree(DORTests.PREFIX, prefix)
+            dpath = os.path.join(prefix, "card0", "pair0", "domB")
+            def write(fname, txt):
+                with open(os.path.join(dpath, fname), "w") as f:
+                    f.write(txt)
+            d = dor.DOR(prefix)
+            d.newEpoch()
+            dom = d.getDOM('00B')
+            self.assertEqual(dom.mbid(), "000000000000")
+
+            # An ID read in configboot isn't kept
+            write("is-not-configboot", "Card 0 Pair 0 DOM B is out of configboot\n")
+            write("id", "Card 0 Pair 0 DOM B ID is a490e191a5a0\n")
+            d.newEpoch()
+            self.assertEqual(dom.mbid(), "a490e191a5a0")
+            self.assertEqual(dom.omkey(), "2029-3")
+
+            # A valid one is, until the DOM reconnects
+            dom.isCommunicating(); dom.commStats()
+            write("id", "Card 0 Pair 0 DOM B ID is 931e24a072db\n")
+            d.newEpoch()
+            self.assertEqual(dom.mbid(), "a490e191a5a0")
+            with open(os.path.join(dpath, "comstat")) as f:
+                comstat = f.read()
+            write("comstat", comstat.replace("NCONNECTS=0", "NCONNECTS=1"))
+            d.newEpoch()
+            self.assertEqual(dom.commStats().nconnects, 1)
+            self.assertEqual(dom.mbid(), "931e24a072db")
+
+            write("is-communicating", "Card 0 Pair 0 DOM B is NOT communicating\n")
+            d.newEpoch()
+            self.assertFalse(dom.isCommunicating())
+            write("id", "Card 0 Pair 0 DOM B ID is 000000000000\n")
+            self.assertEqual(dom.mbid(), "000000000000")
+            d.endEpoch()
+            dor.dor.procFiles.close(prefix)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testSnapshotIDCache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prefix = os.path.join(tmpdir, "domhub")
+            shutil.copytree(DORTests.PREFIX, prefix)
+            dpath = os.path.join(prefix, "card0", "pair0", "domB")
+            def write(fname, txt):
+                with open(os.path.join(dpath, fname), "w") as f:
+                    f.write(txt)
+            d = dor.DOR(prefix)
+            d.newEpoch()
+            self.assertEqual(d.snapshot().getDOM('00B').mbid(), "000000000000")
+
+            # The DOM leaves configboot
+            write("is-not-configboot", "Card 0 Pair 0 DOM B is out of configboot\n")
+            write("id", "Card 0 Pair 0 DOM B ID is a490e191a5a0\n")
+            d.newEpoch()
+            self.assertEqual(d.snapshot(timeout=1).getDOM('00B').omkey(), "2029-3")
+
+            # and reboots
+            with open(os.path.join(dpath, "comstat")) as f:
+                comstat = f.read()
+            write("comstat", comstat.replace("NCONNECTS=0", "NCONNECTS=1"))
+            write("id", "Card 0 Pair 0 DOM B ID is 931e24a072db\n")
+            d.newEpoch()
+            self.assertEqual(d.snapshot().getDOM('00B').mbid(), "931e24a072db")
+
+            # A new driver revision rescans the topology
+            write("id", "Card 0 Pair 0 DOM B ID is a490e191a5a0\n")
+            with open(os.path.join(prefix, "revision"), "w") as f:
+                f.write("5\n")
+            d.newEpoch()
+            self.assertEqual(d.snapshot().getDOM('00B').mbid(), "a490e191a5a0")
+            d.endEpoch()
+            dor.dor.procFiles.close(prefix)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def testDORSerial(self):
         c = self.dor.cards[1]
         self.assertTrue(c.serial() == 'R1B0628D05')
@@ -113,6 +494,249 @@ FREV  0x09010471
 '''
         self.assertEqual(self.dor.cards[1].fpgaRegs(), fpgastr)
 
+    def testSnapshot(self):
+        snap = self.dor.snapshot()
+        self.assertEqual(len(snap.cards), 2)
+        self.assertEqual(sorted([d.cwd() for d in snap.getCommunicatingDOMs()]),
+                         ['00A', '00B', '01A', '01B'])
+        dom = snap.getDOM('00a')
+        self.assertEqual(dom.pair.current(), 99)
+        self.assertTrue(math.fabs(dom.pair.voltage()-89.124) < 0.001)
+        self.assertTrue(dom.pair.pwrCheck().ok)
+        self.assertEqual(dom.mbid(), "931e24a072db")
+        self.assertEqual(dom.omkey(), "2029-2")
+        self.assertEqual(dom.commStats().rxbytes, 157090610)
+        self.assertEqual(snap[1].serial(), 'R1B0628D05')
+        self.assertTrue(not snap.getDOM('00B').isNotConfigboot())
+        self.assertTrue(not snap[1][3].isPlugged() and snap[1][3].current() is None)
+        self.assertTrue(snap.getDOM('10A').commStats() is None)
+        self.assertTrue(snap.getDOM('70A') is None)
+
+    def testSnapshotMatchesDriver(self):
+        snap = self.dor.snapshot()
+        self.assertEqual([d.cwd() for d in snap.getPluggedDOMs()],
+                         [d.cwd() for d in self.dor.getPluggedDOMs()])
+        for d in self.dor.getPluggedDOMs():
+            s = snap.getDOM(d.cwd())
+            self.assertEqual(s.pair.current(), d.pair.current())
+            self.assertEqual(s.isCommunicating(), d.isCommunicating())
+            self.assertEqual(s.port(), d.port())
+
+    def testSnapshotImmutable(self):
+        snap = self.dor.snapshot()
+        dom = snap.getDOM('00A')
+        self.assertRaises(AttributeError, setattr, snap, 'time', None)
+        self.assertRaises(AttributeError, setattr, dom, '_mbid', 'deadbeefdead')
+        self.assertRaises(AttributeError, setattr, dom.pair, 'id', 3)
+
+    def testSnapshotBadPath(self):
+        snap = dor.DOR("/bogus/mcbogus/").snapshot()
+        self.assertTrue((snap.getCommunicatingDOMs() == []) and (len(snap.cards) == 0))
+
+    def testTopologyCached(self):
+        doms = self.dor.getAllDOMs()
+        self.assertEqual(len(doms), 16)
+        self.assertTrue(self.dor.getAllDOMs()[0] is doms[0])
+        self.assertTrue(self.dor[1][2]['B'] is self.dor.getDOM('12B'))
+        self.assertTrue((self.dor[5] is None) and (self.dor[0][7] is None))
+        self.assertTrue(not self.dor.refresh())
+        self.dor.invalidate()
+        self.assertTrue(self.dor.refresh())
+        self.assertTrue(self.dor.getAllDOMs()[0] is not doms[0])
+
+    def testTopologyChange(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prefix = os.path.join(tmpdir, "domhub")
+            shutil.copytree(DORTests.PREFIX, prefix)
+            d = dor.DOR(prefix)
+            self.assertEqual(len(d.getAllDOMs()), 16)
+            shutil.rmtree(os.path.join(prefix, "card1"))
+            self.assertEqual(len(d.getAllDOMs()), 8)
+            self.assertTrue(d[1] is None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testProcFilePool(self):
+        tmpdir = tempfile.mkdtemp()
+        pool = dor.dor.ProcFilePool(maxFiles=4, bufSize=16)
+        try:
+            prefix = os.path.join(tmpdir, "domhub")
+            shutil.copytree(DORTests.PREFIX, prefix)
+            path = os.path.join(prefix, "card0", "pair0", "domA", "comstat")
+            with open(path) as f:
+                txt = f.read()
+
+            # Files are opened once, and bigger than the initial buffer is ok
+            self.assertEqual(pool.read(path), txt)
+            self.assertEqual(pool.read(path), txt)
+            self.assertEqual((pool.opens, len(pool)), (1, 1))
+
+            # Rewrites show up without reopening
+            with open(path, "w") as f:
+                f.write("changed\n")
+            self.assertEqual(pool.read(path), "changed\n")
+            self.assertEqual(pool.opens, 1)
+
+            # A file that can't be read any more is reopened
+            os.close(pool.fds[path].fd)
+            self.assertEqual(pool.read(path), "changed\n")
+            self.assertEqual(pool.opens, 2)
+
+            # Missing files raise IOError, like open()
+            self.assertRaises(IOError, pool.read, os.path.join(prefix, "bogus"))
+            self.assertEqual(len(pool), 1)
+
+            # The pool doesn't grow past its limit
+            for c in range(2):
+                for w in range(4):
+                    pool.read(os.path.join(prefix, "card%d" % c, "pair%d" % w, "current"))
+            self.assertTrue(len(pool) <= 4)
+            pool.close(prefix)
+            self.assertEqual(len(pool), 0)
+
+            # Eviction is least recently used first, one file at a time
+            paths = [os.path.join(prefix, "card0", "pair%d" % w, "current") for w in range(4)]
+            for p in paths:
+                pool.read(p)
+            pool.read(paths[0])
+            pool.read(path)
+            self.assertEqual(list(pool.fds), paths[2:] + [paths[0], path])
+
+            # A file held by a reader isn't closed under it
+            f = pool.acquire(paths[2])
+            pool.close(prefix)
+            self.assertEqual(len(pool), 0)
+            self.assertTrue(f.removed)
+            with open(paths[2], "rb") as cf:
+                self.assertEqual(pool.pread(f.fd), cf.read())
+            pool.release(f)
+            self.assertRaises(OSError, os.fstat, f.fd)
+        finally:
+            pool.close()
+            shutil.rmtree(tmpdir)
+
+    def testHotProcFiles(self):
+        pool = dor.dor.procFiles
+        dom = self.dor.getDOM('01A')
+        path = os.path.join(dom.path(), "comstat")
+        dom.commStats()
+        self.assertTrue(path in pool.fds)
+        self.assertEqual(dom.commStats().nretxb, 0)
+        self.assertTrue(os.path.join(dom.path(), "id") not in pool.fds)
+
+        # Rescanning the topology closes the tree's files
+        self.dor.invalidate()
+        self.dor.refresh()
+        self.assertTrue(path not in pool.fds)
+
+    def blockingRead(self, blocked, release):
+        """A readProcFile that blocks on paths ending with blocked"""
+        readProcFile = dor.dor.readProcFile
+        def read(path):
+            if path.endswith(blocked):
+                release.wait(10)
+            return readProcFile(path)
+        return read
+
+    def testTimedReader(self):
+        release = threading.Event()
+        readProcFile = dor.dor.readProcFile
+        dor.dor.readProcFile = self.blockingRead("1pps", release)
+        reader = dor.TimedProcReader(timeout=0.1, maxWorkers=2)
+        try:
+            path = os.path.join(DORTests.PREFIX, "card0", "1pps")
+            current = os.path.join(DORTests.PREFIX, "card0", "pair0", "current")
+            t0 = time.time()
+            self.assertRaises(dor.ProcReadTimeout, reader.read, path)
+            self.assertTrue(time.time()-t0 < 1)
+
+            # Other files can still be read, and the blocked one fails at once
+            self.assertEqual(reader.read(current), readProcFile(current))
+            t0 = time.time()
+            self.assertRaises(dor.ProcReadTimeout, reader.read, path, timeout=5)
+            self.assertTrue(time.time()-t0 < 1)
+            self.assertEqual(reader.timeouts, { path : 2 })
+
+            # Past the deadline, reads are deferred without trying, and
+            # don't count as timeouts
+            self.assertRaises(dor.ProcReadDeferred, reader.read, current,
+                              deadline=dor.dor.monotonic())
+            self.assertEqual(reader.timeouts, { path : 2 })
+
+            # Likewise reads stuck in the queue behind blocked workers
+            pps = os.path.join(DORTests.PREFIX, "card1", "1pps")
+            self.assertRaises(dor.ProcReadTimeout, reader.read, pps)
+            self.assertEqual(reader.workers, 2)
+            self.assertRaises(dor.ProcReadDeferred, reader.read, current)
+            self.assertEqual(reader.timeouts, { path : 2, pps : 1 })
+            self.assertEqual(reader.stuck, set([path, pps]))
+
+            # Errors are passed on
+            self.assertRaises(IOError, reader.read, os.path.join(DORTests.PREFIX, "bogus"))
+
+            # Once the stuck read finishes, the file can be read again
+            release.set()
+            for i in range(50):
+                if path not in reader.stuck:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(reader.read(path), readProcFile(path))
+        finally:
+            release.set()
+            dor.dor.readProcFile = readProcFile
+
+    def testPartialSnapshot(self):
+        release = threading.Event()
+        readProcFile = dor.dor.readProcFile
+        dor.dor.readProcFile = self.blockingRead(os.path.join("pair1", "domA", "comstat"),
+                                                 release)
+        try:
+            snap = self.dor.snapshot(timeout=0.1)
+            self.assertTrue(snap.isPartial())
+            self.assertEqual(snap.missing, (os.path.join("card0", "pair1", "domA", "comstat"),))
+            dom = snap.getDOM('01A')
+            self.assertEqual((dom.missing, dom.commStats()), (("comstat",), None))
+            self.assertTrue(dom.isCommunicating() and dom.mbid() is not None)
+            self.assertTrue(snap.getDOM('01B').commStats() is not None)
+            self.assertEqual(self.dor.readTimeouts(),
+                             { os.path.join(snap.getDOM('01A').pair.card.driver.prefix,
+                                            "card0", "pair1", "domA", "comstat") : 1 })
+
+            # Nothing is read once the budget is used up; that's deferred,
+            # not missing
+            snap = self.dor.snapshot(budget=0)
+            self.assertEqual(len(snap.getAllDOMs()), 16)
+            self.assertEqual(snap.getCommunicatingDOMs(), [])
+            self.assertEqual(snap.getDOM('00A').pair.missing, ("is-plugged",))
+            self.assertTrue(snap.isPartial())
+            self.assertEqual(snap.missing, ())
+            self.assertTrue(os.path.join("card0", "pair0", "is-plugged") in snap.deferred)
+            self.assertEqual(self.dor.deferred, list(snap.deferred))
+        finally:
+            release.set()
+            dor.dor.readProcFile = readProcFile
+
+        # Complete snapshots match the untimed ones; deferred files are
+        # read first
+        reads = []
+        def countingRead(path):
+            reads.append(os.path.relpath(path, self.dor.prefix))
+            return readProcFile(path)
+        dor.dor.readProcFile = countingRead
+        try:
+            deferred = list(self.dor.deferred)
+            snap = self.dor.snapshot(timeout=1, budget=10)
+        finally:
+            dor.dor.readProcFile = readProcFile
+        # (after the driver revision, which is checked first)
+        self.assertEqual(reads[1:len(deferred)+1], deferred)
+        self.assertEqual(self.dor.deferred, [])
+        self.assertFalse(snap.isPartial())
+        self.assertEqual([d.commStats().counters() for d in snap.getCommunicatingDOMs()],
+                         [d.commStats().counters()
+                          for d in self.dor.snapshot().getCommunicatingDOMs()])
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(DORTests)
     
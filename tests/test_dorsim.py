@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import dor
+import dorsim
+
+class SimHubTests(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = dorsim.SimHub(seed=1)
+        self.dor = dor.DOR(self.hub.prefix)
+
+    def tearDown(self):
+        dor.dor.procFiles.close(self.hub.prefix)
+        self.hub.cleanup()
+        self.assertFalse(os.path.exists(self.hub.prefix))
+
+    def testFullHub(self):
+        self.assertEqual(len(self.dor.cards), 8)
+        self.assertEqual(len(self.dor.getCommunicatingDOMs()), 64)
+        self.assertEqual(self.dor.cards[7].serial(), "SIM0000007")
+        snap = self.dor.snapshot(timeout=1)
+        self.assertFalse(snap.isPartial())
+        for d in snap.getCommunicatingDOMs():
+            self.assertTrue(d.isNotConfigboot())
+            self.assertEqual(d.mbid(), self.hub.getDOM(d.cwd()).mbid)
+            self.assertEqual(d.commStats().counters(),
+                             tuple(self.hub.getDOM(d.cwd()).counters[c]
+                                   for c in dor.CommStats.COUNTERS))
+        pair = snap.getDOM('73B').pair
+        self.assertTrue(pair.pwrCheck().ok)
+        self.assertTrue(abs(pair.current() - dorsim.procfs.DOM_CURRENT*2) <= 2)
+
+    def testCounters(self):
+        dom = self.hub.getDOM('32A')
+        dom.open = True
+        dom.rates["badpkt"] = 2
+        before = self.dor.snapshot().getDOM('32A').commStats()
+        self.hub.step(10)
+        after = self.dor.snapshot().getDOM('32A').commStats()
+        self.assertTrue(after.open)
+        self.assertTrue(after.rxmsgs > before.rxmsgs)
+        self.assertTrue(16 <= after.badpkt - before.badpkt <= 24)
+        # No messages while closed
+        txmsgs = self.dor.snapshot().getDOM('32B').commStats().txmsgs
+        self.assertEqual(txmsgs, 0)
+
+        self.hub.resetComstats('32A')
+        self.hub.step(0)
+        self.assertEqual(self.dor.snapshot().getDOM('32A').commStats().rxbytes, 0)
+
+    def testFaults(self):
+        self.hub.fail(2, 1, "current_lo")
+        self.hub.unplug(4, 3)
+        self.hub.reboot('50B', "configboot")
+        self.hub.step()
+        snap = self.dor.snapshot()
+        pc = snap.getDOM('21A').pair.pwrCheck()
+        self.assertFalse(pc.ok or pc.current_lo_ok)
+        self.assertTrue(pc.current_hi_ok and pc.voltage_lo_ok)
+        self.assertTrue(snap.getDOM('21A').pair.current() < 20)
+        self.assertFalse(snap.getDOM('43A').pair.isPlugged())
+        self.assertEqual(len(snap.getCommunicatingDOMs()), 62)
+        self.assertFalse(snap.getDOM('50B').isNotConfigboot())
+        self.assertEqual(snap.getDOM('50B').commStats().nconnects, 2)
+        self.assertRaises(ValueError, self.hub.fail, 0, 0, "bogus")
+
+        self.hub.repair(2, 1)
+        self.hub.plug(4, 3)
+        self.hub.step()
+        snap = self.dor.snapshot()
+        self.assertTrue(snap.getDOM('21A').pair.pwrCheck().ok)
+        self.assertEqual(len(snap.getCommunicatingDOMs()), 64)
+
+    def testBlockedFile(self):
+        comstat = os.path.join("card1", "pair2", "domB", "comstat")
+        self.hub.block(comstat)
+        snap = self.dor.snapshot(timeout=0.2)
+        self.assertEqual(snap.missing, (comstat,))
+        self.hub.unblock(comstat)
+        snap = self.dor.snapshot(timeout=1)
+        self.assertFalse(snap.isPartial())
+
+class DOMEmulatorTests(unittest.TestCase):
+
+    MODES = { '00A' : "domapp", '00B' : "iceboot", '01A' : "configboot",
+              '01B' : "slow", '02A' : "hung" }
+
+    def setUp(self):
+        self.hub = dorsim.SimHub(cards=1, modes=DOMEmulatorTests.MODES)
+        self.emulator = dorsim.DOMEmulator(self.hub)
+        self.emulator.start()
+        self.dor = dor.DOR(self.hub.prefix, devpath=self.emulator.devdir)
+
+    def tearDown(self):
+        self.emulator.stop(timeout=1)
+        dor.dor.procFiles.close(self.hub.prefix)
+        self.hub.cleanup()
+
+    def testDevPath(self):
+        dom = self.dor.getDOM('02B')
+        self.assertEqual(dom.dev(), os.path.join(self.emulator.devdir, "dhc0w2dB"))
+        self.assertEqual(dor.DOR(self.hub.prefix).getDOM('02B').dev(), "/dev/dhc0w2dB")
+
+    def testStates(self):
+        self.hub.unplug(0, 3)
+        self.hub.step()
+        states = dor.DOMStateProber(self.dor.getAllDOMs(), timeout=1).run()
+        expected = { '00A' : "domapp", '00B' : "iceboot", '01A' : "configboot",
+                     '01B' : "unknown", '02A' : "busy", '02B' : "domapp",
+                     '03A' : "nocomm", '03B' : "nocomm" }
+        self.assertEqual(states, expected)
+
+        # Slow replies within the prober's wait still count
+        self.hub.getDOM('01B').mode = "domapp"
+        self.hub.getDOM('01B').delay = 0.05
+        self.hub.setMode('02A', "iceboot")
+        states = dor.DOMStateProber([self.dor.getDOM('01B'), self.dor.getDOM('02A')],
+                                    timeout=1).run()
+        self.assertEqual(states, { '01B' : "domapp", '02A' : "iceboot" })
+
+def suite():
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([loader.loadTestsFromTestCase(SimHubTests),
+                               loader.loadTestsFromTestCase(DOMEmulatorTests)])
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+import dor
+import hubmonitools
+from hubmonitools.history import HistoryStore, HistoryException
+
+class HistoryTests(unittest.TestCase):
+
+    HUBMONICONFIG = os.path.dirname(os.path.abspath(__file__))+"/hubmoni.config"
+
+    def setUp(self):
+        self.config = hubmonitools.HubMoniConfig(HistoryTests.HUBMONICONFIG)
+        self.dor = dor.DOR(prefix=self.config.DOR_PREFIX)
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, "history")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def sample(self):
+        return dict((d.cwd(), hubmonitools.HubMoniDOM(d, "ichub29"))
+                    for d in self.dor.getCommunicatingDOMs())
+
+    def testAppendQuery(self):
+        store = HistoryStore(self.fname, slots=10)
+        self.assertEqual(len(store), 0)
+        for i in range(3):
+            s = self.sample()
+            s['01A'].comstat.badpkt += i*8
+            store.append(s, t=1000.0+i)
+        self.assertEqual(len(store), 3)
+
+        times, values = store.query('01a', 'badpkt')
+        self.assertEqual(list(times), [1000.0, 1001.0, 1002.0])
+        self.assertEqual(list(numpy.diff(values)), [8, 8])
+
+        times, values = store.query('00A', 'voltage', start=1001.0, stop=1002.0)
+        self.assertEqual(list(times), [1001.0])
+        self.assertEqual(list(values), [89.124])
+
+        # DOMs that weren't sampled are NaN
+        times, values = store.query('71B', 'rxbytes')
+        self.assertTrue(numpy.isnan(values).all())
+
+        self.assertRaises(HistoryException, store.query, '00A', 'bogus')
+        store.close()
+
+    def testRingBuffer(self):
+        store = HistoryStore(self.fname, slots=4)
+        size = os.path.getsize(self.fname)
+        s = self.sample()
+        for i in range(10):
+            store.append(s, t=float(i))
+        self.assertEqual(len(store), 4)
+        times, values = store.query('00A', 'current')
+        self.assertEqual(list(times), [6.0, 7.0, 8.0, 9.0])
+        self.assertEqual(os.path.getsize(self.fname), size)
+        store.close()
+
+    def testPersistence(self):
+        store = HistoryStore(self.fname, slots=4)
+        store.append(self.sample(), t=5.0)
+        store.close()
+
+        store = HistoryStore(self.fname, readonly=True)
+        self.assertEqual(store.slots, 4)
+        times, values = store.query('00A', 'current')
+        self.assertEqual(list(times), [5.0])
+        self.assertEqual(list(values), [99])
+        store.close()
+
+        self.assertRaises(HistoryException, HistoryStore,
+                          os.path.join(self.tmpdir, "missing"), readonly=True)
+
+    def testSnapshotTime(self):
+        store = HistoryStore(self.fname, slots=4)
+        store.append(self.sample(), t="1970-01-01 00:16:40.500000")
+        times, values = store.query('00A', 'current')
+        self.assertEqual(list(times), [1000.5])
+        store.close()
+
+    def testTruncated(self):
+        store = HistoryStore(self.fname, slots=4)
+        store.close()
+        size = os.path.getsize(self.fname)
+        with open(self.fname, "r+b") as f:
+            f.truncate(size - 8)
+        self.assertRaises(HistoryException, HistoryStore, self.fname)
+        with open(self.fname, "r+b") as f:
+            f.truncate(100)
+        self.assertRaises(HistoryException, HistoryStore, self.fname, readonly=True)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(HistoryTests)
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,9 @@
 import unittest
 import math
 import os
+import json
+import shutil
+import tempfile
 import hubmonitools
 
 class HubConfigTests(unittest.TestCase):
@@ -38,8 +41,82 @@ class HubConfigTests(unittest.TestCase):
                         self.conf.isWaived("ichub07", "sps", 5, 2) and not
                         self.conf.isWaived("ichub13", "sps", 2, 2))        
 
+    def testTypedFields(self):
+        hub = self.conf.getHub("ichub07", cluster="sps")
+        self.assertEqual(hub.waivers, frozenset([(4, 1), (5, 0), (5, 2)]))
+        self.assertEqual((hub.comm, hub.dor, hub.iceboot, hub.quad),
+                         (hub["comm"], hub["dor"], hub["iceboot"], hub["quad"]))
+
+        # Setting an item keeps the typed fields in step, and is validated
+        hub["waive"] = ["c0p1"]
+        self.assertTrue(self.conf.isWaived("ichub07", "sps", 0, 1))
+        self.assertFalse(self.conf.isWaived("ichub07", "sps", 4, 1))
+        hub["comm"] = 3
+        self.assertEqual(hub.comm, 3)
+        self.assertRaises(hubmonitools.HubConfigException, hub.__setitem__, "comm", "3")
+        self.assertRaises(hubmonitools.HubConfigException, hub.__setitem__, "waive", ["c8p0"])
+        self.assertEqual(hub["comm"], 3)
+        self.assertEqual(hub["waive"], ["c0p1"])
+
+class HubConfigLoadTests(unittest.TestCase):
+
+    HUB = { "comm" : 4, "dor" : 2, "iceboot" : 4, "quad" : 1, "waive" : [] }
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, "hubConfig.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data, mtime):
+        with open(self.fname, "w") as f:
+            json.dump(data, f)
+        os.utime(self.fname, (mtime, mtime))
+
+    def testValidation(self):
+        for bad in ([], { "spts" : [] }, { "spts" : { "ichub29" : [] } }):
+            self.write(bad, 1000)
+            self.assertRaises(hubmonitools.HubConfigException, hubmonitools.HubConfig, self.fname)
+        for key, val in (("comm", -1), ("dor", "2"), ("quad", None), ("iceboot", True),
+                         ("waive", "c0p1"), ("waive", ["c0p4"]), ("waive", ["card0"])):
+            hub = dict(HubConfigLoadTests.HUB)
+            hub[key] = val
+            self.write({ "spts" : { "ichub29" : hub } }, 1000)
+            self.assertRaises(hubmonitools.HubConfigException, hubmonitools.HubConfig, self.fname)
+        hub = dict(HubConfigLoadTests.HUB)
+        del hub["quad"]
+        self.write({ "spts" : { "ichub29" : hub } }, 1000)
+        self.assertRaises(hubmonitools.HubConfigException, hubmonitools.HubConfig, self.fname)
+        with open(self.fname, "w") as f:
+            f.write("{ not json")
+        self.assertRaises(hubmonitools.HubConfigException, hubmonitools.HubConfig, self.fname)
+
+    def testReload(self):
+        self.write({ "spts" : { "ichub29" : HubConfigLoadTests.HUB } }, 1000)
+        conf = hubmonitools.HubConfig(self.fname)
+        self.assertFalse(conf.changed())
+
+        hub = dict(HubConfigLoadTests.HUB)
+        hub["waive"] = ["c1p2"]
+        self.write({ "spts" : { "ichub29" : hub, "ichub30" : hub } }, 2000)
+        self.assertTrue(conf.changed())
+        self.assertFalse(conf.changed())
+        conf.load(self.fname)
+        self.assertTrue(conf.isWaived("ichub29", "spts", 1, 2))
+        self.assertEqual(sorted(conf.hubs("spts")), ["ichub29", "ichub30"])
+
+        # A bad file leaves the loaded configuration alone
+        self.write({ "spts" : { "ichub29" : { "comm" : 4 } } }, 3000)
+        self.assertTrue(conf.changed())
+        self.assertRaises(hubmonitools.HubConfigException, conf.load, self.fname)
+        self.assertTrue(conf.isWaived("ichub29", "spts", 1, 2))
+        self.assertEqual(sorted(conf.hubs("spts")), ["ichub29", "ichub30"])
+
 def suite():
-    return unittest.TestLoader().loadTestsFromTestCase(HubConfigTests)
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([loader.loadTestsFromTestCase(HubConfigTests),
+                               loader.loadTestsFromTestCase(HubConfigLoadTests)])
 
 def main():
     unittest.TextTestRunner(verbosity=2).run(suite())
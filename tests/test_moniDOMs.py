@@ -111,6 +111,70 @@ class MoniDOMTests(unittest.TestCase):
         self.assertEqual(throughputRec.getDOMValue("2029-2"), 162000000)
         self.assertEqual(delta_sec, 5)
 
+    def testDeltaEncoding(self):
+        encoder = hubmonitools.MoniDeltaEncoder(keyframePeriod=3,
+                                                thresholds={"dom_pwrstat_voltage": 0.5})
+        decoder = hubmonitools.MoniDeltaDecoder()
+
+        def voltageRec():
+            recs = hubmonitools.moniRecords(self.config, self.moniDOMs, {})
+            return [r for r in recs if r["varname"] == "dom_pwrstat_voltage"][0]
+
+        # First record is a full keyframe
+        full = voltageRec()
+        enc = encoder.encode(full)
+        self.assertTrue(enc["value"]["keyframe"])
+        self.assertEqual(enc["value"]["seq"], 0)
+        self.assertEqual(len(enc["value"]["value"]), 3)
+        self.assertEqual(decoder.decode(enc)["value"]["value"], full["value"]["value"])
+
+        # Nothing changed beyond the threshold
+        self.moniDOMs['00A'].voltage += 0.2
+        enc = encoder.encode(voltageRec())
+        self.assertFalse(enc["value"]["keyframe"])
+        self.assertEqual(enc["value"]["value"], {})
+        self.assertEqual(len(decoder.decode(enc)["value"]["value"]), 3)
+
+        # One DOM changed, one disappeared
+        self.moniDOMs['00A'].voltage += 0.4
+        del self.moniDOMs['01A']
+        full = voltageRec()
+        enc = encoder.encode(full)
+        self.assertEqual(enc["value"]["value"], {"2029-2": 89.724})
+        self.assertEqual(enc["value"]["removed"], ["2029-4"])
+        self.assertEqual(enc["value"]["seq"], 2)
+        self.assertEqual(decoder.decode(enc)["value"]["value"]["2029-2"], 89.724)
+
+        # Keyframe period
+        enc = encoder.encode(voltageRec())
+        self.assertTrue(enc["value"]["keyframe"])
+        self.assertEqual(len(enc["value"]["value"]), 2)
+
+        # A gap is detected and decoding waits for the next keyframe
+        encoder.encode(voltageRec())
+        enc = encoder.encode(voltageRec())
+        self.assertEqual(decoder.decode(enc), None)
+        self.assertEqual(decoder.gaps, 1)
+        enc = encoder.encode(voltageRec())
+        self.assertTrue(enc["value"]["keyframe"])
+        self.assertEqual(decoder.decode(enc)["value"]["value"], voltageRec()["value"]["value"])
+
+        # After a known loss, the next record is a keyframe without waiting
+        # for the period
+        encoder.forceKeyframe()
+        enc = encoder.encode(voltageRec())
+        self.assertTrue(enc["value"]["keyframe"])
+        self.assertEqual(enc["value"]["seq"], 7)
+        self.assertEqual(decoder.decode(enc)["value"]["value"], voltageRec()["value"]["value"])
+        self.assertEqual(decoder.gaps, 1)
+        enc = encoder.encode(voltageRec())
+        self.assertFalse(enc["value"]["keyframe"])
+        self.assertEqual(len(decoder.decode(enc)["value"]["value"]), 2)
+
+        # Counts aren't delta-encoded
+        countRec = hubmonitools.HubMoniRecord(self.config, "dom_comstat_badpkt", True)
+        self.assertTrue(encoder.encode(countRec) is countRec)
+
     def testAlerts(self):
         alerts = hubmonitools.moniAlerts(self.config, self.dor, self.hubconfig, self.hub, self.cluster)
 
@@ -140,6 +204,79 @@ class MoniDOMTests(unittest.TestCase):
         self.assertEqual(alerts[0]["value"]["desc"],
                          "%s-%s: expected 1 DOR cards, found 2" % (self.cluster, self.hub))
 
+    def testAlertsFromSnapshot(self):
+        snapshot = self.dor.snapshot()
+        self.hubconfig[self.cluster][self.hub]["comm"] = 3
+
+        # Evaluating alerts on a snapshot doesn't touch the proc files
+        reads = []
+        readProcFile = dor.dor.readProcFile
+        listProcDir = dor.dor.listProcDir
+        def countingRead(path):
+            reads.append(path)
+            return readProcFile(path)
+        def countingList(path):
+            reads.append(path)
+            return listProcDir(path)
+        dor.dor.readProcFile = countingRead
+        dor.dor.listProcDir = countingList
+        try:
+            alerts = hubmonitools.moniAlerts(self.config, snapshot, self.hubconfig,
+                                             self.hub, self.cluster)
+        finally:
+            dor.dor.readProcFile = readProcFile
+            dor.dor.listProcDir = listProcDir
+        self.assertEqual(reads, [])
+
+        # ...and gives the same answers as the live driver
+        liveAlerts = hubmonitools.moniAlerts(self.config, self.dor, self.hubconfig,
+                                             self.hub, self.cluster)
+        self.assertEqual(len(alerts), 2)
+        self.assertEqual([a["value"]["desc"] for a in alerts],
+                         [a["value"]["desc"] for a in liveAlerts])
+
+    def testAlertsFromPartialSnapshot(self):
+        # Missing pwr_check values don't count as failures
+        readProcFile = dor.dor.readProcFile
+        def failingRead(path):
+            if path.endswith("pwr_check"):
+                raise IOError("bogus")
+            return readProcFile(path)
+        dor.dor.readProcFile = failingRead
+        try:
+            snapshot = self.dor.snapshot(timeout=1)
+        finally:
+            dor.dor.readProcFile = readProcFile
+        self.assertEqual(len(snapshot.missing), 2)
+        alerts = hubmonitools.moniAlerts(self.config, snapshot, self.hubconfig,
+                                         self.hub, self.cluster)
+        self.assertEqual(alerts, [])
+
+        # Nor do missing is-communicating values
+        def failingRead(path):
+            if path.endswith(os.path.join("card0", "pair0", "domA", "is-communicating")):
+                raise IOError("bogus")
+            return readProcFile(path)
+        dor.dor.readProcFile = failingRead
+        try:
+            snapshot = self.dor.snapshot(timeout=1)
+        finally:
+            dor.dor.readProcFile = readProcFile
+        self.assertEqual(snapshot.missing, (os.path.join("card0", "pair0", "domA",
+                                                         "is-communicating"),))
+        def countAlerts():
+            alerts = hubmonitools.moniAlerts(self.config, snapshot, self.hubconfig,
+                                             self.hub, self.cluster)
+            return [a["value"]["desc"] for a in alerts
+                    if a["value"]["condition"].endswith("unexpected number of DOMs")]
+        self.assertEqual(countAlerts(), [])
+
+        # ...unless the count is off anyway
+        self.hubconfig[self.cluster][self.hub]["comm"] = 6
+        self.assertEqual(countAlerts(),
+                         ["%s-%s: expected 6 communicating DOMs, found 3 (1 unknown)" %
+                          (self.cluster, self.hub)])
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(MoniDOMTests)
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import random
+import dor
+import hubmonitools
+from hubmonitools import P2Quantile, RunningStats, MoniStats
+
+class MoniStatsTests(unittest.TestCase):
+
+    HUBMONICONFIG = os.path.dirname(os.path.abspath(__file__))+"/hubmoni.config"
+
+    def testRunningStats(self):
+        xs = [2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0]
+        s = RunningStats()
+        for x in xs:
+            s.add(x)
+        self.assertEqual((s.n, s.min, s.max), (8, 2.0, 9.0))
+        self.assertAlmostEqual(s.mean, 5.0)
+        self.assertAlmostEqual(s.variance(), 32.0/7)
+        # (approximate)
+        self.assertTrue(4.0 <= s.summary()["p50"] <= 5.0)
+
+    def testP2Quantile(self):
+        rng = random.Random(12345)
+        xs = [rng.gauss(100, 15) for i in range(20000)]
+        ests = dict((p, P2Quantile(p)) for p in (0.5, 0.9, 0.99))
+        for x in xs:
+            for q in ests.values():
+                q.add(x)
+        xs.sort()
+        for p in ests:
+            exact = xs[int(p*(len(xs)-1))]
+            self.assertTrue(abs(ests[p].value() - exact) < 1.0,
+                            "p%g: %f vs %f" % (p, ests[p].value(), exact))
+
+    def testMoniStats(self):
+        config = hubmonitools.HubMoniConfig(MoniStatsTests.HUBMONICONFIG)
+        driver = dor.DOR(prefix=config.DOR_PREFIX)
+        stats = MoniStats()
+        samples = []
+        for i in range(4):
+            sample = {}
+            for d in driver.getCommunicatingDOMs():
+                m = hubmonitools.HubMoniDOM(d, "ichub29")
+                m.updateTime = "2026-10-17 00:00:%02d.000000" % (10*i)
+                sample[d.cwd()] = m
+            # A burst of bad packets in one interval only
+            if i >= 2:
+                sample['01A'].comstat.badpkt += 50
+            sample['00A'].current += i
+            stats.add(sample)
+            samples.append(sample)
+
+        cur = stats.get('00A', 'current')
+        self.assertEqual((cur.n, cur.min, cur.max), (4, 99, 102))
+        bad = stats.get('01A', 'badpkt')
+        self.assertEqual(bad.n, 3)
+        self.assertEqual(bad.max, 5.0)
+        self.assertEqual(bad.min, 0.0)
+
+        # Published with the records
+        recs = hubmonitools.moniRecords(config, samples[-1], samples[0], stats)
+        badpktRec = [r for r in recs if r["varname"] == "dom_comstat_badpkt"][0]
+        self.assertEqual(badpktRec.getDOMValue("2029-4"), 50)
+        self.assertEqual(badpktRec["value"]["stats"]["2029-4"]["max"], 5.0)
+        cabling = [r for r in recs if r["varname"] == "dom_cabling"][0]
+        self.assertTrue("stats" not in cabling["value"])
+
+        # Not without a MoniStats
+        recs = hubmonitools.moniRecords(config, samples[-1], samples[0])
+        self.assertTrue(all("stats" not in r["value"] for r in recs))
+
+        # Rates carry over into the next window
+        stats.reset()
+        self.assertEqual(stats.get('00A', 'current'), None)
+        stats.add(samples[0])
+        self.assertEqual(stats.get('01A', 'badpkt'), None)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(MoniStatsTests)
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 import unittest
 import os
+import shutil
+import tempfile
+import json
+import pickle
 import nicknames
 
 class NicknamesTests(unittest.TestCase):
@@ -31,12 +35,87 @@ class NicknamesTests(unittest.TestCase):
                         (self.nicks.findMBID('UL9P6630') == '778fa3a8e2bf') and
                         (self.nicks.findMBID('garbage') == None))
 
-    def testException(self):
+    def testFindMBIDVariants(self):
+        self.assertEqual(self.nicks.findMBID('84-27'), '778fa3a8e2bf')
+        self.assertEqual(self.nicks.findMBID('albino_shouting_gorilla'), '778fa3a8e2bf')
+        self.assertEqual(self.nicks.findMBID('ul9p6630'), '778fa3a8e2bf')
+        self.assertEqual(self.nicks.findMBID('778FA3A8E2BF'), '778fa3a8e2bf')
+        self.assertEqual(self.nicks.findMBID((65, 40)), '49df544c6bb6')
+        self.assertEqual(self.nicks.findMBID(['unhashable']), None)
+
+    def testResolve(self):
+        self.assertEqual(self.nicks.resolve(['Albino_Shouting_Gorilla', 'garbage', '65-40']),
+                         ['778fa3a8e2bf', None, '49df544c6bb6'])
+        self.assertEqual(self.nicks.resolve([]), [])
+
+    def testLazyLoad(self):
+        nicks = nicknames.Nicknames(nicknameFile=NicknamesTests.PREFIX+"nicknames.txt")
+        self.assertTrue('nameDict' not in nicks.__dict__)
+        self.assertEqual(nicks.getDOMName('778fa3a8e2bf'), "Albino_Shouting_Gorilla")
+        self.assertTrue(('nameDict' in nicks.__dict__) and ('index' not in nicks.__dict__))
+
+    def testCache(self):
+        tmpdir = tempfile.mkdtemp()
         try:
-            bogus = nicknames.Nicknames(nicknameFile="bogus.txt")
-        except nicknames.NicknamesException:
-            return
-        self.fail()
+            fname = os.path.join(tmpdir, "nicknames.txt")
+            shutil.copy(NicknamesTests.PREFIX+"nicknames.txt", fname)
+            nicks = nicknames.Nicknames(nicknameFile=fname)
+            self.assertEqual(nicks.findMBID('Aardvark'), '33186a0ca57f')
+            self.assertTrue(os.path.isfile(fname+nicknames.nicknames.CACHE_SUFFIX))
+
+            # Loaded from the cache, which is plain JSON
+            with open(fname+nicknames.nicknames.CACHE_SUFFIX) as f:
+                self.assertTrue("name" in json.load(f))
+            nicks = nicknames.Nicknames(nicknameFile=fname)
+            self.assertEqual(nicks.getDOMID('33186a0ca57f'), 'UP4P0222')
+            self.assertTrue(isinstance(nicks.getDOMPosition('33186a0ca57f'), tuple))
+            self.assertEqual(nicks.findMBID(nicks.getDOMPosition('33186a0ca57f')),
+                             '33186a0ca57f')
+
+            # Anything else in its place is ignored and replaced
+            with open(fname+nicknames.nicknames.CACHE_SUFFIX, "wb") as f:
+                pickle.dump("bogus", f)
+            nicks = nicknames.Nicknames(nicknameFile=fname)
+            self.assertEqual(nicks.getDOMID('33186a0ca57f'), 'UP4P0222')
+            with open(fname+nicknames.nicknames.CACHE_SUFFIX) as f:
+                self.assertTrue("name" in json.load(f))
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ["nicknames.txt", "nicknames.txt.cache"])
+
+            # Cache is rebuilt when the text file changes
+            with open(fname) as f:
+                txt = f.read()
+            with open(fname, "w") as f:
+                f.write(txt.replace("Aardvark\t", "Aardwolf\t"))
+            st = os.stat(fname)
+            os.utime(fname, (st.st_atime, st.st_mtime+10))
+            nicks = nicknames.Nicknames(nicknameFile=fname)
+            self.assertEqual(nicks.getDOMName('33186a0ca57f'), 'Aardwolf')
+            self.assertEqual(nicks.findMBID('Aardvark'), None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testLookupOrder(self):
+        # The first DOM in the file matching anything wins, except that
+        # MBIDs always map to themselves
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, "nicknames.txt")
+            with open(fname, "w") as f:
+                f.write("mbid\tprod_id\tname\tloc\tdesc\n"
+                        "000000000001\tUP4P0001\tFoo\t01-01\t-\n"
+                        "000000000002\tUP4P0002\tUP4P0001\t01-02\t-\n"
+                        "000000000003\t000000000001\t1-2\t01-03\t-\n")
+            nicks = nicknames.Nicknames(nicknameFile=fname)
+            self.assertEqual(nicks.findMBID('UP4P0001'), '000000000001')
+            self.assertEqual(nicks.findMBID('000000000001'), '000000000001')
+            self.assertEqual(nicks.findMBID('1-2'), '000000000002')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testException(self):
+        self.assertRaises(nicknames.NicknamesException, nicknames.Nicknames,
+                          nicknameFile="bogus.txt")
 
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(NicknamesTests)
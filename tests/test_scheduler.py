@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import unittest
+import logging
+import hubmonitools
+
+class FakeClock:
+    """Manually-advanced clock; sleeping just moves time forward"""
+    def __init__(self, t=1000.0):
+        self.t = t
+        self.slept = []
+
+    def __call__(self):
+        return self.t
+
+    def sleep(self, dt):
+        self.slept.append(dt)
+        self.t += dt
+
+class SchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.logger = logging.getLogger('testScheduler')
+        self.sched = hubmonitools.Scheduler(clock=self.clock, sleep=self.clock.sleep,
+                                            logger=self.logger)
+        self.sched.add("sample", 1)
+        self.sched.add("report", 2, offset=2)
+
+    def testOrder(self):
+        # Same tick sequence as the hubmoni test configuration
+        ticks = []
+        for i in range(5):
+            due = self.sched.wait()
+            ticks.append((self.clock() - 1000.0, due))
+        self.assertEqual(ticks, [(0.0, ["sample"]),
+                                 (1.0, ["sample"]),
+                                 (2.0, ["sample", "report"]),
+                                 (3.0, ["sample"]),
+                                 (4.0, ["sample", "report"])])
+
+    def testNoDrift(self):
+        # Work done in each cycle doesn't push out later ticks
+        times = []
+        for i in range(10):
+            self.sched.wait()
+            times.append(self.clock() - 1000.0)
+            self.clock.t += 0.3
+        self.assertEqual(times[-1], 9.0)
+        self.assertEqual(self.sched["sample"].overruns, 0)
+
+    def testOverrun(self):
+        self.sched.wait()
+        # Stall for several periods; missed ticks are skipped, not queued
+        self.clock.t += 3.5
+        self.assertEqual(self.sched.wait(), ["sample", "report"])
+        t = self.sched["sample"]
+        self.assertEqual(t.overruns, 2)
+        self.assertAlmostEqual(t.maxLateness, 2.5)
+        self.assertEqual(self.sched["report"].overruns, 0)
+        # Back in phase on the next tick
+        self.sched.wait()
+        self.assertEqual(self.clock() - 1000.0, 4.0)
+
+    def testLateTick(self):
+        self.sched.lateTolerance = 0.1
+        self.sched.wait()
+        self.clock.t += 1.5
+        self.sched.wait()
+        self.assertEqual(self.sched["sample"].late, 1)
+        self.assertEqual(self.sched["sample"].overruns, 0)
+
+    def testBadPeriod(self):
+        self.assertRaises(ValueError, self.sched.add, "bad", 0)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(SchedulerTests)
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
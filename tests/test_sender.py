@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import unittest
+import json
+import time
+import shutil
+import tempfile
+import zmq
+from hubmonitools.sender import MoniSender, encode, decode
+from hubmonitools.spool import Spool
+
+PORT = 56669
+ADDR = "tcp://localhost:%d" % PORT
+
+class Listener:
+    """Stand-in for the LiveControl ZMQ listener that can be started and
+    stopped under a running sender"""
+    def __init__(self, port=PORT):
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PULL)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind("tcp://*:%d" % port)
+
+    def receive(self, n, timeout=5.0):
+        data = []
+        deadline = time.time() + timeout
+        while (len(data) < n) and (time.time() < deadline):
+            if self.socket.poll(100):
+                data.append(json.loads(self.socket.recv()))
+        return data
+
+    def close(self):
+        self.socket.close()
+
+def record(i):
+    return {"service": "hubmoni", "varname": "dom_pwrstat_voltage", "value": i}
+
+def alert(i):
+    return {"service": "hubmoni", "varname": "alert", "value": i}
+
+class MoniSenderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = None
+        self.sender = MoniSender(ADDR, maxRecords=5, maxAlerts=3,
+                                 minBackoff=0.05, maxBackoff=0.2)
+        self.sender.start()
+
+    def tearDown(self):
+        self.sender.stop(timeout=1)
+        if self.listener is not None:
+            self.listener.close()
+
+    def testSend(self):
+        self.listener = Listener()
+        self.sender.sendRecord(record(0))
+        self.sender.sendAlert(alert(0))
+        self.assertTrue(self.sender.flush(timeout=5))
+        data = self.listener.receive(2)
+        self.assertEqual(sorted(d["varname"] for d in data),
+                         ["alert", "dom_pwrstat_voltage"])
+
+    def testNoListener(self):
+        # Queueing never blocks, even with nobody listening
+        t0 = time.time()
+        for i in range(100):
+            self.sender.sendRecord(record(i))
+        self.assertTrue(time.time() - t0 < 0.5)
+        self.assertFalse(self.sender.flush(timeout=0.5))
+        self.assertEqual(self.sender.sent, 0)
+        self.assertTrue(self.sender.failures > 0)
+
+    def testDropPolicy(self):
+        # Fill the queues before the thread starts, so nothing's in flight
+        self.sender.stop(timeout=1)
+        self.sender = MoniSender(ADDR, maxRecords=5, maxAlerts=3,
+                                 minBackoff=0.05, maxBackoff=0.2)
+        for i in range(8):
+            self.assertEqual(self.sender.sendRecord(record(i)), i < 5)
+        for i in range(4):
+            self.assertEqual(self.sender.sendAlert(alert(i)), i < 3)
+        self.assertEqual(self.sender.droppedRecords, 3)
+        self.assertEqual(self.sender.droppedAlerts, 1)
+
+        # Alerts go first, then the newest records
+        self.listener = Listener()
+        self.sender.start()
+        data = self.listener.receive(8)
+        self.assertEqual([d["varname"] for d in data[:3]], ["alert"]*3)
+        self.assertEqual([d["value"] for d in data[:3]], [1, 2, 3])
+        self.assertEqual([d["value"] for d in data[3:]], [3, 4, 5, 6, 7])
+
+    def testReconnect(self):
+        self.listener = Listener()
+        self.sender.sendRecord(record(0))
+        self.assertEqual(len(self.listener.receive(1)), 1)
+
+        # Listener goes away; records wait in the queue
+        self.listener.close()
+        self.listener = None
+        time.sleep(0.2)
+        for i in range(1, 4):
+            self.sender.sendRecord(record(i))
+        time.sleep(0.5)
+
+        # ...and are delivered once it comes back
+        self.listener = Listener()
+        data = self.listener.receive(3)
+        self.assertEqual([d["value"] for d in data], [1, 2, 3])
+        self.assertTrue(self.sender.flush(timeout=5))
+
+    def testSpool(self):
+        tmpdir = tempfile.mkdtemp()
+        self.sender.stop(timeout=1)
+        try:
+            self.sender = MoniSender(ADDR, minBackoff=0.05, maxBackoff=0.2,
+                                     spool=Spool(tmpdir), replayRate=100)
+            self.sender.start()
+            # Nobody listening; everything ends up in the spool
+            for i in range(5):
+                self.sender.sendRecord(record(i))
+            self.sender.sendAlert(alert(0))
+            time.sleep(0.5)
+            self.assertEqual(self.sender.sent, 0)
+            self.assertFalse(self.sender.flush(timeout=0.1))
+            # Synced by the sender thread, with no more appends
+            self.sender.spool.lastSync -= self.sender.spool.syncInterval
+            time.sleep(0.5)
+            self.assertFalse(self.sender.spool.dirty)
+
+            # Replayed in order once the listener is back, then new ones
+            self.listener = Listener()
+            self.sender.sendRecord(record(5))
+            data = self.listener.receive(7)
+            self.assertEqual([d["value"] for d in data if d["varname"] != "alert"],
+                             [0, 1, 2, 3, 4, 5])
+            self.assertEqual(len([d for d in data if d["varname"] == "alert"]), 1)
+            self.assertTrue(self.sender.flush(timeout=5))
+        finally:
+            self.sender.stop(timeout=1)
+            shutil.rmtree(tmpdir)
+
+class BatchEncodingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.recs = []
+        for i in range(7):
+            r = record(i)
+            r["varname"] = "dom_comstat_%d" % i
+            r["prio"] = 3
+            r["time"] = "2026-10-17 00:00:00.000000"
+            self.recs.append(r)
+
+    def testSingle(self):
+        self.assertEqual(decode(encode(self.recs[0])), [self.recs[0]])
+        self.assertEqual(decode(encode(self.recs[0], compress=True)), [self.recs[0]])
+
+    def testBatch(self):
+        buf = encode(self.recs)
+        self.assertEqual(decode(buf), self.recs)
+        # Common headers are stored once
+        self.assertEqual(buf.count(b"2026-10-17"), 1)
+        self.assertTrue(len(buf) < sum(len(encode(r)) for r in self.recs))
+
+    def testBatchMixedHeaders(self):
+        self.recs[3]["prio"] = 1
+        self.assertEqual(decode(encode(self.recs)), self.recs)
+
+    def testCompressed(self):
+        buf = encode(self.recs, compress=True)
+        self.assertEqual(decode(buf), self.recs)
+        self.assertTrue(len(buf) < len(encode(self.recs)))
+
+    def testSendBatch(self):
+        sender = MoniSender(ADDR, minBackoff=0.05, maxBackoff=0.2, compress=True)
+        sender.start()
+        listener = Listener()
+        try:
+            sender.sendBatch(self.recs)
+            self.assertTrue(listener.socket.poll(5000))
+            buf = listener.socket.recv()
+            self.assertEqual(decode(buf), self.recs)
+            self.assertTrue(sender.flush(timeout=5))
+            self.assertEqual(sender.sent, 1)
+            self.assertEqual(sender.sentBytes, len(buf))
+        finally:
+            sender.stop(timeout=1)
+            listener.close()
+
+def suite():
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([loader.loadTestsFromTestCase(MoniSenderTests),
+                               loader.loadTestsFromTestCase(BatchEncodingTests)])
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+import socket
+import stat
+import dor
+from hubmonitools.snapshotServer import SnapshotServer, SnapshotClient, QueryException
+from hubmonitools.snapshotServer import encodeSnapshot, decodeSnapshot
+
+class FakeDriver(object):
+    """Stands in for the DOM state probe, counting the DOMs probed"""
+    def __init__(self):
+        self.probed = []
+
+    def getDOMStates(self, doms, maxAge=None):
+        self.probed.extend(d.cwd() for d in doms)
+        return dict((d.cwd(), d.isCommunicating() and "domapp" or "nocomm") for d in doms)
+
+    def refresh(self):
+        return False
+
+class SnapshotServerTests(unittest.TestCase):
+
+    PREFIX = os.path.dirname(os.path.abspath(__file__))+"/ichub29_proc"
+
+    def setUp(self):
+        self.dor = dor.DOR(SnapshotServerTests.PREFIX)
+        self.snapshot = self.dor.snapshot()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "hubmoni.sock")
+        self.driver = FakeDriver()
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.stop(timeout=2)
+        shutil.rmtree(self.dir)
+
+    def start(self, **kwargs):
+        self.server = SnapshotServer(self.path, driver=self.driver, **kwargs)
+        self.server.start()
+        return SnapshotClient(self.path, timeout=2)
+
+    def assertSameSnapshot(self, a, b):
+        self.assertEqual(a.time, b.time)
+        self.assertEqual([d.cwd() for d in a.getAllDOMs()], [d.cwd() for d in b.getAllDOMs()])
+        for da, db in zip(a.getAllDOMs(), b.getAllDOMs()):
+            self.assertEqual((da.isCommunicating(), da.isNotConfigboot(), da.mbid(),
+                              da.pair.isPlugged(), da.pair.current(), da.pair.voltage(),
+                              da.pair.card.serial(), da.name(), da.omkey()),
+                             (db.isCommunicating(), db.isNotConfigboot(), db.mbid(),
+                              db.pair.isPlugged(), db.pair.current(), db.pair.voltage(),
+                              db.pair.card.serial(), db.name(), db.omkey()))
+            if da.commStats() is not None:
+                self.assertEqual(da.commStats().counters(), db.commStats().counters())
+            if da.pair.pwrCheck() is not None:
+                self.assertEqual(da.pair.pwrCheck().text, db.pair.pwrCheck().text)
+
+    def testEncoding(self):
+        snap = decodeSnapshot(encodeSnapshot(self.snapshot), self.dor.nicks)
+        self.assertSameSnapshot(snap, self.snapshot)
+
+    def testSnapshot(self):
+        # No server, or nothing published yet
+        client = SnapshotClient(self.path, timeout=2)
+        self.assertRaises(QueryException, client.snapshot)
+        client = self.start()
+        self.assertRaises(QueryException, client.snapshot)
+
+        self.server.publish(self.snapshot)
+        snap, age = client.snapshot()
+        self.assertTrue(0 <= age < 5)
+        self.assertSameSnapshot(snap, self.snapshot)
+        self.assertEqual(len(snap.getCommunicatingDOMs()), 4)
+
+        self.server.stop(timeout=2)
+        self.assertFalse(self.server.is_alive())
+        self.assertFalse(os.path.exists(self.path))
+        self.server = None
+        self.assertRaises(QueryException, client.snapshot)
+
+    def testStates(self):
+        client = self.start(stateCacheTime=60)
+        self.server.publish(self.snapshot)
+        states = client.states()
+        self.assertEqual(states, { '00A' : 'domapp', '00B' : 'domapp',
+                                   '01A' : 'domapp', '01B' : 'domapp' })
+        self.assertEqual(len(self.driver.probed), 4)
+
+        # Cached states aren't probed again, unless they're too old
+        del self.driver.probed[:]
+        self.assertEqual(client.states(['00A', '10A', '77B']),
+                         { '00A' : 'domapp', '10A' : 'nocomm', '77B' : 'noplug' })
+        self.assertEqual(self.driver.probed, ['10A'])
+        del self.driver.probed[:]
+        client.states(['00A'], maxAge=0)
+        self.assertEqual(self.driver.probed, [])
+        self.server.minStateAge = 0
+        client.states(['00A'], maxAge=0)
+        self.assertEqual(self.driver.probed, ['00A'])
+
+    def testNewDOMs(self):
+        # The server's driver picks up DOMs that appeared after it was built
+        prefix = os.path.join(self.dir, "domhub")
+        shutil.copytree(SnapshotServerTests.PREFIX, prefix)
+        shutil.rmtree(os.path.join(prefix, "card1"))
+        self.driver = dor.DOR(prefix)
+        self.assertEqual(self.driver.getDOM('10A'), None)
+        client = self.start()
+        shutil.copytree(os.path.join(SnapshotServerTests.PREFIX, "card1"),
+                        os.path.join(prefix, "card1"))
+        self.server.publish(dor.DOR(prefix).snapshot())
+        self.assertEqual(client.states(['10A', '11B']), { '10A' : "nocomm", '11B' : "nocomm" })
+
+        # DOMs the driver can't find are skipped
+        self.assertEqual(self.driver.getDOMStates([self.snapshot.getDOM('10A')]),
+                         { '10A' : "nocomm" })
+        shutil.rmtree(os.path.join(prefix, "card1"))
+        self.driver.invalidate()
+        self.assertEqual(self.driver.getDOMStates([self.snapshot.getDOM('10A')]), {})
+
+    def testSocketPath(self):
+        # The socket's directory is created private, and the socket too
+        self.path = os.path.join(self.dir, "private", "query.sock")
+        client = self.start()
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode), 0o700)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        # A socket in use isn't taken over
+        self.assertRaises(EnvironmentError, SnapshotServer, self.path)
+        self.server.publish(self.snapshot)
+        client.snapshot()
+
+        # A stale one is
+        self.server.stop(timeout=2)
+        self.server = None
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.start()
+
+        # Anything else is left alone
+        self.server.stop(timeout=2)
+        self.server = None
+        with open(self.path, "w") as f:
+            f.write("precious\n")
+        self.assertRaises(EnvironmentError, SnapshotServer, self.path)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "precious\n")
+
+    def testSilentClient(self):
+        client = self.start(connectionTime=1)
+        self.server.publish(self.snapshot)
+        silent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            silent.connect(self.path)
+            # Other clients are answered meanwhile
+            snap, age = client.snapshot()
+            self.assertEqual(len(snap.getCommunicatingDOMs()), 4)
+            # and the silent one is dropped when its time is up
+            silent.settimeout(3)
+            self.assertEqual(silent.recv(1), b"")
+        finally:
+            silent.close()
+
+    def testBadRequest(self):
+        client = self.start()
+        self.assertRaises(QueryException, client.request, { "req" : "bogus" })
+        self.assertRaises(QueryException, client.request, [])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(SnapshotServerTests)
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()
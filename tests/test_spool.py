@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+import hubmonitools.spool
+from hubmonitools.spool import Spool, ALERT, RECORD
+
+class SpoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dir = os.path.join(self.tmpdir, "spool")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def drain(self, spool):
+        msgs = []
+        entry = spool.peek()
+        while entry is not None:
+            msgs.append(entry)
+            spool.ack()
+            entry = spool.peek()
+        return msgs
+
+    def testAppendReplay(self):
+        spool = Spool(self.dir)
+        self.assertFalse(spool.pending())
+        spool.append(RECORD, b"rec0")
+        spool.append(ALERT, b"alert0")
+        spool.append(RECORD, b"rec1")
+        self.assertEqual(list(spool), [(RECORD, b"rec0"), (ALERT, b"alert0"), (RECORD, b"rec1")])
+
+        # peek() without ack() doesn't consume
+        self.assertEqual(spool.peek(), (RECORD, b"rec0"))
+        self.assertEqual(spool.peek(), (RECORD, b"rec0"))
+        spool.ack()
+        self.assertEqual(self.drain(spool), [(ALERT, b"alert0"), (RECORD, b"rec1")])
+        self.assertFalse(spool.pending())
+        spool.close()
+
+    def testPersistence(self):
+        spool = Spool(self.dir, syncInterval=1000)
+        for i in range(5):
+            spool.append(RECORD, ("rec%d" % i).encode())
+        spool.peek()
+        spool.ack()
+        spool.close()
+
+        # Replay picks up where it left off, and new entries go after
+        spool = Spool(self.dir)
+        spool.append(RECORD, b"rec5")
+        self.assertEqual([b for k, b in self.drain(spool)],
+                         [b"rec1", b"rec2", b"rec3", b"rec4", b"rec5"])
+        spool.close()
+
+        spool = Spool(self.dir)
+        self.assertFalse(spool.pending())
+        spool.close()
+
+    def testAppendFlushed(self):
+        # Entries reach the file at once, and are synced once the interval
+        # has passed even if nothing else is appended
+        spool = Spool(self.dir, syncInterval=0.1)
+        for i in range(7):
+            spool.append(RECORD, ("rec%d" % i).encode())
+        self.assertEqual(os.path.getsize(spool.path(spool.segments[-1][0])),
+                         spool.segments[-1][1])
+        self.assertTrue(spool.dirty)
+        spool.maybeSync()
+        self.assertTrue(spool.dirty)
+        spool.lastSync -= 1
+        spool.maybeSync()
+        self.assertFalse(spool.dirty or spool.moved)
+        spool.close()
+
+    def testTornEntry(self):
+        spool = Spool(self.dir)
+        spool.append(RECORD, b"rec0")
+        spool.append(RECORD, b"rec1")
+        spool.close()
+        # Simulate a crash in the middle of the last write
+        seg = sorted(f for f in os.listdir(self.dir) if f.startswith("spool."))[-1]
+        with open(os.path.join(self.dir, seg), "ab") as f:
+            f.write(b"\x00\x00\x01\x00R partial")
+
+        spool = Spool(self.dir)
+        spool.append(RECORD, b"rec2")
+        self.assertEqual([b for k, b in self.drain(spool)], [b"rec0", b"rec1", b"rec2"])
+        spool.close()
+
+    def testSizeCap(self):
+        spool = Spool(self.dir, maxBytes=10000, segmentBytes=1000)
+        for i in range(100):
+            spool.append(RECORD, ("%03d" % i).encode()*100)
+        self.assertTrue(spool.size() <= 10000)
+        self.assertTrue(spool.dropped > 0)
+        msgs = [b for k, b in self.drain(spool)]
+        # The newest entries survive, in order
+        self.assertEqual(len(msgs) + spool.dropped, 100)
+        self.assertEqual(msgs[-1], b"099"*100)
+        self.assertEqual(msgs, sorted(msgs))
+        spool.close()
+
+    def testInspect(self):
+        # Opening a spool just to look at it leaves no empty segments
+        def segments():
+            return sorted(f for f in os.listdir(self.dir) if f.startswith("spool."))
+        spool = Spool(self.dir)
+        spool.close()
+        self.assertEqual(segments(), [])
+        spool = Spool(self.dir)
+        spool.append(RECORD, b"rec0")
+        spool.close()
+        for i in range(3):
+            spool = Spool(self.dir)
+            self.assertEqual(list(spool), [(RECORD, b"rec0")])
+            spool.close()
+        self.assertEqual(segments(), ["spool.00000000"])
+
+        spool = Spool(self.dir)
+        spool.append(RECORD, b"rec1")
+        self.assertEqual(segments(), ["spool.00000000", "spool.00000001"])
+        self.assertEqual([b for k, b in self.drain(spool)], [b"rec0", b"rec1"])
+        spool.close()
+
+    def testLocked(self):
+        spool = Spool(self.dir)
+        self.assertRaises(hubmonitools.spool.SpoolLockedException, Spool, self.dir)
+        spool.close()
+        Spool(self.dir).close()
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(SpoolTests)
+
+def main():
+    unittest.TextTestRunner(verbosity=2).run(suite())
+
+if __name__ == '__main__':
+    main()